@@ -0,0 +1,114 @@
+"""
+Microbenchmark for the compiled model codecs against the original reflective to_dict / from_dict
+
+Usage: python benchmark_codec.py [iterations]
+"""
+
+import sys
+import timeit
+from enum import Enum
+from models import *
+
+def legacy_to_dict(obj):
+    """Original reflective to_dict implementation"""
+    if hasattr(obj, '__dict__'):
+        result = {}
+        for key, value in obj.__dict__.items():
+            if isinstance(value, Enum):
+                result[key] = value.value
+            elif isinstance(value, list):
+                result[key] = [legacy_to_dict(item) if hasattr(item, '__dict__') else item for item in value]
+            elif hasattr(value, '__dict__'):
+                result[key] = legacy_to_dict(value)
+            else:
+                result[key] = value
+        return result
+    return obj
+
+def legacy_from_dict(data_class, data):
+    """Original reflective from_dict implementation (top-level enums only, mutates its input)"""
+    if not isinstance(data, dict):
+        return data
+    
+    field_types = getattr(data_class, '__annotations__', {})
+    for field_name, field_type in field_types.items():
+        if field_name in data and hasattr(field_type, '__origin__'):
+            if hasattr(field_type, '__args__') and type(None) in field_type.__args__:
+                field_type = field_type.__args__[0]
+        
+        if field_name in data and issubclass(field_type, Enum):
+            data[field_name] = field_type(data[field_name])
+    
+    return data_class(**data)
+
+def build_samples():
+    """Representative objects exchanged between the orchestrators and activities"""
+    conversation_request = ConversationRequest(
+        user_id="user123",
+        message="Help me create a workflow for customer approval process",
+        conversation_id="conversation-123",
+        context={"channel": "teams", "locale": "en-US"},
+        routing_preference=AgentRoutingPreference.AUTO
+    )
+    agent_response = AgentResponse(
+        message="Your approval workflow has been created.",
+        agent_type="CopilotStudio",
+        agent_id="bot-123",
+        conversation_id="conversation-123",
+        context={"workflowId": "wf-1", "approvers": ["a", "b"]},
+        requires_follow_up=True,
+        next_action="escalate"
+    )
+    routing_decision = AgentRoutingDecision(
+        selected_agent=AgentType.COPILOT_STUDIO,
+        reason="Message contains 2 Copilot Studio keywords indicating structured process",
+        confidence=0.8
+    )
+    multi_agent_request = MultiAgentRequest(
+        task_description="Develop a comprehensive customer onboarding strategy",
+        required_capabilities=[
+            AgentCapability("process_design", "Design customer onboarding workflows", [AgentType.COPILOT_STUDIO]),
+            AgentCapability("data_analysis", "Analyze customer behavior patterns", [AgentType.AZURE_AI]),
+            AgentCapability("automation", "Create automated notification systems", [AgentType.POWER_AUTOMATE])
+        ],
+        user_id="user123"
+    )
+    return [conversation_request, agent_response, routing_decision, multi_agent_request]
+
+def bench(label, func, iterations):
+    seconds = min(timeit.repeat(func, number=iterations, repeat=5))
+    per_call = seconds / iterations * 1e6
+    print(f"  {label:<10} {per_call:8.2f} us/object")
+    return per_call
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f"Model codec microbenchmark ({iterations} iterations, best of 5)")
+    
+    for sample in build_samples():
+        data_class = type(sample)
+        encoded = to_dict(sample)
+        assert from_dict(data_class, dict(encoded)) == sample
+        
+        print(f"\n{data_class.__name__}")
+        print(" encode")
+        legacy = bench("legacy", lambda: legacy_to_dict(sample), iterations)
+        compiled = bench("compiled", lambda: to_dict(sample), iterations)
+        print(f"  speedup    {legacy / compiled:8.2f}x")
+        
+        print(" decode")
+        # The legacy decoder mutates its input, so both sides pay for a shallow copy
+        compiled = bench("compiled", lambda: from_dict(data_class, dict(encoded)), iterations)
+        
+        # The legacy decoder raises on dict and list annotations, so time it without those fields
+        reduced = {key: value for key, value in encoded.items() if not isinstance(value, (dict, list))}
+        try:
+            legacy_from_dict(data_class, dict(reduced))
+        except Exception as ex:
+            print(f"  legacy     fails: {ex}")
+            continue
+        legacy = bench("legacy*", lambda: legacy_from_dict(data_class, dict(reduced)), iterations)
+        print(f"  speedup    {legacy / compiled:8.2f}x  (* legacy skips {len(encoded) - len(reduced)} dict/list field(s))")
+
+if __name__ == "__main__":
+    main()
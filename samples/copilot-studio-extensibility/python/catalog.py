@@ -0,0 +1,169 @@
+"""
+Local catalog of Copilot Studio bots, topics and environment metadata
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+from models import TopicStatus
+from services import PacCliService, PowerPlatformGraphService
+
+logger = logging.getLogger(__name__)
+
+ENVIRONMENT_PATH = "/api/environments/current"
+TOPICS_PATH = "/api/botmanagement/v1/bots/{bot_id}/topics"
+
+class CatalogCache:
+    """In-memory index of bots, topics and environment info, refreshed in the background with conditional requests"""
+    
+    def __init__(self, power_platform_service: PowerPlatformGraphService, pac_service: PacCliService,
+                 refresh_interval: float = 300.0):
+        self.power_platform_service = power_platform_service
+        self.pac_service = pac_service
+        self.refresh_interval = refresh_interval
+        self.environment: Dict[str, Any] = {}
+        self.loaded_at: Optional[float] = None
+        self.refreshes = 0
+        self.not_modified = 0
+        self.changed = 0
+        self.refresh_failures = 0
+        self.topic_hits = 0
+        self.topic_misses = 0
+        self._bots: Dict[str, Dict[str, Any]] = {}
+        self._topics: Dict[str, Dict[str, TopicStatus]] = {}
+        self._validators: Dict[str, Dict[str, str]] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+    
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the catalog has been loaded at least once"""
+        return self.loaded_at is not None
+    
+    async def start(self) -> None:
+        """Load the catalog and keep refreshing it in the background on the current event loop"""
+        try:
+            await self.refresh()
+        except Exception as ex:
+            self.refresh_failures += 1
+            logger.warning(f"Initial catalog load failed, activities will use the network until a refresh succeeds: {ex}")
+        
+        if self.refresh_interval > 0 and self._refresh_task is None:
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_periodically())
+    
+    async def stop(self) -> None:
+        """Stop the background refresh"""
+        task, self._refresh_task = self._refresh_task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    
+    async def refresh(self) -> None:
+        """Refresh the environment, the bot list and the topics of every bot, skipping resources that did not change"""
+        # Raises when PAC CLI fails, so a failed listing keeps the previous catalog instead of emptying it
+        listed_bots = await self.pac_service.fetch_copilot_studio_bots()
+        
+        environment = await self._fetch_if_modified("environment", ENVIRONMENT_PATH, "environment")
+        if environment is not None:
+            pac_info = await self.pac_service.get_environment_info()
+            if pac_info:
+                environment["pacCliInfo"] = pac_info
+            self.environment = environment
+        
+        bots = {}
+        for bot in listed_bots:
+            bot_id = self._bot_id(bot)
+            if bot_id:
+                bots[bot_id] = bot
+        
+        for bot_id in set(self._bots) - set(bots):
+            self._topics.pop(bot_id, None)
+            self._validators.pop(f"topics:{bot_id}", None)
+        self._bots = bots
+        
+        results = await asyncio.gather(
+            *[self._fetch_if_modified(f"topics:{bot_id}", TOPICS_PATH.format(bot_id=bot_id), "copilot_studio_topics") for bot_id in bots],
+            return_exceptions=True)
+        for bot_id, result in zip(bots, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to refresh topics for bot {bot_id}: {result}")
+            elif result is not None:
+                self._topics[bot_id] = {
+                    topic.topic_id: topic for topic in self.power_platform_service.parse_topics(result)}
+        
+        self.refreshes += 1
+        self.loaded_at = time.time()
+        logger.info(f"Catalog refreshed: {len(self._bots)} bots, {sum(len(t) for t in self._topics.values())} topics")
+    
+    def get_bot(self, bot_id: str) -> Optional[Dict[str, Any]]:
+        """Look up a bot by id"""
+        return self._bots.get(bot_id)
+    
+    def list_bots(self) -> List[Dict[str, Any]]:
+        """Return every bot in the catalog"""
+        return list(self._bots.values())
+    
+    def get_topic(self, bot_id: str, topic_id: str) -> Optional[TopicStatus]:
+        """Look up a topic by bot and topic id"""
+        return self._topics.get(bot_id, {}).get(topic_id)
+    
+    def get_topics(self, bot_id: str) -> List[TopicStatus]:
+        """Return the topics of a bot"""
+        return list(self._topics.get(bot_id, {}).values())
+    
+    async def get_copilot_studio_topics(self, bot_id: str) -> List[TopicStatus]:
+        """Return the topics of a bot from the catalog, fetching them when the bot is not in it"""
+        topics = self._topics.get(bot_id)
+        if topics is not None:
+            self.topic_hits += 1
+            return list(topics.values())
+        self.topic_misses += 1
+        return await self.power_platform_service.get_copilot_studio_topics(bot_id)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current counters"""
+        return {
+            "loaded": self.is_loaded,
+            "age": time.time() - self.loaded_at if self.is_loaded else None,
+            "bots": len(self._bots),
+            "topics": sum(len(topics) for topics in self._topics.values()),
+            "refreshes": self.refreshes,
+            "notModified": self.not_modified,
+            "changed": self.changed,
+            "refreshFailures": self.refresh_failures,
+            "topicHits": self.topic_hits,
+            "topicMisses": self.topic_misses
+        }
+    
+    async def _fetch_if_modified(self, key: str, path: str, endpoint: str) -> Optional[Dict[str, Any]]:
+        """Fetch a resource unless it is unchanged since the last fetch, returning None when it is unchanged"""
+        validators = self._validators.get(key, {})
+        status, data, response_validators = await self.power_platform_service.get_json_if_modified(
+            path, validators.get("ETag"), validators.get("Last-Modified"), endpoint)
+        
+        if status == 304:
+            self.not_modified += 1
+            return None
+        if status != 200:
+            raise RuntimeError(f"HTTP {status} fetching {path}")
+        
+        self.changed += 1
+        self._validators[key] = response_validators
+        return data
+    
+    async def _refresh_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as ex:
+                self.refresh_failures += 1
+                logger.warning(f"Catalog refresh failed, serving the previous catalog: {ex}")
+    
+    @staticmethod
+    def _bot_id(bot: Dict[str, Any]) -> Optional[str]:
+        # PAC CLI output field names vary between versions
+        for name in ("botId", "BotId", "id", "Id"):
+            if bot.get(name):
+                return str(bot[name])
+        return None
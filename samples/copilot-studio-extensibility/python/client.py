@@ -9,6 +9,9 @@ import os
 from azure.identity import DefaultAzureCredential, ManagedIdentityCredential
 from durabletask.azuremanaged.client import DurableTaskSchedulerClient
 from models import *
+from codec import encode_payload, decode_payload
+from routing import ConversationAffinity
+from payloads import create_payload_store
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -41,18 +44,24 @@ class CopilotStudioClient:
             host_address=self.endpoint,
             secure_channel=self.endpoint != "http://localhost:8080",
             taskhub=self.taskhub_name,
-            token_credential=credential
+            token_credential=credential,
+            # Must match the workers' store to read offloaded inputs and outputs
+            payload_store=create_payload_store()
         )
         
+        # Follow-up messages reuse the routing decision of the agent handling an open topic
+        self.affinity = ConversationAffinity()
+        
         logger.info(f"Initialized client for taskhub: {self.taskhub_name}, endpoint: {self.endpoint}")
     
     async def start_conversation(self, request: ConversationRequest) -> str:
         """Start a hybrid agent conversation"""
         logger.info(f"Starting conversation for user {request.user_id}")
+        request = self.affinity.apply(request)
         
         instance_id = await self.client.schedule_new_orchestration_instance(
             orchestration_name="hybrid_agent_conversation_orchestrator",
-            input=json.dumps(to_dict(request))
+            input=encode_payload(request)
         )
         
         logger.info(f"Started conversation with instance ID: {instance_id}")
@@ -64,7 +73,7 @@ class CopilotStudioClient:
         
         instance_id = await self.client.schedule_new_orchestration_instance(
             orchestration_name="multi_agent_collaboration_orchestrator",
-            input=json.dumps(to_dict(request))
+            input=encode_payload(request)
         )
         
         logger.info(f"Started collaboration with instance ID: {instance_id}")
@@ -76,7 +85,7 @@ class CopilotStudioClient:
         
         instance_id = await self.client.schedule_new_orchestration_instance(
             orchestration_name="topic_based_conversation_orchestrator",
-            input=json.dumps(to_dict(request))
+            input=encode_payload(request)
         )
         
         logger.info(f"Started topic management with instance ID: {instance_id}")
@@ -223,6 +232,8 @@ async def interactive_demo():
     print("Enter messages to send to the hybrid agent system.")
     print("Type 'quit' to exit, 'collab' for collaboration demo, 'topic' for topic demo")
     
+    conversation_id = None
+    
     while True:
         user_input = input("\nYour message: ").strip()
         
@@ -240,6 +251,7 @@ async def interactive_demo():
         request = ConversationRequest(
             user_id="interactive-user",
             message=user_input,
+            conversation_id=conversation_id,
             routing_preference=AgentRoutingPreference.AUTO
         )
         
@@ -251,13 +263,17 @@ async def interactive_demo():
         
         if final_status and hasattr(final_status, 'serialized_output'):
             try:
-                output_data = json.loads(final_status.serialized_output)
+                # The orchestrator returns an encoded payload string, which the SDK serializes as JSON
+                output_data = decode_payload(json.loads(final_status.serialized_output))
+                response = from_dict(AgentResponse, output_data)
+                conversation_id = response.conversation_id or conversation_id
+                client.affinity.record(response)
                 print(f"\nAgent Response:")
                 print(f"Type: {output_data.get('agent_type', 'Unknown')}")
                 print(f"Message: {output_data.get('message', 'No message')}")
                 if output_data.get('requires_follow_up'):
                     print(f"Follow-up needed: {output_data.get('next_action', 'None specified')}")
-            except json.JSONDecodeError:
+            except (ValueError, AttributeError, TypeError):
                 print(f"Response: {final_status.serialized_output}")
         else:
             print("No response available")
@@ -0,0 +1,310 @@
+"""
+Compiled dataclass codecs for Copilot Studio extensibility models
+"""
+
+import base64
+import dataclasses
+import json
+import os
+import typing
+import zlib
+from enum import Enum
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+Encoder = Callable[[Any], Dict[str, Any]]
+Decoder = Callable[[Dict[str, Any]], Any]
+
+_encoders: Dict[type, Encoder] = {}
+_decoders: Dict[type, Decoder] = {}
+
+def get_encoder(data_class: type) -> Encoder:
+    """Get the encoder for a dataclass, compiling it on first use"""
+    encoder = _encoders.get(data_class)
+    if encoder is None:
+        try:
+            encoder = _compile_encoder(data_class)
+        except Exception:
+            _encoders.pop(data_class, None)
+            raise
+    return encoder
+
+def get_decoder(data_class: type) -> Decoder:
+    """Get the decoder for a dataclass, compiling it on first use"""
+    decoder = _decoders.get(data_class)
+    if decoder is None:
+        try:
+            decoder = _compile_decoder(data_class)
+        except Exception:
+            _decoders.pop(data_class, None)
+            raise
+    return decoder
+
+def encode_value(value: Any) -> Any:
+    """Encode a value whose type is only known at runtime"""
+    encoder = _encoders.get(type(value))
+    if encoder is not None:
+        return encoder(value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return get_encoder(type(value))(value)
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, list):
+        return [encode_value(item) for item in value]
+    return value
+
+def _compile_encoder(data_class: type) -> Encoder:
+    hints = typing.get_type_hints(data_class)
+    namespace: Dict[str, Any] = {}
+    items = []
+    
+    # Register a forwarding stub first so self-referencing dataclasses resolve
+    _encoders[data_class] = lambda obj: encoder(obj)
+    
+    for index, field in enumerate(dataclasses.fields(data_class)):
+        converter = _value_encoder(hints.get(field.name, Any))
+        if converter is None:
+            items.append(f"{field.name!r}: obj.{field.name}")
+        else:
+            namespace[f"_c{index}"] = converter
+            items.append(f"{field.name!r}: _c{index}(obj.{field.name})")
+    
+    source = "def encode(obj):\n    return {" + ", ".join(items) + "}\n"
+    exec(source, namespace)
+    encoder = namespace["encode"]
+    _encoders[data_class] = encoder
+    return encoder
+
+def _compile_decoder(data_class: type) -> Decoder:
+    hints = typing.get_type_hints(data_class)
+    namespace: Dict[str, Any] = {"_cls": data_class}
+    lines = ["def decode(data):", "    kwargs = {}"]
+    
+    _decoders[data_class] = lambda data: decoder(data)
+    
+    for index, field in enumerate(dataclasses.fields(data_class)):
+        if not field.init:
+            continue
+        converter = _value_decoder(hints.get(field.name, Any))
+        lines.append(f"    if {field.name!r} in data:")
+        if converter is None:
+            lines.append(f"        kwargs[{field.name!r}] = data[{field.name!r}]")
+        else:
+            namespace[f"_c{index}"] = converter
+            lines.append(f"        kwargs[{field.name!r}] = _c{index}(data[{field.name!r}])")
+    lines.append("    return _cls(**kwargs)")
+    
+    exec("\n".join(lines) + "\n", namespace)
+    decoder = namespace["decode"]
+    _decoders[data_class] = decoder
+    return decoder
+
+def _unwrap_optional(field_type: Any) -> Any:
+    if typing.get_origin(field_type) is typing.Union:
+        args = [arg for arg in typing.get_args(field_type) if arg is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return field_type
+
+def _value_encoder(field_type: Any) -> Optional[Callable[[Any], Any]]:
+    """Build an encoder for a field type, or None when values pass through unchanged"""
+    field_type = _unwrap_optional(field_type)
+    origin = typing.get_origin(field_type)
+    
+    if isinstance(field_type, type) and issubclass(field_type, Enum):
+        return lambda value: None if value is None else value.value
+    if dataclasses.is_dataclass(field_type):
+        nested = get_encoder(field_type)
+        return lambda value: None if value is None else nested(value)
+    if origin is list:
+        args = typing.get_args(field_type)
+        item_encoder = _value_encoder(args[0]) if args else encode_value
+        if item_encoder is None:
+            return None
+        return lambda value: None if value is None else [item_encoder(item) for item in value]
+    if origin is dict:
+        args = typing.get_args(field_type)
+        item_encoder = _value_encoder(args[1]) if args else None
+        if item_encoder is None:
+            return None
+        return lambda value: None if value is None else {key: item_encoder(item) for key, item in value.items()}
+    return None
+
+def _value_decoder(field_type: Any) -> Optional[Callable[[Any], Any]]:
+    """Build a decoder for a field type, or None when values pass through unchanged"""
+    field_type = _unwrap_optional(field_type)
+    origin = typing.get_origin(field_type)
+    
+    if isinstance(field_type, type) and issubclass(field_type, Enum):
+        return lambda value: None if value is None else field_type(value)
+    if dataclasses.is_dataclass(field_type):
+        nested = get_decoder(field_type)
+        return lambda value: value if value is None or isinstance(value, field_type) else nested(value)
+    if origin is list:
+        args = typing.get_args(field_type)
+        item_decoder = _value_decoder(args[0]) if args else None
+        if item_decoder is None:
+            return lambda value: None if value is None else list(value)
+        return lambda value: None if value is None else [item_decoder(item) for item in value]
+    if origin is dict:
+        args = typing.get_args(field_type)
+        item_decoder = _value_decoder(args[1]) if args else None
+        if item_decoder is None:
+            return None
+        return lambda value: None if value is None else {key: item_decoder(item) for key, item in value.items()}
+    return None
+
+
+class PayloadCodec:
+    """Turns encoded model payloads into the strings passed through orchestration history"""
+    
+    name = "json"
+    version = 1
+    
+    def encode(self, data: Any) -> str:
+        """Serialize an already encoded payload"""
+        return json.dumps(data, separators=(",", ":"))
+    
+    def decode(self, envelope: Dict[str, Any]) -> Any:
+        """Deserialize the data of an envelope written by this codec"""
+        raise ValueError("JSON payloads are not wrapped in an envelope")
+
+
+class CompressedJsonPayloadCodec(PayloadCodec):
+    """JSON payload codec that zlib-compresses large payloads into a versioned envelope when that is smaller"""
+    
+    name = "json+zlib"
+    
+    def __init__(self, compress_threshold: int = 1024):
+        self.compress_threshold = compress_threshold
+    
+    def encode(self, data: Any) -> str:
+        text = super().encode(data)
+        if len(text) < self.compress_threshold:
+            return text
+        packed = base64.b64encode(zlib.compress(text.encode("utf-8"))).decode("ascii")
+        envelope = json.dumps({"$codec": self.name, "$v": self.version, "zlib": True, "data": packed},
+                              separators=(",", ":"))
+        return envelope if len(envelope) < len(text) else text
+    
+    def decode(self, envelope: Dict[str, Any]) -> Any:
+        return json.loads(zlib.decompress(base64.b64decode(envelope["data"])))
+
+
+class BinaryPayloadCodec(PayloadCodec):
+    """Base class for binary codecs, written as a versioned JSON envelope around base64 data"""
+    
+    def __init__(self, compress_threshold: int = 1024):
+        self.compress_threshold = compress_threshold
+        self._fallback = CompressedJsonPayloadCodec(compress_threshold)
+    
+    def encode(self, data: Any) -> str:
+        packed = self._pack(data)
+        envelope = {"$codec": self.name, "$v": self.version}
+        if len(packed) >= self.compress_threshold:
+            packed = zlib.compress(packed)
+            envelope["zlib"] = True
+        envelope["data"] = base64.b64encode(packed).decode("ascii")
+        encoded = json.dumps(envelope, separators=(",", ":"))
+        
+        # Base64 and the envelope outweigh the binary savings on small payloads, so those stay JSON
+        fallback = self._fallback.encode(data)
+        return encoded if len(encoded) < len(fallback) else fallback
+    
+    def decode(self, envelope: Dict[str, Any]) -> Any:
+        packed = base64.b64decode(envelope["data"])
+        if envelope.get("zlib"):
+            packed = zlib.decompress(packed)
+        return self._unpack(packed)
+    
+    def _pack(self, data: Any) -> bytes:
+        raise NotImplementedError
+    
+    def _unpack(self, packed: bytes) -> Any:
+        raise NotImplementedError
+
+
+class MsgPackPayloadCodec(BinaryPayloadCodec):
+    """MessagePack payload codec (requires the msgpack package)"""
+    
+    name = "msgpack"
+    
+    def _pack(self, data: Any) -> bytes:
+        if msgpack is None:
+            raise RuntimeError("The msgpack payload codec requires the msgpack package: pip install msgpack")
+        return msgpack.packb(data, use_bin_type=True)
+    
+    def _unpack(self, packed: bytes) -> Any:
+        if msgpack is None:
+            raise RuntimeError("The msgpack payload codec requires the msgpack package: pip install msgpack")
+        return msgpack.unpackb(packed, raw=False)
+
+
+class CborPayloadCodec(BinaryPayloadCodec):
+    """CBOR payload codec (requires the cbor2 package)"""
+    
+    name = "cbor"
+    
+    def _pack(self, data: Any) -> bytes:
+        if cbor2 is None:
+            raise RuntimeError("The CBOR payload codec requires the cbor2 package: pip install cbor2")
+        return cbor2.dumps(data)
+    
+    def _unpack(self, packed: bytes) -> Any:
+        if cbor2 is None:
+            raise RuntimeError("The CBOR payload codec requires the cbor2 package: pip install cbor2")
+        return cbor2.loads(packed)
+
+
+# Codecs by (name, version); older versions stay registered so in-flight instances still decode
+_payload_codecs: Dict[Tuple[str, int], PayloadCodec] = {}
+_active_payload_codec: Optional[PayloadCodec] = None
+
+def register_payload_codec(codec: PayloadCodec) -> None:
+    """Register a payload codec so envelopes written by it can be decoded"""
+    _payload_codecs[(codec.name, codec.version)] = codec
+
+def set_payload_codec(name: str) -> PayloadCodec:
+    """Select the codec used for new payloads, using the latest registered version"""
+    global _active_payload_codec
+    versions = [codec for codec in _payload_codecs.values() if codec.name == name]
+    if not versions:
+        raise ValueError(f"Unknown payload codec: {name}")
+    _active_payload_codec = max(versions, key=lambda codec: codec.version)
+    return _active_payload_codec
+
+def get_payload_codec() -> PayloadCodec:
+    """Get the codec used for new payloads, selected by the PAYLOAD_CODEC environment variable"""
+    if _active_payload_codec is None:
+        return set_payload_codec(os.getenv("PAYLOAD_CODEC", "json"))
+    return _active_payload_codec
+
+def encode_payload(obj: Any) -> str:
+    """Encode a model, list of models or plain structure for an orchestration input or output"""
+    return get_payload_codec().encode(encode_value(obj))
+
+def decode_payload(payload: str) -> Any:
+    """Decode a payload written by any registered codec or version"""
+    data = json.loads(payload)
+    if isinstance(data, dict) and "$codec" in data:
+        codec = _payload_codecs.get((data["$codec"], data.get("$v", 1)))
+        if codec is None:
+            raise ValueError(f"Unsupported payload codec: {data['$codec']} v{data.get('$v', 1)}")
+        return codec.decode(data)
+    return data
+
+register_payload_codec(PayloadCodec())
+register_payload_codec(CompressedJsonPayloadCodec())
+# Compressed JSON envelopes written as json v2 still decode
+_payload_codecs[("json", 2)] = _payload_codecs[("json+zlib", 1)]
+register_payload_codec(MsgPackPayloadCodec())
+register_payload_codec(CborPayloadCodec())
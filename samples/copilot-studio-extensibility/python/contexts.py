@@ -0,0 +1,190 @@
+"""
+Versioned, content-addressed store for conversation contexts passed between orchestration steps
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from models import ContextDelta
+
+logger = logging.getLogger(__name__)
+
+def context_ref(context: Dict[str, Any]) -> str:
+    """Content address of a context: the same context always gets the same reference"""
+    canonical = json.dumps(context, sort_keys=True, separators=(",", ":"), default=str)
+    return "sha256:" + hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def diff_context(base: Dict[str, Any], context: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """Return the keys that were added or changed and the keys that were removed going from base to context"""
+    changes = {key: value for key, value in context.items() if key not in base or base[key] != value}
+    removed = [key for key in base if key not in context]
+    return changes, removed
+
+def apply_delta(base: Dict[str, Any], changes: Dict[str, Any], removed: List[str]) -> Dict[str, Any]:
+    """Return a copy of base with the changes applied and the removed keys dropped"""
+    context = {**base, **changes}
+    for key in removed:
+        context.pop(key, None)
+    return context
+
+class ContextStore:
+    """Content-addressed context store: a shared directory keeps each version as a delta against an earlier one,
+    and the in-memory backend keeps the most recently used max_entries versions whole"""
+    
+    def __init__(self, directory: Optional[str] = None, max_chain: int = 8, cache_size: int = 256,
+                 max_entries: int = 4096):
+        self.directory = directory
+        self.max_chain = max_chain
+        self.cache_size = cache_size
+        self.max_entries = max_entries
+        self.puts = 0
+        self.deduplicated = 0
+        self.gets = 0
+        self.evicted = 0
+        self.bytes_stored = 0
+        # Serialized entries of the in-memory backend only; a directory store reads through the bounded cache
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._cache: "OrderedDict[str, Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    
+    def put(self, context: Dict[str, Any], base_ref: Optional[str] = None) -> str:
+        """Store a context, as a delta against base_ref when given, and return its reference"""
+        # Copied, so a caller that keeps changing the context cannot change the stored version
+        context = copy.deepcopy(context or {})
+        ref = context_ref(context)
+        self.puts += 1
+        if self._has_entry(ref):
+            self.deduplicated += 1
+            return ref
+        
+        entry: Dict[str, Any] = {"context": context}
+        depth = 0
+        # Evicting an in-memory version must not break the delta chain of another, so only directories use deltas
+        if self.directory and base_ref and base_ref != ref:
+            try:
+                base, base_depth = self._resolve(base_ref)
+                if base_depth < self.max_chain:
+                    changes, removed = diff_context(base, context)
+                    entry = {"base": base_ref, "changes": changes, "removed": removed}
+                    depth = base_depth + 1
+            except KeyError:
+                pass
+        
+        self._save_entry(ref, entry)
+        self._remember(ref, context, depth)
+        return ref
+    
+    def get(self, ref: str) -> Dict[str, Any]:
+        """Return a copy of the context stored under ref, raising KeyError when it is unknown"""
+        self.gets += 1
+        context, _ = self._resolve(ref)
+        return copy.deepcopy(context)
+    
+    def rehydrate(self, delta: ContextDelta) -> Dict[str, Any]:
+        """Build the context a delta describes: its base contexts merged in order, then its own changes"""
+        context: Dict[str, Any] = {}
+        for ref in delta.base_refs or []:
+            context.update(self.get(ref))
+        return apply_delta(context, delta.changes or {}, delta.removed or [])
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current counters"""
+        return {
+            "puts": self.puts,
+            "deduplicated": self.deduplicated,
+            "gets": self.gets,
+            "evicted": self.evicted,
+            "bytesStored": self.bytes_stored,
+            "cached": len(self._cache)
+        }
+    
+    def _resolve(self, ref: str) -> Tuple[Dict[str, Any], int]:
+        """Materialize a version by walking its delta chain, returning the context and the chain depth"""
+        with self._lock:
+            cached = self._cache.get(ref)
+            if cached is not None:
+                self._cache.move_to_end(ref)
+                return cached
+        
+        entry = self._load_entry(ref)
+        if entry is None:
+            raise KeyError(f"Unknown context reference {ref}")
+        
+        if "context" in entry:
+            context, depth = entry["context"], 0
+        else:
+            base, base_depth = self._resolve(entry["base"])
+            context, depth = apply_delta(base, entry["changes"], entry["removed"]), base_depth + 1
+        
+        self._remember(ref, context, depth)
+        return context, depth
+    
+    def _remember(self, ref: str, context: Dict[str, Any], depth: int) -> None:
+        with self._lock:
+            self._cache[ref] = (context, depth)
+            self._cache.move_to_end(ref)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+    
+    def _has_entry(self, ref: str) -> bool:
+        if not self.directory:
+            # The cache may outlive an evicted entry, so only the entries themselves count
+            with self._lock:
+                return ref in self._entries
+        with self._lock:
+            if ref in self._cache:
+                return True
+        return os.path.exists(self._path(ref))
+    
+    def _load_entry(self, ref: str) -> Optional[Dict[str, Any]]:
+        if not self.directory:
+            with self._lock:
+                data = self._entries.get(ref)
+                if data is None:
+                    return None
+                self._entries.move_to_end(ref)
+            return json.loads(data)
+        
+        try:
+            with open(self._path(ref), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+    
+    def _save_entry(self, ref: str, entry: Dict[str, Any]) -> None:
+        data = json.dumps(entry, separators=(",", ":"), default=str)
+        self.bytes_stored += len(data)
+        if not self.directory:
+            with self._lock:
+                self._entries[ref] = data
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evicted += 1
+        else:
+            # Write then rename, so other workers never read a partial file
+            path = self._path(ref)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+    
+    def _path(self, ref: str) -> str:
+        return os.path.join(self.directory, ref.replace(":", "-") + ".json")
+
+def create_context_store() -> Optional[ContextStore]:
+    """Create the store configured by CONTEXT_STORE: unset disables it, "memory" is in-process, anything else is a shared directory"""
+    location = os.getenv("CONTEXT_STORE", "").strip()
+    if not location:
+        return None
+    
+    store = ContextStore(None if location == "memory" else location,
+                         max_entries=int(os.getenv("CONTEXT_STORE_MAX_ENTRIES", "4096")))
+    logger.info(f"Passing collaboration contexts by reference through the {location} context store")
+    return store
@@ -0,0 +1,198 @@
+"""
+Tracking of outstanding Power Automate flow runs
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from models import PowerAutomateFlowResponse
+
+logger = logging.getLogger(__name__)
+
+# Run statuses after which a run no longer changes
+TERMINAL_RUN_STATUSES = {"Succeeded", "Failed", "Cancelled", "TimedOut", "Skipped"}
+
+EventSink = Callable[[str, str, PowerAutomateFlowResponse], Awaitable[None]]
+
+@dataclass
+class TrackedRun:
+    flow_id: str
+    run_id: str
+    future: asyncio.Future
+    interval: float
+    next_poll: float
+    instance_id: Optional[str] = None
+    event_name: Optional[str] = None
+    expires_at: Optional[float] = None
+
+class FlowRunTracker:
+    """Waits for many flow runs at once, polling their status in batches with per-run adaptive intervals"""
+    
+    def __init__(self, power_platform_service, min_interval: float = 1.0, max_interval: float = 30.0,
+                 backoff: float = 1.5, batch_size: int = 50, event_sink: Optional[EventSink] = None,
+                 event_retries: int = 3, event_retry_delay: float = 1.0):
+        self.power_platform_service = power_platform_service
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.batch_size = batch_size
+        self.event_sink = event_sink
+        self.event_retries = event_retries
+        self.event_retry_delay = event_retry_delay
+        self.status_calls = 0
+        self.completed = 0
+        self.expired = 0
+        self.event_retried = 0
+        self.event_failures = 0
+        self._runs: Dict[Tuple[str, str], TrackedRun] = {}
+        self._deliveries: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+    
+    async def track(self, flow_id: str, run_id: str, instance_id: Optional[str] = None,
+                    event_name: Optional[str] = None, timeout: Optional[float] = None) -> asyncio.Future:
+        """Start tracking a run; the returned future resolves with its final status, and the
+        orchestration instance, if given, receives it as the named external event. After timeout seconds the run
+        is dropped and its future cancelled"""
+        loop = asyncio.get_running_loop()
+        key = (flow_id, run_id)
+        expires_at = loop.time() + timeout if timeout is not None else None
+        run = self._runs.get(key)
+        if run is None:
+            run = TrackedRun(flow_id, run_id, loop.create_future(), self.min_interval,
+                             loop.time() + self.min_interval, instance_id, event_name, expires_at)
+            self._runs[key] = run
+        elif expires_at is not None and run.expires_at is not None:
+            run.expires_at = max(run.expires_at, expires_at)
+        else:
+            run.expires_at = None
+        
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._poll_until_done())
+        self._wakeup.set()
+        return run.future
+    
+    async def wait(self, flow_id: str, run_id: str, timeout: Optional[float] = None) -> PowerAutomateFlowResponse:
+        """Wait for a run to finish and return its final status"""
+        future = await self.track(flow_id, run_id, timeout=timeout)
+        done, _ = await asyncio.wait([future], timeout=timeout)
+        # A run that expired just before the wait timed out has its future cancelled, without the tracker stopping
+        if not done or (future.cancelled() and self._task is not None):
+            raise asyncio.TimeoutError(f"Flow run {run_id} of flow {flow_id} did not finish within {timeout}s")
+        return future.result()
+    
+    async def check(self, flow_id: str, run_id: str) -> Optional[PowerAutomateFlowResponse]:
+        """Get the current status of one run, whether or not it is tracked, or None when it cannot be found"""
+        self.status_calls += 1
+        statuses = await self.power_platform_service.get_flow_run_statuses(flow_id, [run_id])
+        return next((status for status in statuses if status.run_id == run_id), None)
+    
+    async def stop(self) -> None:
+        """Stop polling, cancelling the futures of runs that have not finished, and wait for pending event deliveries"""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        for run in self._runs.values():
+            run.future.cancel()
+        self._runs.clear()
+        await asyncio.gather(*self._deliveries, return_exceptions=True)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current counters"""
+        return {
+            "outstanding": len(self._runs),
+            "completed": self.completed,
+            "expired": self.expired,
+            "statusCalls": self.status_calls,
+            "eventRetries": self.event_retried,
+            "eventFailures": self.event_failures
+        }
+    
+    async def _poll_until_done(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._runs:
+            now = loop.time()
+            self._expire(now)
+            due = [run for run in self._runs.values() if run.next_poll <= now]
+            if due:
+                await self._poll(due)
+            if not self._runs:
+                break
+            
+            # Sleep until the next run is due or expires, or until a new run is tracked
+            delay = min(min(run.next_poll, run.expires_at or run.next_poll) for run in self._runs.values()) - loop.time()
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(delay, 0.0))
+            except asyncio.TimeoutError:
+                pass
+    
+    async def _poll(self, due: List[TrackedRun]) -> None:
+        # One status call covers up to batch_size runs of the same flow
+        by_flow: Dict[str, List[TrackedRun]] = {}
+        for run in due:
+            by_flow.setdefault(run.flow_id, []).append(run)
+        batches = [(flow_id, runs[i:i + self.batch_size])
+                   for flow_id, runs in by_flow.items() for i in range(0, len(runs), self.batch_size)]
+        
+        self.status_calls += len(batches)
+        results = await asyncio.gather(
+            *[self.power_platform_service.get_flow_run_statuses(flow_id, [run.run_id for run in runs])
+              for flow_id, runs in batches],
+            return_exceptions=True)
+        
+        loop = asyncio.get_running_loop()
+        for (flow_id, runs), result in zip(batches, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to get run statuses for flow {flow_id}: {result}")
+                statuses = {}
+            else:
+                statuses = {status.run_id: status for status in result}
+            
+            for run in runs:
+                status = statuses.get(run.run_id)
+                if status is not None and status.status in TERMINAL_RUN_STATUSES:
+                    await self._complete(run, status)
+                else:
+                    # Runs that keep running are polled less and less often
+                    run.interval = min(run.interval * self.backoff, self.max_interval)
+                    run.next_poll = loop.time() + run.interval
+    
+    async def _complete(self, run: TrackedRun, status: PowerAutomateFlowResponse) -> None:
+        self._runs.pop((run.flow_id, run.run_id), None)
+        self.completed += 1
+        if not run.future.done():
+            run.future.set_result(status)
+        
+        if run.instance_id and run.event_name and self.event_sink is not None:
+            # Delivered in the background, so retries do not hold up polling of the other runs
+            delivery = asyncio.get_running_loop().create_task(self._deliver(run, status))
+            self._deliveries.add(delivery)
+            delivery.add_done_callback(self._deliveries.discard)
+    
+    async def _deliver(self, run: TrackedRun, status: PowerAutomateFlowResponse) -> None:
+        for attempt in range(self.event_retries + 1):
+            try:
+                await self.event_sink(run.instance_id, run.event_name, status)
+                return
+            except Exception as ex:
+                if attempt == self.event_retries:
+                    self.event_failures += 1
+                    logger.error(f"Failed to raise {run.event_name} for orchestration {run.instance_id} "
+                                 f"after {attempt + 1} attempts: {ex}")
+                    return
+                delay = self.event_retry_delay * 2 ** attempt
+                self.event_retried += 1
+                logger.warning(f"Failed to raise {run.event_name} for orchestration {run.instance_id}, "
+                               f"retrying in {delay:.1f}s: {ex}")
+                await asyncio.sleep(delay)
+    
+    def _expire(self, now: float) -> None:
+        for run in [run for run in self._runs.values() if run.expires_at is not None and run.expires_at <= now]:
+            del self._runs[(run.flow_id, run.run_id)]
+            self.expired += 1
+            run.future.cancel()
+            logger.warning(f"Stopped tracking flow run {run.run_id} of flow {run.flow_id}, its deadline passed")
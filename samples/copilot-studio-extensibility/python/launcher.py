@@ -0,0 +1,162 @@
+"""
+Multi-process launcher that runs several copies of a worker under supervision
+
+Each process registers the same orchestrations and activities and pulls work from the same task hub,
+so CPU-bound work is spread across cores instead of sharing one GIL.
+
+Usage: python launcher.py [module:function]    (default worker:main)
+"""
+
+import asyncio
+import importlib
+import inspect
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+def load_target(spec: str) -> Callable[[], Any]:
+    """Resolve a "module:function" spec, importing the module from the current directory if needed"""
+    module_name, _, attribute = spec.partition(":")
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    return getattr(importlib.import_module(module_name), attribute or "main")
+
+def _run_worker_process(target: Union[str, Callable[[], Any]], index: int) -> None:
+    # Own process group, so Ctrl+C reaches only the supervisor, which then drains every worker once
+    os.setpgrp()
+    os.environ["WORKER_PROCESS_INDEX"] = str(index)
+    
+    # SIGTERM drains like Ctrl+C: asyncio.run cancels the main task and the worker's context manager stops the worker.
+    # Workers run by a WorkerHost replace this with their own handler
+    signal.signal(signal.SIGTERM, lambda signum, frame: signal.raise_signal(signal.SIGINT))
+    try:
+        func = load_target(target) if isinstance(target, str) else target
+        result = func()
+        if inspect.isawaitable(result):
+            asyncio.run(result)
+    except KeyboardInterrupt:
+        pass
+
+class WorkerSupervisor:
+    """Runs copies of a worker in child processes, restarting any that exit and draining all of them on shutdown"""
+    
+    def __init__(self, target: Union[str, Callable[[], Any]], processes: Optional[int] = None,
+                 drain_timeout: float = 30.0, restart_backoff: float = 1.0, max_restart_backoff: float = 30.0,
+                 stable_after: float = 60.0, health_interval: float = 1.0):
+        self.target = target
+        self.processes = processes or os.cpu_count() or 1
+        self.drain_timeout = drain_timeout
+        self.restart_backoff = restart_backoff
+        self.max_restart_backoff = max_restart_backoff
+        self.stable_after = stable_after
+        self.health_interval = health_interval
+        self.restarts = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._children: Dict[int, Any] = {}
+        self._started_at: Dict[int, float] = {}
+        self._failures: Dict[int, int] = {}
+        self._restart_at: Dict[int, float] = {}
+        self._stopping = False
+    
+    def start(self) -> None:
+        """Start every worker process"""
+        logger.info(f"Starting {self.processes} worker processes for {self.target}")
+        for index in range(self.processes):
+            self._spawn(index)
+    
+    def check(self) -> None:
+        """One health pass: restart workers that exited, backing off when the same worker keeps crashing"""
+        if self._stopping:
+            return
+        
+        now = time.monotonic()
+        for index in range(self.processes):
+            process = self._children.get(index)
+            if process is not None and process.is_alive():
+                # A worker that stayed up long enough starts its backoff from scratch next time
+                if now - self._started_at[index] >= self.stable_after:
+                    self._failures[index] = 0
+                continue
+            
+            if process is not None:
+                self._children[index] = None
+                self._failures[index] = self._failures.get(index, 0) + 1
+                delay = min(self.restart_backoff * 2 ** (self._failures[index] - 1), self.max_restart_backoff)
+                self._restart_at[index] = now + delay
+                logger.warning(f"Worker process {index} (pid {process.pid}) exited with code {process.exitcode}, "
+                               f"restarting in {delay:.1f}s")
+            
+            if now >= self._restart_at.get(index, 0):
+                self._spawn(index)
+                self.restarts += 1
+    
+    def stop(self) -> float:
+        """Ask every worker to drain, wait up to the drain timeout, kill any still running and return the drain duration"""
+        self._stopping = True
+        started = time.monotonic()
+        running = [process for process in self._children.values() if process is not None and process.is_alive()]
+        for process in running:
+            process.terminate()
+        
+        deadline = started + self.drain_timeout
+        for process in running:
+            process.join(max(0.0, deadline - time.monotonic()))
+        for process in running:
+            if process.is_alive():
+                logger.warning(f"Worker process {process.name} (pid {process.pid}) did not drain in "
+                               f"{self.drain_timeout}s, killing it")
+                process.kill()
+                process.join()
+        return time.monotonic() - started
+    
+    def run(self) -> None:
+        """Supervise the workers until SIGTERM or SIGINT, then drain them"""
+        stop_requested = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda signum, frame: stop_requested.set())
+        
+        self.start()
+        while not stop_requested.wait(self.health_interval):
+            self.check()
+        
+        logger.info(f"Draining {self.processes} worker processes")
+        duration = self.stop()
+        logger.info(f"Worker processes drained in {duration:.2f}s, supervisor stats: {self.snapshot()}")
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current process state"""
+        alive = [process for process in self._children.values() if process is not None and process.is_alive()]
+        return {
+            "processes": self.processes,
+            "alive": len(alive),
+            "restarts": self.restarts,
+            "pids": [process.pid for process in alive]
+        }
+    
+    def _spawn(self, index: int) -> None:
+        process = self._context.Process(target=_run_worker_process, args=(self.target, index), name=f"worker-{index}")
+        process.start()
+        self._children[index] = process
+        self._started_at[index] = time.monotonic()
+        logger.info(f"Started worker process {index} (pid {process.pid})")
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    target = sys.argv[1] if len(sys.argv) > 1 else "worker:main"
+    supervisor = WorkerSupervisor(
+        target,
+        processes=int(os.getenv("WORKER_PROCESSES", "0")) or None,
+        # Leave each worker time to flush its metrics after its own drain deadline
+        drain_timeout=float(os.getenv("WORKER_DRAIN_TIMEOUT", "30")) + 5
+    )
+    supervisor.run()
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ from dataclasses import dataclass, field
 from typing import Dict, List, Optional, Any
 from enum import Enum
 import json
+from codec import encode_value, get_decoder
 
 class AgentRoutingPreference(Enum):
     AUTO = "auto"
@@ -34,6 +35,8 @@ class ConversationRequest:
     conversation_id: Optional[str] = None
     context: Optional[Dict[str, Any]] = field(default_factory=dict)
     routing_preference: AgentRoutingPreference = AgentRoutingPreference.AUTO
+    routing_decision: Optional["AgentRoutingDecision"] = None
+    context_delta: Optional["ContextDelta"] = None
 
 @dataclass
 class AgentResponse:
@@ -44,6 +47,14 @@ class AgentResponse:
     context: Optional[Dict[str, Any]] = field(default_factory=dict)
     requires_follow_up: bool = False
     next_action: Optional[str] = None
+    routing_decision: Optional["AgentRoutingDecision"] = None
+    context_ref: Optional[str] = None
+
+@dataclass
+class ContextDelta:
+    base_refs: List[str] = field(default_factory=list)
+    changes: Optional[Dict[str, Any]] = field(default_factory=dict)
+    removed: Optional[List[str]] = field(default_factory=list)
 
 @dataclass
 class CopilotStudioRequest:
@@ -91,6 +102,7 @@ class AgentCapability:
     description: str
     supported_by: List[AgentType]
     is_required: bool = True
+    depends_on: Optional[List[str]] = field(default_factory=list)
 
 @dataclass
 class MultiAgentRequest:
@@ -121,37 +133,16 @@ class AgentCollaborationStep:
     description: str
     prompt: str
     input_context: Optional[Dict[str, Any]] = field(default_factory=dict)
+    depends_on: Optional[List[int]] = field(default_factory=list)
+    input_context_ref: Optional[str] = None
 
 def to_dict(obj):
     """Convert dataclass to dictionary"""
-    if hasattr(obj, '__dict__'):
-        result = {}
-        for key, value in obj.__dict__.items():
-            if isinstance(value, Enum):
-                result[key] = value.value
-            elif isinstance(value, list):
-                result[key] = [to_dict(item) if hasattr(item, '__dict__') else item for item in value]
-            elif hasattr(value, '__dict__'):
-                result[key] = to_dict(value)
-            else:
-                result[key] = value
-        return result
-    return obj
+    return encode_value(obj)
 
 def from_dict(data_class, data):
     """Create dataclass from dictionary"""
     if not isinstance(data, dict):
         return data
     
-    # Handle enum fields
-    field_types = getattr(data_class, '__annotations__', {})
-    for field_name, field_type in field_types.items():
-        if field_name in data and hasattr(field_type, '__origin__'):
-            # Handle Optional types
-            if hasattr(field_type, '__args__') and type(None) in field_type.__args__:
-                field_type = field_type.__args__[0]
-        
-        if field_name in data and issubclass(field_type, Enum):
-            data[field_name] = field_type(data[field_name])
-    
-    return data_class(**data)
\ No newline at end of file
+    return get_decoder(data_class)(data)
\ No newline at end of file
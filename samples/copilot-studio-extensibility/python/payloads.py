@@ -0,0 +1,163 @@
+"""
+Claim-check stores for orchestration payloads too large to pass inline
+"""
+
+import asyncio
+import gzip
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from durabletask.payload.store import LargePayloadStorageOptions, PayloadStore
+
+logger = logging.getLogger(__name__)
+
+class LocalPayloadStore(PayloadStore):
+    """Payload store that keeps each payload as a content-addressed file in a directory shared by workers and clients"""
+    
+    TOKEN_PREFIX = "file:v1:"
+    
+    def __init__(self, directory: str, options: Optional[LargePayloadStorageOptions] = None):
+        self.directory = directory
+        self._options = options or LargePayloadStorageOptions()
+        os.makedirs(directory, exist_ok=True)
+    
+    @property
+    def options(self) -> LargePayloadStorageOptions:
+        return self._options
+    
+    def upload(self, data: bytes, *, instance_id: Optional[str] = None) -> str:
+        if self._options.enable_compression:
+            # Without a fixed timestamp in the gzip header, the same payload would get a new name every second
+            data = gzip.compress(data, mtime=0)
+        name = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            # Write then rename, so readers never see a partial file
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        return self.TOKEN_PREFIX + name
+    
+    async def upload_async(self, data: bytes, *, instance_id: Optional[str] = None) -> str:
+        return await asyncio.to_thread(self.upload, data, instance_id=instance_id)
+    
+    def download(self, token: str) -> bytes:
+        with open(os.path.join(self.directory, token[len(self.TOKEN_PREFIX):]), "rb") as f:
+            data = f.read()
+        # Compression may have been toggled while payloads were in flight
+        return gzip.decompress(data) if data[:2] == b"\x1f\x8b" else data
+    
+    async def download_async(self, token: str) -> bytes:
+        return await asyncio.to_thread(self.download, token)
+    
+    def is_known_token(self, value: str) -> bool:
+        return value.startswith(self.TOKEN_PREFIX) and len(value) == len(self.TOKEN_PREFIX) + 64
+
+class CachedPayloadStore(PayloadStore):
+    """Wraps a payload store with an LRU cache of downloaded payloads, so a payload read by several steps is fetched once"""
+    
+    def __init__(self, store: PayloadStore, max_bytes: int = 64 * 1024 * 1024):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        self.downloads = 0
+        self.hits = 0
+        self._cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+    
+    @property
+    def options(self) -> LargePayloadStorageOptions:
+        return self.store.options
+    
+    def upload(self, data: bytes, *, instance_id: Optional[str] = None) -> str:
+        token = self.store.upload(data, instance_id=instance_id)
+        self._record_upload(token, data)
+        return token
+    
+    async def upload_async(self, data: bytes, *, instance_id: Optional[str] = None) -> str:
+        token = await self.store.upload_async(data, instance_id=instance_id)
+        self._record_upload(token, data)
+        return token
+    
+    def download(self, token: str) -> bytes:
+        data = self._get_cached(token)
+        if data is None:
+            data = self.store.download(token)
+            self._put_cached(token, data)
+        return data
+    
+    async def download_async(self, token: str) -> bytes:
+        data = self._get_cached(token)
+        if data is None:
+            data = await self.store.download_async(token)
+            self._put_cached(token, data)
+        return data
+    
+    def is_known_token(self, value: str) -> bool:
+        return self.store.is_known_token(value)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current counters"""
+        return {
+            "uploads": self.uploads,
+            "uploadedBytes": self.uploaded_bytes,
+            "downloads": self.downloads,
+            "cacheHits": self.hits,
+            "cachedBytes": self._cached_bytes,
+            "thresholdBytes": self.options.threshold_bytes
+        }
+    
+    def _record_upload(self, token: str, data: bytes) -> None:
+        self.uploads += 1
+        self.uploaded_bytes += len(data)
+        # The uploader usually reads its own payload back on the next step
+        self._put_cached(token, data)
+    
+    def _get_cached(self, token: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._cache.get(token)
+            if data is None:
+                self.downloads += 1
+                return None
+            self.hits += 1
+            self._cache.move_to_end(token)
+            return data
+    
+    def _put_cached(self, token: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if token in self._cache:
+                return
+            self._cache[token] = data
+            self._cached_bytes += len(data)
+            while self._cached_bytes > self.max_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_bytes -= len(evicted)
+
+def create_payload_store() -> Optional[CachedPayloadStore]:
+    """Create the store configured by PAYLOAD_STORE: unset disables offloading, "blob" uses Azure Blob Storage, anything else is a directory"""
+    location = os.getenv("PAYLOAD_STORE", "").strip()
+    if not location:
+        return None
+    
+    threshold = int(os.getenv("PAYLOAD_OFFLOAD_THRESHOLD", "262144"))
+    if location == "blob":
+        # Works against Azure Storage or Azurite, e.g. PAYLOAD_STORAGE_CONNECTION_STRING=UseDevelopmentStorage=true
+        from durabletask.extensions.azure_blob_payloads import BlobPayloadStore, BlobPayloadStoreOptions
+        store = BlobPayloadStore(BlobPayloadStoreOptions(
+            threshold_bytes=threshold,
+            connection_string=os.environ["PAYLOAD_STORAGE_CONNECTION_STRING"],
+            container_name=os.getenv("PAYLOAD_STORAGE_CONTAINER", "durabletask-payloads")
+        ))
+    else:
+        store = LocalPayloadStore(location, LargePayloadStorageOptions(threshold_bytes=threshold))
+    
+    logger.info(f"Offloading payloads larger than {threshold} bytes to the {location} payload store")
+    return CachedPayloadStore(store, int(os.getenv("PAYLOAD_CACHE_BYTES", str(64 * 1024 * 1024))))
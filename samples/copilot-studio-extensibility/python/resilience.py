@@ -0,0 +1,297 @@
+"""
+Client-side rate limiting, adaptive concurrency and circuit breaking for Power Platform endpoints
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class ThrottledError(Exception):
+    """Raised when an endpoint keeps throttling requests after every retry"""
+    
+    def __init__(self, endpoint: str, retry_after: Optional[float]):
+        super().__init__(f"Power Platform endpoint {endpoint} is throttling requests (retry after {retry_after}s)")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given in seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """Token bucket that allows bursts up to its capacity and refills at a steady rate"""
+    
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+    
+    async def acquire(self) -> None:
+        """Wait until a token is available and take it"""
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+            wait = self.paused_until - now
+            if wait <= 0:
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+    
+    def pause(self, seconds: float) -> None:
+        """Hand out no tokens for the given number of seconds, e.g. after a Retry-After"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+    
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+class AdaptiveConcurrencyLimit:
+    """AIMD concurrency limit: grows by one per window of successes and is cut multiplicatively when throttled"""
+    
+    def __init__(self, maximum: int = 20, minimum: int = 1, decrease_factor: float = 0.5):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.decrease_factor = decrease_factor
+        self.limit = float(maximum)
+        self.in_flight = 0
+        # Bumped on every decrease, so requests sent before a cut do not cut the limit again
+        self.generation = 0
+        self._waiters: List[asyncio.Future] = []
+    
+    async def acquire(self) -> int:
+        """Wait for a free slot under the current limit, take it and return the limit's generation"""
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+        return self.generation
+    
+    def release(self) -> None:
+        """Free a slot"""
+        self.in_flight -= 1
+        self._wake()
+    
+    def on_success(self) -> None:
+        """Additive increase: roughly one more slot per limit's worth of successful requests"""
+        self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+        self._wake()
+    
+    def on_throttle(self, generation: Optional[int] = None) -> bool:
+        """Multiplicative decrease, at most once for the requests sent under one generation of the limit"""
+        if generation is not None and generation != self.generation:
+            return False
+        self.limit = max(float(self.minimum), self.limit * self.decrease_factor)
+        self.generation += 1
+        return True
+    
+    def _wake(self) -> None:
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+class EndpointLimiter:
+    """Rate and concurrency limits for one endpoint"""
+    
+    def __init__(self, name: str, rate: float, burst: float, max_concurrency: int, min_concurrency: int):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AdaptiveConcurrencyLimit(max_concurrency, min_concurrency)
+        self.requests = 0
+        self.throttled = 0
+    
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[int]:
+        """Hold a rate-limited concurrency slot for the duration of one request, yielding the limit's generation"""
+        await self.bucket.acquire()
+        generation = await self.concurrency.acquire()
+        self.requests += 1
+        try:
+            yield generation
+        finally:
+            self.concurrency.release()
+    
+    def on_success(self) -> None:
+        """Record a request that was not throttled"""
+        self.concurrency.on_success()
+    
+    def on_throttle(self, retry_after: Optional[float], generation: Optional[int] = None) -> None:
+        """Record a throttled request, pausing the endpoint for Retry-After when given; a burst of throttled
+        requests sent under the same generation of the limit cuts it only once"""
+        self.throttled += 1
+        decreased = self.concurrency.on_throttle(generation)
+        if retry_after:
+            self.bucket.pause(retry_after)
+        if decreased:
+            logger.warning(f"Endpoint {self.name} throttled, concurrency limit now {int(self.concurrency.limit)}"
+                           + (f", pausing for {retry_after}s" if retry_after else ""))
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current limits and counters"""
+        return {
+            "rate": self.bucket.rate,
+            "burst": self.bucket.burst,
+            "concurrencyLimit": int(self.concurrency.limit),
+            "maxConcurrency": self.concurrency.maximum,
+            "inFlight": self.concurrency.in_flight,
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "pausedFor": max(self.bucket.paused_until - time.monotonic(), 0.0)
+        }
+
+class RateLimiter:
+    """Creates and keeps an EndpointLimiter per endpoint, all with the same settings"""
+    
+    def __init__(self, rate: float = 20.0, burst: float = 40.0, max_concurrency: int = 20, min_concurrency: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self._endpoints: Dict[str, EndpointLimiter] = {}
+    
+    def for_endpoint(self, name: str) -> EndpointLimiter:
+        """Get the limiter for an endpoint, creating it on first use"""
+        limiter = self._endpoints.get(name)
+        if limiter is None:
+            limiter = EndpointLimiter(name, self.rate, self.burst, self.max_concurrency, self.min_concurrency)
+            self._endpoints[name] = limiter
+        return limiter
+    
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Return the current limits of every endpoint"""
+        return {name: limiter.snapshot() for name, limiter in self._endpoints.items()}
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose circuit breaker is open"""
+    
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__(f"Circuit for Power Platform endpoint {endpoint} is open (next probe in {retry_in:.1f}s)")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+class CircuitBreaker:
+    """Closed / open / half-open circuit breaker for one endpoint"""
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, name: str, failure_threshold: int = 5, probe_interval: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probing = False
+    
+    @property
+    def is_open(self) -> bool:
+        """Whether requests are currently being rejected: open and not yet due for a probe, or half-open with a probe in flight"""
+        if self.state == self.HALF_OPEN:
+            return self._probing
+        return self.state == self.OPEN and time.monotonic() - self._opened_at < self.probe_interval
+    
+    def before_request(self) -> None:
+        """Raise CircuitOpenError unless a request may go out; after the probe interval one probe is let through"""
+        if self.state == self.CLOSED:
+            return
+        
+        if self.state == self.OPEN and not self.is_open:
+            self.state = self.HALF_OPEN
+            logger.info(f"Circuit for {self.name} half-open, probing")
+        
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return
+        
+        self.rejected += 1
+        raise CircuitOpenError(self.name, max(self.probe_interval - (time.monotonic() - self._opened_at), 0.0))
+    
+    def on_success(self) -> None:
+        """Record a healthy response, closing the circuit after a successful probe"""
+        if self.state != self.CLOSED:
+            logger.info(f"Circuit for {self.name} closed")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probing = False
+    
+    def abandon(self) -> None:
+        """Forget a request that was cancelled before its outcome was known"""
+        self._probing = False
+    
+    def on_failure(self) -> None:
+        """Record a failed request, opening the circuit at the threshold or when a probe fails"""
+        self.consecutive_failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened += 1
+                logger.warning(f"Circuit for {self.name} opened after {self.consecutive_failures} consecutive failures")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the breaker state and counters"""
+        return {
+            "state": self.state,
+            "consecutiveFailures": self.consecutive_failures,
+            "failureThreshold": self.failure_threshold,
+            "probeInterval": self.probe_interval,
+            "opened": self.opened,
+            "rejected": self.rejected
+        }
+
+class CircuitBreakers:
+    """Creates and keeps a CircuitBreaker per endpoint, all with the same settings"""
+    
+    def __init__(self, failure_threshold: int = 5, probe_interval: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self._endpoints: Dict[str, CircuitBreaker] = {}
+    
+    def for_endpoint(self, name: str) -> CircuitBreaker:
+        """Get the breaker for an endpoint, creating it on first use"""
+        breaker = self._endpoints.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, self.failure_threshold, self.probe_interval)
+            self._endpoints[name] = breaker
+        return breaker
+    
+    def is_open(self, name: str) -> bool:
+        """Whether the endpoint's circuit is currently rejecting requests"""
+        breaker = self._endpoints.get(name)
+        return breaker is not None and breaker.is_open
+    
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Return the state of every endpoint's breaker"""
+        return {name: breaker.snapshot() for name, breaker in self._endpoints.items()}
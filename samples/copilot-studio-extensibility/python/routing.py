@@ -0,0 +1,332 @@
+"""
+Keyword-based routing helpers for Copilot Studio extensibility
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from dataclasses import replace
+from models import AgentType, AgentResponse, AgentRoutingDecision, AgentRoutingPreference, ConversationRequest, from_dict, to_dict
+
+logger = logging.getLogger(__name__)
+
+# Keywords, with weights, that suggest which agent should handle a conversation
+DEFAULT_ROUTING_KEYWORDS: Dict[AgentType, Dict[str, float]] = {
+    AgentType.COPILOT_STUDIO: {
+        "workflow": 1.0, "process": 1.0, "step": 1.0, "form": 1.0,
+        "approval": 1.0, "business": 1.0, "policy": 1.0, "procedure": 1.0
+    },
+    AgentType.AZURE_AI: {
+        "explain": 1.0, "analyze": 1.0, "creative": 1.0, "generate": 1.0,
+        "complex": 1.0, "reasoning": 1.0, "technical": 1.0, "code": 1.0
+    }
+}
+
+# Keywords in a capability name that suggest which agent is best suited for it
+CAPABILITY_KEYWORDS: Dict[AgentType, Dict[str, float]] = {
+    AgentType.COPILOT_STUDIO: {"workflow": 1.0, "process": 1.0},
+    AgentType.AZURE_AI: {"analysis": 1.0, "creative": 1.0}
+}
+
+# Keywords in a task description that add steps to a general collaboration plan
+COLLABORATION_KEYWORDS: Dict[AgentType, Dict[str, float]] = {
+    AgentType.AZURE_AI: {"complex": 1.0, "analyze": 1.0, "creative": 1.0},
+    AgentType.POWER_AUTOMATE: {"automate": 1.0, "flow": 1.0, "trigger": 1.0}
+}
+
+class KeywordMatcher:
+    """Aho-Corasick matcher that scores text against weighted keywords per label in a single pass"""
+    
+    def __init__(self, keyword_table: Dict[Any, Dict[str, float]], whole_words: bool = False):
+        """Build the matcher; matches must start on a word boundary, and also end on one if whole_words is set"""
+        self.whole_words = whole_words
+        self.keyword_count = 0
+        
+        # Trie transitions, failure links and the (keyword, label, weight) entries ending at each node
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._outputs: List[List[Tuple[str, Any, float]]] = [[]]
+        
+        for label, keywords in keyword_table.items():
+            for keyword, weight in keywords.items():
+                self._add(keyword.lower(), label, weight)
+        self._build_failure_links()
+    
+    @classmethod
+    def from_file(cls, path: str, whole_words: bool = False) -> "KeywordMatcher":
+        """Load a keyword table from a JSON file of {agent_type: {keyword: weight}}"""
+        with open(path) as keyword_file:
+            table = json.load(keyword_file)
+        return cls({AgentType(label): keywords for label, keywords in table.items()}, whole_words)
+    
+    def match(self, text: str) -> Dict[Any, Dict[str, float]]:
+        """Return the distinct keywords found in the text, with their weights, per label"""
+        text = text.lower()
+        length = len(text)
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        matches: Dict[Any, Dict[str, float]] = {}
+        node = 0
+        
+        for position, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            
+            for keyword, label, weight in outputs[node]:
+                start = position - len(keyword) + 1
+                if start > 0 and text[start - 1].isalnum():
+                    continue
+                if self.whole_words and position + 1 < length and text[position + 1].isalnum():
+                    continue
+                matches.setdefault(label, {})[keyword] = weight
+        
+        return matches
+    
+    def score(self, text: str) -> Dict[Any, float]:
+        """Return the summed weight of the distinct keywords found in the text per label"""
+        return {label: sum(keywords.values()) for label, keywords in self.match(text).items()}
+    
+    def best_label(self, text: str, candidates: Optional[List[Any]] = None) -> Optional[Any]:
+        """Return the highest scoring label, optionally restricted to candidates"""
+        scores = self.score(text)
+        if candidates is not None:
+            scores = {label: value for label, value in scores.items() if label in candidates}
+        return max(scores, key=scores.get) if scores else None
+    
+    def _add(self, keyword: str, label: Any, weight: float) -> None:
+        node = 0
+        for char in keyword:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+            node = next_node
+        self._outputs[node].append((keyword, label, weight))
+        self.keyword_count += 1
+    
+    def _build_failure_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                # Inherit the keywords that end at the failure node, so each position needs one lookup
+                self._outputs[child] = self._outputs[child] + self._outputs[self._fail[child]]
+
+def create_routing_matcher() -> KeywordMatcher:
+    """Create the conversation routing matcher, from ROUTING_KEYWORDS_FILE when it is set"""
+    path = os.getenv("ROUTING_KEYWORDS_FILE")
+    if path:
+        logger.info(f"Loading routing keywords from {path}")
+        return KeywordMatcher.from_file(path)
+    return KeywordMatcher(DEFAULT_ROUTING_KEYWORDS)
+
+def read_conversation_requests(path: str) -> Iterator[ConversationRequest]:
+    """Stream conversation requests from a JSON Lines transcript file, one request per line"""
+    with open(path) as transcript_file:
+        for line in transcript_file:
+            if line.strip():
+                yield from_dict(ConversationRequest, json.loads(line))
+
+class SqliteDecisionStore:
+    """Routing decision store in a local SQLite file, shared by worker processes on the same machine"""
+    
+    def __init__(self, path: str, purge_interval: float = 60.0):
+        self.path = path
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._next_purge = time.monotonic() + purge_interval
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS decisions (key TEXT PRIMARY KEY, decision TEXT, expires_at REAL)")
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the stored decision for the key, or None when missing or expired"""
+        row = self._connect().execute("SELECT decision, expires_at FROM decisions WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(row[0])
+    
+    def put(self, key: str, decision: Dict[str, Any], ttl: float) -> None:
+        """Store a decision that expires after ttl seconds"""
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO decisions (key, decision, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(decision), time.time() + ttl))
+        
+        # Expired rows are never read again, so clear them out periodically instead of letting the file grow
+        if time.monotonic() >= self._next_purge:
+            self._next_purge = time.monotonic() + self.purge_interval
+            self.purge_expired()
+    
+    def purge_expired(self) -> int:
+        """Delete expired decisions, returning how many were removed"""
+        with self._connect() as connection:
+            return connection.execute("DELETE FROM decisions WHERE expires_at <= ?", (time.time(),)).rowcount
+    
+    def _connect(self) -> sqlite3.Connection:
+        # SQLite connections cannot be shared between threads, so keep one per thread
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0)
+            self._local.connection = connection
+        return connection
+
+class RoutingDecisionCache:
+    """Bounded LRU cache of routing decisions with a time-to-live, optionally backed by a shared store"""
+    
+    def __init__(self, max_entries: int = 10000, ttl: float = 300.0, context_keys: Optional[List[str]] = None,
+                 shared_store: Optional[SqliteDecisionStore] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.context_keys = sorted(context_keys or [])
+        self.shared_store = shared_store
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def key(self, request: ConversationRequest) -> str:
+        """Build the cache key from the normalized message, routing preference and relevant context"""
+        message = " ".join(re.findall(r"\w+", request.message.lower()))
+        context = request.context or {}
+        relevant = [[name, context.get(name)] for name in self.context_keys]
+        raw = json.dumps([message, request.routing_preference.value, relevant], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def get(self, request: ConversationRequest) -> Optional[AgentRoutingDecision]:
+        """Return a cached decision for the request, or None"""
+        key = self.key(request)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return from_dict(AgentRoutingDecision, entry[1])
+                del self._entries[key]
+        
+        if self.shared_store is not None:
+            data = self.shared_store.get(key)
+            if data is not None:
+                self._store(key, data)
+                with self._lock:
+                    self.shared_hits += 1
+                return from_dict(AgentRoutingDecision, data)
+        
+        with self._lock:
+            self.misses += 1
+        return None
+    
+    def put(self, request: ConversationRequest, decision: AgentRoutingDecision) -> None:
+        """Cache a decision for the request"""
+        key = self.key(request)
+        data = to_dict(decision)
+        self._store(key, data)
+        if self.shared_store is not None:
+            self.shared_store.put(key, data, self.ttl)
+    
+    def clear(self) -> None:
+        """Drop every locally cached decision"""
+        with self._lock:
+            self._entries.clear()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current counters, including the hit rate"""
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "hits": self.hits,
+            "sharedHits": self.shared_hits,
+            "misses": self.misses,
+            "hitRate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "maxEntries": self.max_entries
+        }
+    
+    def _store(self, key: str, data: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+class ConversationAffinity:
+    """Remembers the routing decision of each conversation while its agent is mid-topic"""
+    
+    def __init__(self, max_conversations: int = 10000, ttl: float = 1800.0):
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._decisions: "OrderedDict[str, Tuple[float, AgentRoutingDecision]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def apply(self, request: ConversationRequest) -> ConversationRequest:
+        """Return the request with the conversation's sticky routing decision attached, if there is one"""
+        if request.routing_decision is not None or request.routing_preference != AgentRoutingPreference.AUTO or not request.conversation_id:
+            return request
+        
+        with self._lock:
+            entry = self._decisions.get(request.conversation_id)
+            if entry is None or entry[0] <= time.monotonic():
+                self._decisions.pop(request.conversation_id, None)
+                self.misses += 1
+                return request
+            self._decisions.move_to_end(request.conversation_id)
+            self.hits += 1
+        return replace(request, routing_decision=entry[1])
+    
+    def record(self, response: AgentResponse) -> None:
+        """Keep the response's routing decision while a follow-up is expected, otherwise release the conversation"""
+        if not response.conversation_id:
+            return
+        
+        with self._lock:
+            if response.requires_follow_up and response.routing_decision is not None:
+                self._decisions[response.conversation_id] = (time.monotonic() + self.ttl, response.routing_decision)
+                self._decisions.move_to_end(response.conversation_id)
+                while len(self._decisions) > self.max_conversations:
+                    self._decisions.popitem(last=False)
+            else:
+                self._decisions.pop(response.conversation_id, None)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current counters"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": self.hits / lookups if lookups else 0.0,
+            "conversations": len(self._decisions)
+        }
+
+def create_routing_cache() -> Optional[RoutingDecisionCache]:
+    """Create the routing decision cache from the ROUTING_CACHE_* environment variables, or None when disabled"""
+    max_entries = int(os.getenv("ROUTING_CACHE_SIZE", "10000"))
+    if max_entries <= 0:
+        return None
+    
+    context_keys = [name.strip() for name in os.getenv("ROUTING_CACHE_CONTEXT_KEYS", "").split(",") if name.strip()]
+    path = os.getenv("ROUTING_CACHE_FILE")
+    shared_store = SqliteDecisionStore(path) if path else None
+    if shared_store is not None:
+        logger.info(f"Sharing routing decisions through {path}")
+    
+    return RoutingDecisionCache(max_entries, float(os.getenv("ROUTING_CACHE_TTL", "300")), context_keys, shared_store)
@@ -0,0 +1,425 @@
+"""
+Shared asyncio runtime for Copilot Studio extensibility activities
+"""
+
+import asyncio
+import concurrent.futures
+import copy
+import functools
+import inspect
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from durabletask import task
+from durabletask.azuremanaged.worker import DurableTaskSchedulerWorker
+from durabletask.internal import helpers as ph, orchestrator_service_pb2 as pb, tracing, type_discovery
+from durabletask.payload import helpers as payload_helpers
+from durabletask.worker import _AsyncWorkerManager
+from scheduling import WorkScheduler
+
+logger = logging.getLogger(__name__)
+
+class ActivityRuntime:
+    """Runs activity coroutines on one long-lived event loop in a background thread"""
+    
+    def __init__(self, name: str = "activity-runtime"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+    
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The runtime's event loop, started on first use"""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._start()
+            return self._loop
+    
+    def submit(self, coro: Awaitable[Any]) -> concurrent.futures.Future:
+        """Schedule a coroutine on the runtime loop and return a future for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    
+    async def run_async(self, coro: Awaitable[Any]) -> Any:
+        """Run a coroutine on the runtime loop and await its result from another event loop"""
+        return await asyncio.wrap_future(self.submit(coro))
+    
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """Run a coroutine on the runtime loop and wait for its result"""
+        loop = self.loop
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("ActivityRuntime.run() cannot be called from the runtime loop itself")
+        
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+    
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stop the runtime loop, cancelling anything still running on it"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop, self._thread = None, None
+        
+        if loop is None or loop.is_closed():
+            return
+        
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.warning(f"Activity runtime thread {self.name} did not stop within {timeout}s")
+    
+    def _start(self) -> None:
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+        
+        def run_loop():
+            asyncio.set_event_loop(loop)
+            loop.call_soon(started.set)
+            try:
+                loop.run_forever()
+            finally:
+                self._shutdown_loop(loop)
+        
+        self._thread = threading.Thread(target=run_loop, name=self.name, daemon=True)
+        self._thread.start()
+        started.wait()
+        self._loop = loop
+        logger.info(f"Started activity runtime loop on thread {self.name}")
+    
+    @staticmethod
+    def _shutdown_loop(loop: asyncio.AbstractEventLoop) -> None:
+        try:
+            pending = asyncio.all_tasks(loop)
+            for pending_task in pending:
+                pending_task.cancel()
+            if pending:
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            loop.close()
+
+class _AwaitingWorkerManager(_AsyncWorkerManager):
+    """Work item manager that also awaits coroutines handed back by handlers it ran on the thread pool"""
+    
+    async def _run_func(self, func: Any, *args: Any, **kwargs: Any) -> Any:
+        # The worker wraps each handler so its gRPC channel is released when the handler returns. A handler that
+        # hands back a coroutine still needs the channel to report its result, so release it after the coroutine
+        handler, release = _unwrap_release(func)
+        try:
+            result = await super()._run_func(handler, *args, **kwargs)
+            if inspect.isawaitable(result):
+                return await result
+            return result
+        finally:
+            release()
+
+# Free variables of the SDK's wrap_with_release closure (durabletask 1.11)
+_RELEASE_WRAPPER_FREEVARS = ("handler", "release")
+
+def _unwrap_release(func: Any) -> Tuple[Any, Callable[[], None]]:
+    code = getattr(func, "__code__", None)
+    if code is None or code.co_freevars != _RELEASE_WRAPPER_FREEVARS:
+        raise RuntimeError(f"Unexpected work item handler {func!r}; the durabletask version is not supported")
+    handler, release = (cell.cell_contents for cell in func.__closure__)
+    return handler, release
+
+def _has_release_wrapper(code: Any) -> bool:
+    """Whether code defines the SDK's wrap_with_release closure, searching nested functions"""
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            if const.co_name == "wrapped" and const.co_freevars == _RELEASE_WRAPPER_FREEVARS:
+                return True
+            if _has_release_wrapper(const):
+                return True
+    return False
+
+class AsyncActivityWorkerMixin:
+    """Worker mixin that awaits `async def` activities on the worker's event loop instead of blocking a pool thread,
+    and admits activities and orchestrations through per-registration concurrency limits and priorities"""
+    
+    def __init__(self, *args: Any, activity_capacity: Optional[int] = None, orchestration_capacity: Optional[int] = None,
+                 **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        # Awaiting handlers relies on how the SDK wraps them, so refuse to start on an SDK that wraps them differently
+        if not _has_release_wrapper(self._async_run_loop.__code__):
+            raise RuntimeError(f"{type(self).__name__} requires durabletask 1.11.x, which releases gRPC channels "
+                               f"through wrap_with_release; see requirements.txt")
+        # The schedulers enforce the worker's concurrency limits, so the work item manager dequeues every item
+        # straight away and work queued in a scheduler never holds an SDK permit that other work is waiting for
+        options = self._concurrency_options
+        self.activity_scheduler = WorkScheduler(activity_capacity or options.maximum_concurrent_activity_work_items)
+        self.orchestration_scheduler = WorkScheduler(
+            orchestration_capacity or options.maximum_concurrent_orchestration_work_items)
+        manager_options = copy.copy(options)
+        manager_options.maximum_concurrent_activity_work_items = sys.maxsize
+        manager_options.maximum_concurrent_orchestration_work_items = sys.maxsize
+        self._async_worker_manager = _AwaitingWorkerManager(manager_options, self._logger)
+    
+    def add_activity(self, fn: Any, max_concurrency: Optional[int] = None, priority: int = 0) -> str:
+        """Register an activity, optionally capping how many run at once and ranking it against other queued work"""
+        name = super().add_activity(fn)
+        if max_concurrency is not None or priority:
+            self.activity_scheduler.configure(name, max_concurrency, priority)
+        return name
+    
+    def add_orchestrator(self, fn: Any, max_concurrency: Optional[int] = None, priority: int = 0) -> str:
+        """Register an orchestrator, optionally capping how many execute at once and ranking it against other queued work"""
+        name = super().add_orchestrator(fn)
+        if max_concurrency is not None or priority:
+            self.orchestration_scheduler.configure(name, max_concurrency, priority)
+        return name
+    
+    def _execute_activity(self, req: Any, stub: Any, completionToken: Any) -> Any:
+        # The SDK calls activity handlers through a synchronous wrapper on its thread pool, so the activity is
+        # returned as a coroutine for the work item manager to await on the worker loop once the scheduler admits it
+        if inspect.iscoroutinefunction(self._registry.get_activity(req.name)):
+            execute = self._execute_async_activity
+        else:
+            execute = self._in_thread_pool(super()._execute_activity)
+        return self._execute_scheduled(self.activity_scheduler, req.name, execute, req, stub, completionToken)
+    
+    def _execute_orchestrator(self, req: Any, stub: Any, completionToken: Any) -> Any:
+        execute = self._in_thread_pool(super()._execute_orchestrator)
+        return self._execute_scheduled(self.orchestration_scheduler, _orchestration_name(req), execute,
+                                       req, stub, completionToken)
+    
+    async def _execute_scheduled(self, scheduler: WorkScheduler, name: str,
+                                 execute: Callable[..., Awaitable[Any]], *args: Any) -> None:
+        async with scheduler.slot(name):
+            await execute(*args)
+    
+    def _in_thread_pool(self, func: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+        async def run(*args: Any) -> Any:
+            return await asyncio.get_running_loop().run_in_executor(self._async_worker_manager.thread_pool, func, *args)
+        
+        return run
+    
+    async def _execute_async_activity(self, req: Any, stub: Any, completionToken: Any) -> None:
+        fn = self._registry.get_activity(req.name)
+        instance_id = req.orchestrationInstance.instanceId
+        self._on_activity_execution_started(req)
+        try:
+            try:
+                if self._payload_store is not None:
+                    await payload_helpers.deexternalize_payloads_async(req, self._payload_store)
+                input_type = type_discovery.activity_input_type(fn, self._data_converter) if req.input.value else None
+                activity_input = self._data_converter.deserialize(req.input.value, input_type)
+                
+                with tracing.suppress_span_emission(not self._emit_trace_spans):
+                    with tracing.start_span(
+                        tracing.create_span_name("activity", req.name),
+                        trace_context=req.parentTraceContext,
+                        kind=tracing.SpanKind.SERVER,
+                        attributes={
+                            tracing.ATTR_TASK_TYPE: "activity",
+                            tracing.ATTR_TASK_INSTANCE_ID: instance_id,
+                            tracing.ATTR_TASK_NAME: req.name,
+                            tracing.ATTR_TASK_TASK_ID: str(req.taskId),
+                        },
+                    ) as span:
+                        try:
+                            result = await fn(task.ActivityContext(instance_id, req.taskId), activity_input)
+                        except Exception as ex:
+                            tracing.set_span_error(span, ex)
+                            raise
+                
+                res = pb.ActivityResponse(
+                    instanceId=instance_id,
+                    taskId=req.taskId,
+                    result=ph.get_string_value(self._data_converter.serialize(result)),
+                    completionToken=completionToken
+                )
+            except Exception as ex:
+                res = pb.ActivityResponse(
+                    instanceId=instance_id,
+                    taskId=req.taskId,
+                    failureDetails=ph.new_failure_details(ex, self._exception_properties_provider, self._logger),
+                    completionToken=completionToken
+                )
+            
+            try:
+                if self._payload_store is not None:
+                    await payload_helpers.externalize_payloads_async(res, self._payload_store, instance_id=instance_id)
+                # The gRPC stub is synchronous
+                await asyncio.get_running_loop().run_in_executor(
+                    self._async_worker_manager.thread_pool, stub.CompleteActivityTask, res)
+            except Exception as ex:
+                self._logger.exception(
+                    f"Failed to deliver activity response for '{req.name}#{req.taskId}' of orchestration ID '{instance_id}': {ex}")
+        finally:
+            self._on_activity_execution_completed(req)
+
+def _orchestration_name(req: Any) -> str:
+    for event in itertools.chain(req.pastEvents, req.newEvents):
+        if event.HasField("executionStarted"):
+            return event.executionStarted.name
+    return ""
+
+class AsyncDurableTaskSchedulerWorker(AsyncActivityWorkerMixin, DurableTaskSchedulerWorker):
+    """Durable Task Scheduler worker that accepts `async def` activities"""
+
+class ProcessPoolActivities:
+    """Runs opted-in CPU-bound activities in a shared process pool, so they do not compete with the worker for the GIL"""
+    
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self._executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+    
+    @property
+    def executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        """The process pool, started on first use"""
+        with self._lock:
+            if self._executor is None:
+                # Spawned processes import the activity's module fresh instead of copying the worker's threads and sockets
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+    
+    def wrap(self, fn: Callable[[Any, Any], Any], finish: Optional[Callable[[Any], Any]] = None,
+             name: Optional[str] = None) -> Callable[[Any, Any], Awaitable[Any]]:
+        """Return an async activity named after fn, or name, that runs fn in the pool; fn must be a module-level function.
+        finish, when given, runs on the result back in the worker process, for steps that need the worker's own state"""
+        @functools.wraps(fn)
+        async def activity(ctx: Any, input_data: Any = None) -> Any:
+            self.submitted += 1
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(self.executor, fn, ctx, input_data)
+            except Exception:
+                self.failed += 1
+                raise
+            self.completed += 1
+            return finish(result) if finish is not None else result
+        
+        if name is not None:
+            activity.__name__ = activity.__qualname__ = name
+        return activity
+    
+    def shutdown(self) -> None:
+        """Stop the pool once running activities finish"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current counters"""
+        return {
+            "maxWorkers": self.max_workers or os.cpu_count(),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+class WorkerHost:
+    """Runs a started worker until SIGTERM or SIGINT, then stops fetching work, drains it within a deadline and flushes metrics"""
+    
+    def __init__(self, worker: Any, drain_timeout: float = 30.0, exit_on_timeout: bool = True):
+        self.worker = worker
+        self.drain_timeout = drain_timeout
+        self.exit_on_timeout = exit_on_timeout
+        self.drain_duration: Optional[float] = None
+        self._shutdown_callbacks: List[Callable[[], Any]] = []
+        self._stop_requested = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop_event: Optional[asyncio.Event] = None
+    
+    def on_shutdown(self, callback: Callable[[], Any]) -> None:
+        """Run a function or coroutine function after the drain, e.g. to stop services and log their stats"""
+        self._shutdown_callbacks.append(callback)
+    
+    def request_stop(self) -> None:
+        """Start the shutdown as if the process had received SIGTERM; safe to call from any thread"""
+        self._stop_requested.set()
+        if self._loop is not None and self._stop_event is not None:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+    
+    async def run(self) -> bool:
+        """Wait for a stop signal, drain the worker and run the shutdown callbacks; returns whether the drain finished in time"""
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        if self._stop_requested.is_set():
+            self._stop_event.set()
+        
+        handled = []
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                self._loop.add_signal_handler(signum, self._stop_event.set)
+                handled.append(signum)
+        try:
+            await self._stop_event.wait()
+        finally:
+            for signum in handled:
+                self._loop.remove_signal_handler(signum)
+        
+        logger.info(f"Shutdown requested, draining in-flight work for up to {self.drain_timeout}s")
+        started = time.monotonic()
+        drained = await self._drain()
+        self.drain_duration = time.monotonic() - started
+        if drained:
+            logger.info(f"Worker drained in {self.drain_duration:.2f}s")
+        else:
+            logger.warning(f"Worker did not drain within {self.drain_timeout}s; the scheduler will redeliver unfinished work")
+        
+        for callback in self._shutdown_callbacks:
+            try:
+                result = callback()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as ex:
+                logger.warning(f"Shutdown callback {getattr(callback, '__name__', callback)} failed: {ex}")
+        
+        if not drained and self.exit_on_timeout:
+            # Work still running would keep the process alive past the deadline
+            logging.shutdown()
+            os._exit(1)
+        return drained
+    
+    async def _drain(self) -> bool:
+        # worker.stop() cancels the work item stream first, then blocks until in-flight work completes, so it runs
+        # on a daemon thread that can be abandoned at the deadline
+        loop = asyncio.get_running_loop()
+        stopped = loop.create_future()
+        
+        def stop() -> None:
+            try:
+                self.worker.stop()
+            finally:
+                loop.call_soon_threadsafe(lambda: stopped.done() or stopped.set_result(None))
+        
+        threading.Thread(target=stop, name="worker-drain", daemon=True).start()
+        try:
+            await asyncio.wait_for(asyncio.shield(stopped), self.drain_timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+def profile_imports(module: str, top: int = 15) -> List[Tuple[str, float]]:
+    """Import a module in a fresh interpreter with -X importtime and return its slowest direct imports in seconds"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    
+    # Lines look like "import time:  self [us] | cumulative | imported package", nested imports indented by depth
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.startswith("   ") and not name.startswith("    "):
+            imports.append((name.strip(), int(cumulative) / 1_000_000))
+    
+    return sorted(imports, key=lambda item: item[1], reverse=True)[:top]
@@ -0,0 +1,142 @@
+"""
+Priority scheduling and per-registration concurrency limits for worker activities and orchestrators
+"""
+
+import asyncio
+import bisect
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class WorkLimit:
+    """Concurrency limit and priority declared when an activity or orchestrator is registered"""
+    max_concurrency: Optional[int] = None
+    priority: int = 0
+
+@dataclass
+class WorkStats:
+    """Queue and wait counters for one registered name"""
+    running: int = 0
+    queued: int = 0
+    max_queued: int = 0
+    admitted: int = 0
+    waited: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+class WorkScheduler:
+    """Admits work items by priority, within an overall capacity and the concurrency limit of each registered name"""
+    
+    def __init__(self, capacity: Optional[int] = None):
+        self.capacity = capacity
+        self.running = 0
+        self._limits: Dict[str, WorkLimit] = {}
+        self._stats: Dict[str, WorkStats] = {}
+        # Kept sorted by (-priority, arrival), so the first admissible waiter is the one to run next
+        self._waiters: List[Tuple[int, int, str, asyncio.Future]] = []
+        self._sequence = itertools.count()
+    
+    def configure(self, name: str, max_concurrency: Optional[int] = None, priority: int = 0) -> None:
+        """Declare the concurrency limit and priority for a name"""
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError(f"max_concurrency for {name} must be at least 1")
+        self._limits[name] = WorkLimit(max_concurrency, priority)
+    
+    async def acquire(self, name: str) -> float:
+        """Wait until the name may run another work item, take the slot and return how long it waited"""
+        stats = self._stats.setdefault(name, WorkStats())
+        if not self._can_run(name):
+            started = time.monotonic()
+            future = asyncio.get_running_loop().create_future()
+            entry = (-self._limit(name).priority, next(self._sequence), name, future)
+            bisect.insort(self._waiters, entry)
+            stats.queued += 1
+            stats.max_queued = max(stats.max_queued, stats.queued)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Admitted just as the caller gave up, so hand the slot on
+                    self.release(name)
+                else:
+                    self._waiters.remove(entry)
+                    stats.queued -= 1
+                raise
+            
+            wait = time.monotonic() - started
+            stats.waited += 1
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+            return wait
+        
+        self._admit(name)
+        return 0.0
+    
+    def release(self, name: str) -> None:
+        """Give back a slot taken with acquire and admit whichever waiters can now run"""
+        self.running -= 1
+        self._stats[name].running -= 1
+        self._dispatch()
+    
+    @asynccontextmanager
+    async def slot(self, name: str) -> AsyncIterator[float]:
+        """Hold a slot for the duration of the block"""
+        wait = await self.acquire(name)
+        try:
+            yield wait
+        finally:
+            self.release(name)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the queue depth and wait times for every name that has had work"""
+        names = {}
+        for name, stats in self._stats.items():
+            limit = self._limit(name)
+            names[name] = {
+                "maxConcurrency": limit.max_concurrency,
+                "priority": limit.priority,
+                "running": stats.running,
+                "queued": stats.queued,
+                "maxQueued": stats.max_queued,
+                "admitted": stats.admitted,
+                "waited": stats.waited,
+                "avgWaitMs": round(stats.total_wait / stats.admitted * 1000, 1) if stats.admitted else 0.0,
+                "maxWaitMs": round(stats.max_wait * 1000, 1)
+            }
+        return {"capacity": self.capacity, "running": self.running, "queued": len(self._waiters), "names": names}
+    
+    def _limit(self, name: str) -> WorkLimit:
+        return self._limits.get(name) or WorkLimit()
+    
+    def _can_run(self, name: str) -> bool:
+        if self.capacity is not None and self.running >= self.capacity:
+            return False
+        max_concurrency = self._limit(name).max_concurrency
+        return max_concurrency is None or self._stats[name].running < max_concurrency
+    
+    def _admit(self, name: str) -> None:
+        stats = self._stats[name]
+        stats.running += 1
+        stats.admitted += 1
+        self.running += 1
+    
+    def _dispatch(self) -> None:
+        # A waiter held back by its own limit does not block lower-priority names behind it
+        index = 0
+        while index < len(self._waiters):
+            if self.capacity is not None and self.running >= self.capacity:
+                return
+            _, _, name, future = self._waiters[index]
+            if future.cancelled() or not self._can_run(name):
+                index += 1
+                continue
+            del self._waiters[index]
+            self._stats[name].queued -= 1
+            self._admit(name)
+            future.set_result(None)
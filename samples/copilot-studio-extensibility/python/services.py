@@ -4,28 +4,253 @@ Services for Power Platform and Copilot Studio integration
 
 import asyncio
 import aiohttp
+import copy
 import json
-import subprocess
+import os
 import logging
-from typing import Dict, List, Optional, Any
-from azure.identity import DefaultAzureCredential
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import cached_property
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 from models import *
+from resilience import CircuitBreakers, RateLimiter, ThrottledError, parse_retry_after
+from routing import KeywordMatcher, RoutingDecisionCache, create_routing_cache, create_routing_matcher
 
 logger = logging.getLogger(__name__)
 
+POWER_PLATFORM_SCOPE = "https://service.powerapps.com/.default"
+COPILOT_STUDIO_ENDPOINT = "copilot_studio_conversations"
+
+class TokenCache:
+    """Access token cache keyed by scope that refreshes tokens before they expire"""
+    
+    def __init__(self, credential, refresh_margin: float = 300.0):
+        self.credential = credential
+        self.refresh_margin = refresh_margin
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self._tokens: Dict[str, Any] = {}
+        self._pending: Dict[str, asyncio.Task] = {}
+    
+    async def get_token(self, scope: str) -> str:
+        """Get a token for the scope, only waiting on the credential when none is usable"""
+        token = self._tokens.get(scope)
+        remaining = token.expires_on - time.time() if token else 0
+        
+        if remaining > 0:
+            self.hits += 1
+            if remaining <= self.refresh_margin:
+                # Refresh in the background while the current token is still valid
+                self._get_pending_fetch(scope, background=True)
+            return token.token
+        
+        self.misses += 1
+        token = await asyncio.shield(self._get_pending_fetch(scope))
+        return token.token
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current counters"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "refreshFailures": self.refresh_failures,
+            "scopes": len(self._tokens)
+        }
+    
+    def _get_pending_fetch(self, scope: str, background: bool = False) -> asyncio.Task:
+        """Get the in-flight fetch for the scope, starting one if needed"""
+        loop = asyncio.get_running_loop()
+        task = self._pending.get(scope)
+        if task is None or task.done() or task.get_loop() is not loop:
+            task = loop.create_task(self._fetch(scope))
+            self._pending[scope] = task
+            if background:
+                self.refreshes += 1
+                task.add_done_callback(self._on_background_refresh_done)
+        return task
+    
+    async def _fetch(self, scope: str):
+        # The credential is synchronous, keep it off the event loop
+        loop = asyncio.get_running_loop()
+        token = await loop.run_in_executor(None, self.credential.get_token, scope)
+        self._tokens[scope] = token
+        return token
+    
+    def _on_background_refresh_done(self, task: asyncio.Task) -> None:
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self.refresh_failures += 1
+            logger.warning(f"Background token refresh failed: {task.exception()}")
+
+
+class ConnectionPoolStats:
+    """Connection pool counters collected through aiohttp request tracing"""
+    
+    def __init__(self):
+        self.requests = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.queued_requests = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+    
+    def create_trace_config(self) -> aiohttp.TraceConfig:
+        """Create a trace config that feeds this instance"""
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_connection_queued_start.append(self._on_connection_queued_start)
+        trace_config.on_connection_queued_end.append(self._on_connection_queued_end)
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        return trace_config
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current counters, including the reuse ratio and wait times"""
+        acquired = self.connections_created + self.connections_reused
+        return {
+            "requests": self.requests,
+            "connectionsCreated": self.connections_created,
+            "connectionsReused": self.connections_reused,
+            "reuseRatio": self.connections_reused / acquired if acquired else 0.0,
+            "queuedRequests": self.queued_requests,
+            "averageWaitTime": self.total_wait_time / self.queued_requests if self.queued_requests else 0.0,
+            "maxWaitTime": self.max_wait_time
+        }
+    
+    async def _on_request_start(self, session, trace_config_ctx, params):
+        self.requests += 1
+    
+    async def _on_connection_queued_start(self, session, trace_config_ctx, params):
+        trace_config_ctx.queued_at = asyncio.get_running_loop().time()
+    
+    async def _on_connection_queued_end(self, session, trace_config_ctx, params):
+        wait_time = asyncio.get_running_loop().time() - trace_config_ctx.queued_at
+        self.queued_requests += 1
+        self.total_wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+    
+    async def _on_connection_create_end(self, session, trace_config_ctx, params):
+        self.connections_created += 1
+    
+    async def _on_connection_reuseconn(self, session, trace_config_ctx, params):
+        self.connections_reused += 1
+
+
+# Calls that may share one upstream request when identical ones are in flight:
+# start_topic covers Copilot Studio messages that start a topic outside an existing conversation
+DEFAULT_COALESCED_OPERATIONS = ("start_topic", "get_copilot_studio_topics", "get_environment_info")
+
+class SingleFlight:
+    """Lets concurrent identical calls share one execution and its result"""
+    
+    def __init__(self):
+        self.executions = 0
+        self.coalesced = 0
+        self._pending: Dict[str, asyncio.Task] = {}
+    
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Run factory() unless an identical call is already in flight, returning a private copy of the result"""
+        loop = asyncio.get_running_loop()
+        task = self._pending.get(key)
+        if task is not None and not task.done() and task.get_loop() is loop:
+            self.coalesced += 1
+        else:
+            self.executions += 1
+            task = loop.create_task(factory())
+            self._pending[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        
+        # Waiters must not see each other's changes to the shared result
+        return copy.deepcopy(await asyncio.shield(task))
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current counters"""
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "inFlight": sum(1 for task in self._pending.values() if not task.done())
+        }
+    
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._pending.get(key) is task:
+            del self._pending[key]
+
+
 class PowerPlatformGraphService:
     """Service for interacting with Power Platform via Microsoft Graph and REST APIs"""
     
-    def __init__(self):
+    def __init__(self, pool_limit: Optional[int] = None, pool_limit_per_host: Optional[int] = None,
+                 dns_cache_ttl: Optional[int] = None, keepalive_timeout: Optional[float] = None,
+                 coalesced_operations: Optional[List[str]] = None):
         self.environment_url = os.getenv("POWER_PLATFORM_ENVIRONMENT_URL")
         if not self.environment_url:
             raise ValueError("POWER_PLATFORM_ENVIRONMENT_URL environment variable is required")
         
-        self.credential = DefaultAzureCredential()
+        self.token_refresh_margin = float(os.getenv("POWER_PLATFORM_TOKEN_REFRESH_MARGIN", "300"))
+        
+        # Connection pool settings, shared by every request made through this service
+        self.pool_limit = pool_limit or int(os.getenv("POWER_PLATFORM_HTTP_POOL_LIMIT", "100"))
+        self.pool_limit_per_host = pool_limit_per_host or int(os.getenv("POWER_PLATFORM_HTTP_POOL_LIMIT_PER_HOST", "20"))
+        self.dns_cache_ttl = dns_cache_ttl or int(os.getenv("POWER_PLATFORM_HTTP_DNS_CACHE_TTL", "300"))
+        self.keepalive_timeout = keepalive_timeout or float(os.getenv("POWER_PLATFORM_HTTP_KEEPALIVE_TIMEOUT", "60"))
+        self.pool_stats = ConnectionPoolStats()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+        
+        # Identical idempotent requests in flight at the same time share one upstream call
+        if coalesced_operations is None:
+            configured = os.getenv("POWER_PLATFORM_COALESCE", ",".join(DEFAULT_COALESCED_OPERATIONS))
+            coalesced_operations = [name.strip() for name in configured.split(",") if name.strip()]
+        self.coalesced_operations = set(coalesced_operations)
+        self.single_flight = SingleFlight()
+        
+        # Per-endpoint token bucket and AIMD concurrency limit, so throttling settles at a sustainable rate
+        self.rate_limiter = RateLimiter(
+            rate=float(os.getenv("POWER_PLATFORM_RATE_LIMIT", "20")),
+            burst=float(os.getenv("POWER_PLATFORM_RATE_BURST", "40")),
+            max_concurrency=int(os.getenv("POWER_PLATFORM_MAX_CONCURRENCY", "20")),
+            min_concurrency=int(os.getenv("POWER_PLATFORM_MIN_CONCURRENCY", "1"))
+        )
+        self.max_throttle_retries = int(os.getenv("POWER_PLATFORM_THROTTLE_RETRIES", "5"))
+        
+        # Per-endpoint circuit breakers, so a degraded endpoint fails fast instead of tying up workers
+        self.circuit_breakers = CircuitBreakers(
+            failure_threshold=int(os.getenv("POWER_PLATFORM_CIRCUIT_FAILURE_THRESHOLD", "5")),
+            probe_interval=float(os.getenv("POWER_PLATFORM_CIRCUIT_PROBE_INTERVAL", "30"))
+        )
+        self.request_timeout = float(os.getenv("POWER_PLATFORM_REQUEST_TIMEOUT", "30"))
+        
+        # How many flows of one batch are triggered at the same time
+        self.flow_batch_concurrency = int(os.getenv("POWER_AUTOMATE_BATCH_CONCURRENCY", "10"))
+        
         logger.info(f"Initialized PowerPlatformGraphService for environment: {self.environment_url}")
     
+    @cached_property
+    def credential(self):
+        """Azure credential, created on first use because azure.identity is slow to import"""
+        from azure.identity import DefaultAzureCredential
+        return DefaultAzureCredential()
+    
+    @cached_property
+    def token_cache(self) -> TokenCache:
+        """Access token cache, created with the credential on first use"""
+        return TokenCache(self.credential, refresh_margin=self.token_refresh_margin)
+    
     async def send_message_to_copilot_studio(self, request: CopilotStudioRequest) -> CopilotStudioResponse:
         """Send a message to Copilot Studio bot"""
+        is_topic_start = request.topic is not None and not request.conversation_id
+        if "send_message_to_copilot_studio" in self.coalesced_operations or (
+                is_topic_start and "start_topic" in self.coalesced_operations):
+            key = "send_message_to_copilot_studio:" + json.dumps(to_dict(request), sort_keys=True, default=str)
+            return await self.single_flight.do(key, lambda: self._send_message_to_copilot_studio(request))
+        return await self._send_message_to_copilot_studio(request)
+    
+    async def _send_message_to_copilot_studio(self, request: CopilotStudioRequest) -> CopilotStudioResponse:
         logger.info(f"Sending message to Copilot Studio bot {request.bot_id}")
         
         try:
@@ -45,23 +270,22 @@ class PowerPlatformGraphService:
                 "Content-Type": "application/json"
             }
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(endpoint, json=payload, headers=headers) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"Failed to send message to Copilot Studio: {response.status} - {error_text}")
-                        raise Exception(f"Copilot Studio API error: {response.status}")
+            async with self._request(COPILOT_STUDIO_ENDPOINT, "POST", endpoint, json=payload, headers=headers) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    logger.error(f"Failed to send message to Copilot Studio: {response.status} - {error_text}")
+                    raise Exception(f"Copilot Studio API error: {response.status}")
                     
-                    response_data = await response.json()
+                response_data = await response.json()
                     
-                    return CopilotStudioResponse(
-                        message=response_data.get("message", ""),
-                        conversation_id=response_data.get("conversationId", request.conversation_id or ""),
-                        topic=response_data.get("topic"),
-                        variables=response_data.get("variables"),
-                        topic_completed=response_data.get("topicCompleted", False),
-                        next_topic=response_data.get("nextTopic")
-                    )
+                return CopilotStudioResponse(
+                    message=response_data.get("message", ""),
+                    conversation_id=response_data.get("conversationId", request.conversation_id or ""),
+                    topic=response_data.get("topic"),
+                    variables=response_data.get("variables"),
+                    topic_completed=response_data.get("topicCompleted", False),
+                    next_topic=response_data.get("nextTopic")
+                )
         
         except Exception as ex:
             logger.error(f"Error sending message to Copilot Studio bot {request.bot_id}: {ex}")
@@ -69,6 +293,11 @@ class PowerPlatformGraphService:
     
     async def get_copilot_studio_topics(self, bot_id: str) -> List[TopicStatus]:
         """Get topics for a Copilot Studio bot"""
+        if "get_copilot_studio_topics" in self.coalesced_operations:
+            return await self.single_flight.do(f"get_copilot_studio_topics:{bot_id}", lambda: self._get_copilot_studio_topics(bot_id))
+        return await self._get_copilot_studio_topics(bot_id)
+    
+    async def _get_copilot_studio_topics(self, bot_id: str) -> List[TopicStatus]:
         logger.info(f"Retrieving topics for Copilot Studio bot {bot_id}")
         
         try:
@@ -77,31 +306,47 @@ class PowerPlatformGraphService:
             token = await self._get_power_platform_token()
             headers = {"Authorization": f"Bearer {token}"}
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(endpoint, headers=headers) as response:
-                    if response.status != 200:
-                        logger.error(f"Failed to retrieve topics: {response.status}")
-                        return []
-                    
-                    response_data = await response.json()
-                    topics = []
+            async with self._request("copilot_studio_topics", "GET", endpoint, headers=headers) as response:
+                if response.status != 200:
+                    logger.error(f"Failed to retrieve topics: {response.status}")
+                    return []
                     
-                    for topic_data in response_data.get("topics", []):
-                        topics.append(TopicStatus(
-                            topic_id=topic_data.get("id", ""),
-                            name=topic_data.get("name", ""),
-                            status=topic_data.get("status", ""),
-                            variables=topic_data.get("variables"),
-                            last_user_input=topic_data.get("lastUserInput"),
-                            last_updated=topic_data.get("lastUpdated")
-                        ))
-                    
-                    return topics
+                return self.parse_topics(await response.json())
         
         except Exception as ex:
             logger.error(f"Error retrieving topics for bot {bot_id}: {ex}")
             return []
     
+    async def get_json_if_modified(self, path: str, etag: Optional[str] = None, last_modified: Optional[str] = None,
+                                   endpoint: str = "default") -> Tuple[int, Any, Dict[str, str]]:
+        """GET a JSON resource conditionally, returning the status, the body (None unless 200) and the response validators"""
+        token = await self._get_power_platform_token()
+        headers = {"Authorization": f"Bearer {token}"}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        
+        async with self._request(endpoint, "GET", f"{self.environment_url}{path}", headers=headers) as response:
+            validators = {name: response.headers[name] for name in ("ETag", "Last-Modified") if name in response.headers}
+            data = await response.json() if response.status == 200 else None
+            return response.status, data, validators
+    
+    @staticmethod
+    def parse_topics(response_data: Dict[str, Any]) -> List[TopicStatus]:
+        """Parse the topics of a bot management topics response"""
+        return [
+            TopicStatus(
+                topic_id=topic_data.get("id", ""),
+                name=topic_data.get("name", ""),
+                status=topic_data.get("status", ""),
+                variables=topic_data.get("variables"),
+                last_user_input=topic_data.get("lastUserInput"),
+                last_updated=topic_data.get("lastUpdated")
+            )
+            for topic_data in response_data.get("topics", [])
+        ]
+    
     async def trigger_power_automate_flow(self, request: PowerAutomateFlowRequest) -> PowerAutomateFlowResponse:
         """Trigger a Power Automate flow"""
         logger.info(f"Triggering Power Automate flow {request.flow_id}")
@@ -123,25 +368,24 @@ class PowerPlatformGraphService:
                 "Content-Type": "application/json"
             }
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(endpoint, json=payload, headers=headers) as response:
-                    response_data = await response.json()
-                    
-                    if response.status != 200:
-                        logger.error(f"Failed to trigger Power Automate flow: {response.status} - {response_data}")
-                        return PowerAutomateFlowResponse(
-                            flow_id=request.flow_id,
-                            run_id="",
-                            status="Failed",
-                            error_message=f"HTTP {response.status}: {response_data}"
-                        )
+            async with self._request("power_automate_flows", "POST", endpoint, json=payload, headers=headers) as response:
+                response_data = await response.json()
                     
+                if response.status != 200:
+                    logger.error(f"Failed to trigger Power Automate flow: {response.status} - {response_data}")
                     return PowerAutomateFlowResponse(
                         flow_id=request.flow_id,
-                        run_id=response_data.get("runId", ""),
-                        status=response_data.get("status", "Unknown"),
-                        output_data=response_data.get("outputs")
+                        run_id="",
+                        status="Failed",
+                        error_message=f"HTTP {response.status}: {response_data}"
                     )
+                    
+                return PowerAutomateFlowResponse(
+                    flow_id=request.flow_id,
+                    run_id=response_data.get("runId", ""),
+                    status=response_data.get("status", "Unknown"),
+                    output_data=response_data.get("outputs")
+                )
         
         except Exception as ex:
             logger.error(f"Error triggering Power Automate flow {request.flow_id}: {ex}")
@@ -152,8 +396,60 @@ class PowerPlatformGraphService:
                 error_message=str(ex)
             )
     
+    async def trigger_power_automate_flows(self, requests: List[PowerAutomateFlowRequest]) -> List[PowerAutomateFlowResponse]:
+        """Trigger a batch of Power Automate flows concurrently, returning a response per request in order"""
+        logger.info(f"Triggering a batch of {len(requests)} Power Automate flows")
+        semaphore = asyncio.Semaphore(max(self.flow_batch_concurrency, 1))
+        
+        async def trigger(request: PowerAutomateFlowRequest) -> PowerAutomateFlowResponse:
+            async with semaphore:
+                return await self.trigger_power_automate_flow(request)
+        
+        results = await asyncio.gather(*[trigger(request) for request in requests], return_exceptions=True)
+        return [
+            result if not isinstance(result, BaseException) else PowerAutomateFlowResponse(
+                flow_id=request.flow_id,
+                run_id="",
+                status="Error",
+                error_message=str(result)
+            )
+            for request, result in zip(requests, results)
+        ]
+    
+    async def get_flow_run_statuses(self, flow_id: str, run_ids: List[str]) -> List[PowerAutomateFlowResponse]:
+        """Get the status of several runs of one flow in a single call; unknown runs are left out"""
+        endpoint = f"{self.environment_url}/api/flows/{flow_id}/runs"
+        
+        token = await self._get_power_platform_token()
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+        
+        async with self._request("power_automate_runs", "GET", endpoint, params={"runIds": ",".join(run_ids)},
+                                 headers=headers) as response:
+            if response.status != 200:
+                raise Exception(f"Power Automate API error: {response.status}")
+            response_data = await response.json()
+        
+        return [
+            PowerAutomateFlowResponse(
+                flow_id=flow_id,
+                run_id=run.get("runId", ""),
+                status=run.get("status", "Unknown"),
+                output_data=run.get("outputs"),
+                error_message=run.get("error")
+            )
+            for run in response_data.get("runs", [])
+        ]
+    
     async def get_environment_info(self) -> Dict[str, Any]:
         """Get Power Platform environment information"""
+        if "get_environment_info" in self.coalesced_operations:
+            return await self.single_flight.do("get_environment_info", self._get_environment_info)
+        return await self._get_environment_info()
+    
+    async def _get_environment_info(self) -> Dict[str, Any]:
         logger.info("Retrieving Power Platform environment information")
         
         try:
@@ -162,16 +458,15 @@ class PowerPlatformGraphService:
             token = await self._get_power_platform_token()
             headers = {"Authorization": f"Bearer {token}"}
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(endpoint, headers=headers) as response:
-                    if response.status != 200:
-                        logger.warning(f"Failed to retrieve environment info: {response.status}")
-                        return {
-                            "error": f"HTTP {response.status}",
-                            "environmentUrl": self.environment_url
-                        }
+            async with self._request("environment", "GET", endpoint, headers=headers) as response:
+                if response.status != 200:
+                    logger.warning(f"Failed to retrieve environment info: {response.status}")
+                    return {
+                        "error": f"HTTP {response.status}",
+                        "environmentUrl": self.environment_url
+                    }
                     
-                    return await response.json()
+                return await response.json()
         
         except Exception as ex:
             logger.error(f"Error retrieving Power Platform environment information: {ex}")
@@ -180,28 +475,272 @@ class PowerPlatformGraphService:
                 "environmentUrl": self.environment_url
             }
     
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Get connection pool statistics for sizing the pool"""
+        stats = self.pool_stats.snapshot()
+        stats["limit"] = self.pool_limit
+        stats["limitPerHost"] = self.pool_limit_per_host
+        return stats
+    
+    async def close(self) -> None:
+        """Close the shared HTTP session and release pooled connections"""
+        session, self._session = self._session, None
+        session_loop, self._session_loop = self._session_loop, None
+        if session is None or session.closed:
+            return
+        
+        logger.info(f"Closing Power Platform HTTP session, pool stats: {self.get_pool_stats()}")
+        if session_loop is asyncio.get_running_loop():
+            await session.close()
+        else:
+            # The pooled connections belong to another event loop and go away with it
+            session.detach()
+    
+    def get_circuit_states(self) -> Dict[str, Dict[str, Any]]:
+        """Get the circuit breaker state of each endpoint"""
+        return self.circuit_breakers.snapshot()
+    
+    def is_copilot_studio_available(self) -> bool:
+        """Whether Copilot Studio conversations can currently be sent, i.e. their circuit is not open"""
+        return not self.circuit_breakers.is_open(COPILOT_STUDIO_ENDPOINT)
+    
+    def get_rate_limits(self) -> Dict[str, Dict[str, Any]]:
+        """Get the current rate and concurrency limits of each endpoint"""
+        return self.rate_limiter.snapshot()
+    
+    @asynccontextmanager
+    async def _request(self, endpoint: str, method: str, url: str, **kwargs) -> AsyncIterator[aiohttp.ClientResponse]:
+        """Send a request through the endpoint's circuit breaker and limiter, retrying throttled responses after their Retry-After"""
+        breaker = self.circuit_breakers.for_endpoint(endpoint)
+        limiter = self.rate_limiter.for_endpoint(endpoint)
+        session = await self._get_session()
+        
+        for attempt in range(self.max_throttle_retries + 1):
+            breaker.before_request()
+            async with limiter.slot() as generation:
+                try:
+                    response = await session.request(method, url, **kwargs)
+                except asyncio.CancelledError:
+                    breaker.abandon()
+                    raise
+                except Exception:
+                    breaker.on_failure()
+                    raise
+                
+                if response.status != 429 and not (response.status == 503 and "Retry-After" in response.headers):
+                    limiter.on_success()
+                    if response.status >= 500:
+                        breaker.on_failure()
+                    else:
+                        breaker.on_success()
+                    break
+                
+                # A throttling endpoint is healthy, just busy
+                breaker.on_success()
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                response.release()
+            
+            # Without Retry-After, back off exponentially
+            limiter.on_throttle(retry_after if retry_after is not None else min(2.0 ** attempt, 30.0), generation)
+        else:
+            raise ThrottledError(endpoint, retry_after)
+        
+        try:
+            yield response
+        finally:
+            response.release()
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Get the shared HTTP session, creating it on first use"""
+        loop = asyncio.get_running_loop()
+        if self._session is not None and not self._session.closed:
+            if self._session_loop is loop:
+                return self._session
+            
+            logger.debug("Discarding HTTP session bound to a previous event loop")
+            self._session.detach()
+        
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_limit,
+            limit_per_host=self.pool_limit_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+            trace_configs=[self.pool_stats.create_trace_config()]
+        )
+        self._session_loop = loop
+        return self._session
+    
+    def get_coalescing_stats(self) -> Dict[str, Any]:
+        """Get request coalescing statistics"""
+        return {"operations": sorted(self.coalesced_operations), **self.single_flight.snapshot()}
+    
+    def get_token_cache_stats(self) -> Dict[str, Any]:
+        """Get access token cache statistics"""
+        return self.token_cache.snapshot()
+    
     async def _get_power_platform_token(self) -> str:
         """Get access token for Power Platform"""
         try:
-            token = await self.credential.get_token("https://service.powerapps.com/.default")
-            return token.token
+            return await self.token_cache.get_token(POWER_PLATFORM_SCOPE)
         except Exception as ex:
             logger.error(f"Failed to obtain Power Platform access token: {ex}")
             raise
 
 
+# Seconds to cache the results of read-only PAC CLI commands, by command prefix
+DEFAULT_PAC_CACHE_TTLS: Dict[str, float] = {
+    "auth list": 60.0,
+    "org who": 300.0,
+    "chatbot list": 60.0,
+    "chatbot show": 300.0
+}
+
+class PacCommandBroker:
+    """Runs PAC CLI commands with bounded concurrency, coalescing identical in-flight commands and caching results"""
+    
+    def __init__(self, executable: str = "pac", max_concurrency: int = 2, timeout: float = 30.0,
+                 cache_ttls: Optional[Dict[str, float]] = None):
+        self.executable = executable
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.cache_ttls = DEFAULT_PAC_CACHE_TTLS if cache_ttls is None else cache_ttls
+        self.executions = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self._results: Dict[Tuple[str, ...], Tuple[float, Dict[str, Any]]] = {}
+        self._pending: Dict[Tuple[str, ...], asyncio.Task] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+    
+    async def run(self, args: List[str]) -> Dict[str, Any]:
+        """Run a PAC CLI command given as separate arguments, reusing a cached or in-flight result if possible"""
+        key = tuple(args)
+        ttl = self._cache_ttl(key)
+        
+        cached = self._results.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            self.cache_hits += 1
+            return dict(cached[1])
+        
+        loop = asyncio.get_running_loop()
+        task = self._pending.get(key)
+        if task is not None and not task.done() and task.get_loop() is loop:
+            self.coalesced += 1
+        else:
+            task = loop.create_task(self._execute(args))
+            self._pending[key] = task
+            task.add_done_callback(lambda done: self._on_done(key, ttl, done))
+        
+        return dict(await asyncio.shield(task))
+    
+    def invalidate(self, prefix: Optional[List[str]] = None) -> None:
+        """Drop cached results, either all of them or those of commands starting with the prefix"""
+        if prefix is None:
+            self._results.clear()
+            return
+        size = len(prefix)
+        for key in [key for key in self._results if list(key[:size]) == prefix]:
+            del self._results[key]
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current counters"""
+        return {
+            "executions": self.executions,
+            "cacheHits": self.cache_hits,
+            "coalesced": self.coalesced,
+            "timeouts": self.timeouts,
+            "inFlight": sum(1 for task in self._pending.values() if not task.done()),
+            "cachedResults": len(self._results),
+            "maxConcurrency": self.max_concurrency
+        }
+    
+    def _cache_ttl(self, key: Tuple[str, ...]) -> Optional[float]:
+        command = " ".join(key)
+        for prefix, ttl in self.cache_ttls.items():
+            if command == prefix or command.startswith(prefix + " "):
+                return ttl
+        return None
+    
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+    
+    def _on_done(self, key: Tuple[str, ...], ttl: Optional[float], task: asyncio.Task) -> None:
+        if self._pending.get(key) is task:
+            del self._pending[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        
+        result = task.result()
+        if not result["success"]:
+            return
+        if ttl is not None:
+            self._results[key] = (time.monotonic() + ttl, result)
+        else:
+            # Commands without a cache entry may change what the cached commands return
+            self.invalidate()
+    
+    async def _execute(self, args: List[str]) -> Dict[str, Any]:
+        command = " ".join(args)
+        async with self._get_semaphore():
+            self.executions += 1
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    self.executable, *args,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
+            except Exception as ex:
+                logger.error(f"Error executing PAC CLI command: pac {command} - {ex}")
+                return {"success": False, "output": "", "error": str(ex)}
+            
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                process.kill()
+                await process.wait()
+                logger.error(f"PAC CLI command timed out after {self.timeout}s: pac {command}")
+                return {"success": False, "output": "", "error": "Command timed out"}
+            except asyncio.CancelledError:
+                process.kill()
+                raise
+        
+        logger.debug(f"PAC CLI command executed: pac {command} - Exit Code: {process.returncode}")
+        return {
+            "success": process.returncode == 0,
+            "output": stdout.decode().strip(),
+            "error": stderr.decode().strip()
+        }
+
+
 class PacCliService:
     """Service for executing Power Platform CLI (PAC CLI) commands"""
     
-    def __init__(self):
+    def __init__(self, broker: Optional[PacCommandBroker] = None):
         self.environment_url = os.getenv("POWER_PLATFORM_ENVIRONMENT_URL")
         if not self.environment_url:
             raise ValueError("POWER_PLATFORM_ENVIRONMENT_URL environment variable is required")
+        
+        self.broker = broker or PacCommandBroker(
+            executable=os.getenv("PAC_CLI_PATH", "pac"),
+            max_concurrency=int(os.getenv("PAC_CLI_MAX_CONCURRENCY", "2")),
+            timeout=float(os.getenv("PAC_CLI_TIMEOUT", "30"))
+        )
     
     async def is_authenticated(self) -> bool:
         """Check if PAC CLI is authenticated"""
         try:
-            result = await self._execute_pac_command("auth list")
+            result = await self._execute_pac_command(["auth", "list"])
             return result["success"] and result["output"]
         except Exception as ex:
             logger.warning(f"Error checking PAC CLI authentication status: {ex}")
@@ -212,7 +751,7 @@ class PacCliService:
         try:
             logger.info(f"Authenticating with PAC CLI for tenant {tenant_id}")
             
-            result = await self._execute_pac_command(f"auth create --url {self.environment_url} --tenant {tenant_id}")
+            result = await self._execute_pac_command(["auth", "create", "--url", self.environment_url, "--tenant", tenant_id])
             
             if result["success"]:
                 logger.info("Successfully authenticated with PAC CLI")
@@ -225,12 +764,27 @@ class PacCliService:
             logger.error(f"Error during PAC CLI authentication: {ex}")
             return False
     
+    async def get_environment_info(self) -> Dict[str, Any]:
+        """Get details of the environment PAC CLI is connected to"""
+        try:
+            result = await self._execute_pac_command(["org", "who", "--json"])
+            
+            if not result["success"]:
+                logger.error(f"Failed to get PAC CLI environment info: {result['error']}")
+                return {}
+            
+            return self._parse_json_object_output(result["output"])
+        
+        except Exception as ex:
+            logger.error(f"Error getting PAC CLI environment info: {ex}")
+            return {}
+    
     async def list_copilot_studio_bots(self) -> List[Dict[str, Any]]:
         """List Copilot Studio bots via PAC CLI"""
         try:
             logger.info("Listing Copilot Studio bots via PAC CLI")
             
-            result = await self._execute_pac_command("chatbot list --json")
+            result = await self._execute_pac_command(["chatbot", "list", "--json"])
             
             if not result["success"]:
                 logger.error(f"Failed to list Copilot Studio bots: {result['error']}")
@@ -245,12 +799,21 @@ class PacCliService:
             logger.error(f"Error listing Copilot Studio bots: {ex}")
             return []
     
+    async def fetch_copilot_studio_bots(self) -> List[Dict[str, Any]]:
+        """List Copilot Studio bots via PAC CLI, raising when the command or its output fails"""
+        result = await self._execute_pac_command(["chatbot", "list", "--json"])
+        if not result["success"]:
+            raise RuntimeError(f"Failed to list Copilot Studio bots: {result['error']}")
+        
+        output = result["output"].strip()
+        return json.loads(output) if output else []
+    
     async def get_bot_details(self, bot_id: str) -> Dict[str, Any]:
         """Get details for a Copilot Studio bot"""
         try:
             logger.info(f"Getting details for Copilot Studio bot {bot_id}")
             
-            result = await self._execute_pac_command(f"chatbot show --chatbot-id {bot_id} --json")
+            result = await self._execute_pac_command(["chatbot", "show", "--chatbot-id", bot_id, "--json"])
             
             if not result["success"]:
                 logger.error(f"Failed to get bot details: {result['error']}")
@@ -262,43 +825,13 @@ class PacCliService:
             logger.error(f"Error getting bot details for {bot_id}: {ex}")
             return {}
     
-    async def _execute_pac_command(self, command: str) -> Dict[str, Any]:
-        """Execute a PAC CLI command"""
-        try:
-            process = await asyncio.create_subprocess_exec(
-                "pac", *command.split(),
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=30.0)
-            
-            output = stdout.decode().strip()
-            error = stderr.decode().strip()
-            success = process.returncode == 0
-            
-            logger.debug(f"PAC CLI command executed: pac {command} - Exit Code: {process.returncode}")
-            
-            return {
-                "success": success,
-                "output": output,
-                "error": error
-            }
-        
-        except asyncio.TimeoutError:
-            logger.error(f"PAC CLI command timed out: pac {command}")
-            return {
-                "success": False,
-                "output": "",
-                "error": "Command timed out"
-            }
-        except Exception as ex:
-            logger.error(f"Error executing PAC CLI command: pac {command} - {ex}")
-            return {
-                "success": False,
-                "output": "",
-                "error": str(ex)
-            }
+    def get_command_stats(self) -> Dict[str, Any]:
+        """Return PAC CLI execution, cache and coalescing counters"""
+        return self.broker.snapshot()
+    
+    async def _execute_pac_command(self, args: List[str]) -> Dict[str, Any]:
+        """Execute a PAC CLI command through the shared broker"""
+        return await self.broker.run(args)
     
     def _parse_json_array_output(self, output: str) -> List[Dict[str, Any]]:
         """Parse JSON array output"""
@@ -325,17 +858,50 @@ class PacCliService:
             return {}
 
 
+class SpeculationStats:
+    """Counts speculative Azure AI executions and how often their result was used"""
+    
+    def __init__(self):
+        self.speculations = 0
+        self.paid_off = 0
+        self.time_saved = 0.0
+    
+    def record(self, paid_off: bool, time_saved: float = 0.0) -> None:
+        """Record the outcome of one speculative execution"""
+        self.speculations += 1
+        if paid_off:
+            self.paid_off += 1
+            self.time_saved += time_saved
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current counters, including the pay-off rate"""
+        return {
+            "speculations": self.speculations,
+            "paidOff": self.paid_off,
+            "discarded": self.speculations - self.paid_off,
+            "paidOffRate": self.paid_off / self.speculations if self.speculations else 0.0,
+            "timeSaved": self.time_saved
+        }
+
+
 class AgentRoutingService:
     """Service for routing conversations to the appropriate agent"""
     
-    def __init__(self, power_platform_service: PowerPlatformGraphService):
+    def __init__(self, power_platform_service: PowerPlatformGraphService, keyword_matcher: Optional[KeywordMatcher] = None,
+                 decision_cache: Optional[RoutingDecisionCache] = None):
         self.power_platform_service = power_platform_service
+        self.keyword_matcher = keyword_matcher or create_routing_matcher()
+        self.decision_cache = decision_cache if decision_cache is not None else create_routing_cache()
         
         # Initialize Azure AI client if configured
         self.azure_ai_endpoint = os.getenv("AZURE_AI_ENDPOINT")
         self.azure_ai_key = os.getenv("AZURE_AI_KEY")
         self.azure_ai_agent_id = os.getenv("AZURE_AI_AGENT_ID", "")
         
+        # Below this routing confidence, hybrid requests start Azure AI alongside Copilot Studio (0 disables)
+        self.speculation_threshold = float(os.getenv("HYBRID_SPECULATION_THRESHOLD", "0"))
+        self.speculation_stats = SpeculationStats()
+        
         if self.azure_ai_endpoint:
             logger.info("Azure AI endpoint configured for routing decisions")
     
@@ -344,29 +910,108 @@ class AgentRoutingService:
         logger.info(f"Determining routing for user {request.user_id} with message: {request.message}")
         
         try:
-            # Handle explicit routing preferences
-            if request.routing_preference != AgentRoutingPreference.AUTO:
-                return self._handle_explicit_routing(request)
-            
-            # Use rule-based routing (AI-powered routing would require additional AI client setup)
-            return self._determine_routing_with_rules(request)
+            return self._route(request)
         
         except Exception as ex:
             logger.error(f"Error determining routing for request: {ex}")
-            
-            # Default to Copilot Studio for error cases
-            return AgentRoutingDecision(
-                selected_agent=AgentType.COPILOT_STUDIO,
-                reason="Error in routing logic, defaulting to Copilot Studio",
-                confidence=0.5,
-                routing_context={"error": str(ex)}
-            )
+            return self._error_decision(ex)
+    
+    async def determine_routing_many(self, requests: List[ConversationRequest]) -> List[AgentRoutingDecision]:
+        """Score a batch of conversation requests off the event loop, see iter_routing"""
+        logger.info(f"Determining routing for a batch of {len(requests)} requests")
+        return await asyncio.to_thread(lambda: list(self.iter_routing(requests)))
+    
+    def iter_routing(self, requests: Iterable[ConversationRequest]) -> Iterator[AgentRoutingDecision]:
+        """Lazily score a stream of requests, such as a transcript file too large for memory. Offline scoring
+        bypasses the decision cache, circuit breakers and speculation, so it leaves live routing untouched"""
+        errors = 0
+        for request in requests:
+            try:
+                yield self._score(request)
+            except Exception as ex:
+                errors += 1
+                yield self._error_decision(ex)
+        
+        if errors:
+            logger.warning(f"Routing defaulted to Copilot Studio for {errors} request(s) after errors")
+    
+    def _route(self, request: ConversationRequest) -> AgentRoutingDecision:
+        decision = self._apply_circuit_state(request, self._select_agent(request))
+        # Decided here rather than in the orchestrator, so replays follow the recorded decision
+        if decision.selected_agent == AgentType.COPILOT_STUDIO and self.should_speculate(decision):
+            decision.routing_context = {**(decision.routing_context or {}), "speculate": True}
+        return decision
+    
+    def _score(self, request: ConversationRequest) -> AgentRoutingDecision:
+        # Handle explicit routing preferences
+        if request.routing_preference != AgentRoutingPreference.AUTO:
+            return self._handle_explicit_routing(request)
+        
+        # Use rule-based routing (AI-powered routing would require additional AI client setup)
+        return self._determine_routing_with_rules(request)
+    
+    def _select_agent(self, request: ConversationRequest) -> AgentRoutingDecision:
+        if request.routing_preference != AgentRoutingPreference.AUTO or self.decision_cache is None:
+            return self._score(request)
+        
+        # Near-identical messages reuse an earlier decision
+        decision = self.decision_cache.get(request)
+        if decision is None:
+            decision = self._score(request)
+            self.decision_cache.put(request, decision)
+        return decision
+    
+    def _apply_circuit_state(self, request: ConversationRequest, decision: AgentRoutingDecision) -> AgentRoutingDecision:
+        """Reroute to Azure AI while the Copilot Studio circuit is open"""
+        # Requests for Copilot Studio only keep their decision and fail fast with CircuitOpenError when sent
+        if (decision.selected_agent != AgentType.COPILOT_STUDIO or self._is_copilot_studio_available()
+                or request.routing_preference == AgentRoutingPreference.COPILOT_STUDIO_ONLY):
+            return decision
+        
+        logger.warning("Copilot Studio circuit is open, rerouting to Azure AI")
+        return AgentRoutingDecision(
+            AgentType.AZURE_AI,
+            f"Copilot Studio unavailable, rerouted to Azure AI (was: {decision.reason})",
+            decision.confidence,
+            {**(decision.routing_context or {}), "rerouted_from": AgentType.COPILOT_STUDIO.value}
+        )
+    
+    def _is_copilot_studio_available(self) -> bool:
+        # Test doubles and other services without circuit breakers are always available
+        is_available = getattr(self.power_platform_service, "is_copilot_studio_available", None)
+        return is_available() if is_available else True
+    
+    def should_speculate(self, decision: AgentRoutingDecision) -> bool:
+        """Whether a possible escalation to Azure AI should start before Copilot Studio answers"""
+        return decision.confidence < self.speculation_threshold
+    
+    def get_speculation_stats(self) -> Dict[str, Any]:
+        """Return speculative execution counters"""
+        return {"threshold": self.speculation_threshold, **self.speculation_stats.snapshot()}
+    
+    def get_routing_cache_stats(self) -> Dict[str, Any]:
+        """Return routing decision cache counters, including the hit rate"""
+        if self.decision_cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.decision_cache.snapshot()}
+    
+    def _error_decision(self, ex: Exception) -> AgentRoutingDecision:
+        # Default to Copilot Studio for error cases
+        return AgentRoutingDecision(
+            selected_agent=AgentType.COPILOT_STUDIO,
+            reason="Error in routing logic, defaulting to Copilot Studio",
+            confidence=0.5,
+            routing_context={"error": str(ex)}
+        )
     
     async def route_and_execute(self, request: ConversationRequest) -> AgentResponse:
         """Route and execute a conversation request"""
         logger.info(f"Routing and executing request for user {request.user_id}")
         
-        routing_decision = await self.determine_routing(request)
+        if request.routing_decision is not None:
+            routing_decision = self._apply_circuit_state(request, request.routing_decision)
+        else:
+            routing_decision = await self.determine_routing(request)
         
         logger.info(f"Routing decision: {routing_decision.selected_agent.value} "
                    f"(confidence: {routing_decision.confidence}) - {routing_decision.reason}")
@@ -399,27 +1044,24 @@ class AgentRoutingService:
     
     def _determine_routing_with_rules(self, request: ConversationRequest) -> AgentRoutingDecision:
         """Determine routing using rule-based logic"""
-        message = request.message.lower()
-        
-        # Keywords that suggest Copilot Studio is appropriate
-        copilot_studio_keywords = ["workflow", "process", "step", "form", "approval", "business", "policy", "procedure"]
-        
-        # Keywords that suggest Azure AI is appropriate
-        azure_ai_keywords = ["explain", "analyze", "creative", "generate", "complex", "reasoning", "technical", "code"]
+        # Score the message against the weighted keyword table in a single pass
+        matches = self.keyword_matcher.match(request.message)
+        copilot_studio_matches = matches.get(AgentType.COPILOT_STUDIO, {})
+        azure_ai_matches = matches.get(AgentType.AZURE_AI, {})
         
-        copilot_studio_score = sum(1 for keyword in copilot_studio_keywords if keyword in message)
-        azure_ai_score = sum(1 for keyword in azure_ai_keywords if keyword in message)
+        copilot_studio_score = sum(copilot_studio_matches.values())
+        azure_ai_score = sum(azure_ai_matches.values())
         
         if copilot_studio_score > azure_ai_score:
             return AgentRoutingDecision(
                 AgentType.COPILOT_STUDIO,
-                f"Message contains {copilot_studio_score} Copilot Studio keywords indicating structured process",
+                f"Message contains {len(copilot_studio_matches)} Copilot Studio keywords indicating structured process",
                 min(0.6 + (copilot_studio_score * 0.1), 1.0)
             )
         elif azure_ai_score > copilot_studio_score:
             return AgentRoutingDecision(
                 AgentType.AZURE_AI,
-                f"Message contains {azure_ai_score} Azure AI keywords indicating complex reasoning needed",
+                f"Message contains {len(azure_ai_matches)} Azure AI keywords indicating complex reasoning needed",
                 min(0.6 + (azure_ai_score * 0.1), 1.0)
             )
         else:
@@ -467,12 +1109,32 @@ class AgentRoutingService:
     
     async def _execute_hybrid_request(self, request: ConversationRequest, decision: AgentRoutingDecision) -> AgentResponse:
         """Execute hybrid request (Copilot Studio + Azure AI)"""
+        if not self._is_copilot_studio_available():
+            logger.warning("Copilot Studio circuit is open, handling hybrid request with Azure AI only")
+            return await self._execute_azure_ai_request(request, decision)
+        
+        # When routing is uncertain, start Azure AI speculatively so an escalation does not pay both latencies
+        speculative_task = None
+        if self.should_speculate(decision):
+            speculative_task = asyncio.create_task(self._timed(self._execute_azure_ai_request(request, decision)))
+        
         # Start with Copilot Studio
-        copilot_response = await self._execute_copilot_studio_request(request, decision)
+        copilot_started = time.monotonic()
+        try:
+            copilot_response = await self._execute_copilot_studio_request(request, decision)
+        except BaseException:
+            if speculative_task is not None:
+                self._discard(speculative_task)
+            raise
+        copilot_elapsed = time.monotonic() - copilot_started
         
         # Check if escalation to Azure AI is needed
         if copilot_response.requires_follow_up and copilot_response.next_action == "escalate":
-            azure_ai_response = await self._execute_azure_ai_request(request, decision)
+            if speculative_task is not None:
+                azure_ai_response, azure_ai_elapsed = await speculative_task
+                self.speculation_stats.record(True, min(azure_ai_elapsed, copilot_elapsed))
+            else:
+                azure_ai_response = await self._execute_azure_ai_request(request, decision)
             
             return AgentResponse(
                 message=f"{copilot_response.message}\n\n[Escalated to Azure AI]\n{azure_ai_response.message}",
@@ -483,4 +1145,20 @@ class AgentRoutingService:
                 requires_follow_up=azure_ai_response.requires_follow_up
             )
         
-        return copilot_response
\ No newline at end of file
+        if speculative_task is not None:
+            self._discard(speculative_task)
+            self.speculation_stats.record(False)
+        
+        return copilot_response
+    
+    @staticmethod
+    async def _timed(coro):
+        started = time.monotonic()
+        result = await coro
+        return result, time.monotonic() - started
+    
+    @staticmethod
+    def _discard(task: asyncio.Task) -> None:
+        # Cancel the losing branch and retrieve any error it already raised so it is not logged as unhandled
+        task.cancel()
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
@@ -3,17 +3,51 @@ Simple integration test for Copilot Studio extensibility
 """
 
 import asyncio
+import inspect
 import json
 import logging
 import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import get_type_hints
 from models import *
-from services import AgentRoutingService
+from aiohttp import web
+from azure.core.credentials import AccessToken
+from services import AgentRoutingService, PacCliService, PacCommandBroker, PowerPlatformGraphService, TokenCache
+from durabletask.worker import TaskHubGrpcWorker
+from runtime import ActivityRuntime, AsyncActivityWorkerMixin, _has_release_wrapper, _unwrap_release
+from scheduling import WorkScheduler
+from catalog import CatalogCache
+from flows import FlowRunTracker
+from contexts import ContextStore
+from payloads import CachedPayloadStore, LocalPayloadStore
+from resilience import CircuitBreakers, CircuitOpenError, RateLimiter, ThrottledError, parse_retry_after
+from codec import encode_payload, decode_payload, set_payload_codec
+from routing import KeywordMatcher, CAPABILITY_KEYWORDS, COLLABORATION_KEYWORDS, ConversationAffinity, RoutingDecisionCache, SqliteDecisionStore, read_conversation_requests
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class AsyncTaskHubGrpcWorker(AsyncActivityWorkerMixin, TaskHubGrpcWorker):
+    """Test backend worker that accepts async def activities, like the scheduler worker in worker.py"""
+
+def set_test_env(saved: dict, name: str, value: str) -> None:
+    """Set an environment variable for a test, remembering its previous value for restore_test_env"""
+    saved.setdefault(name, os.environ.get(name))
+    os.environ[name] = value
+
+def restore_test_env(saved: dict) -> None:
+    """Put back the environment variables changed with set_test_env"""
+    for name, value in saved.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
 async def test_agent_routing():
     """Test agent routing logic"""
     print("\n=== Testing Agent Routing ===")
@@ -69,6 +103,99 @@ async def test_agent_routing():
     except Exception as ex:
         print(f"\n❌ Agent routing tests failed: {ex}")
 
+async def test_batch_routing():
+    """Test batch and streaming routing against single-request routing"""
+    print("\n=== Testing Batch Routing ===")
+    
+    try:
+        routing_service = AgentRoutingService(None)
+        messages = [
+            "Help me create a workflow for customer approval process",
+            "Please analyze this complex technical architecture",
+            "Hello there",
+            "Explain the approval policy"
+        ]
+        requests = [ConversationRequest(user_id="test-user", message=message) for message in messages] * 500
+        requests.append(ConversationRequest(user_id="test-user", message="Hi", routing_preference=AgentRoutingPreference.AZURE_AI_ONLY))
+        
+        start = time.perf_counter()
+        decisions = await routing_service.determine_routing_many(requests)
+        elapsed = time.perf_counter() - start
+        print(f"  {len(requests)} requests routed in {elapsed * 1000:.1f}ms")
+        
+        assert len(decisions) == len(requests)
+        # Offline scoring leaves the live decision cache alone
+        cache_stats = routing_service.get_routing_cache_stats()
+        assert cache_stats["hits"] == 0 and cache_stats["misses"] == 0, cache_stats
+        for request, decision in zip(requests[:4] + requests[-1:], decisions[:4] + decisions[-1:]):
+            assert decision == await routing_service.determine_routing(request)
+        
+        # Nor does it take on the live circuit state or speculation flag
+        routing_service.speculation_threshold = 0.7
+        unclear = ConversationRequest(user_id="test-user", message="Hello there")
+        assert (await routing_service.determine_routing(unclear)).routing_context == {"speculate": True}
+        assert (await routing_service.determine_routing_many([unclear]))[0].routing_context == {}
+        
+        # Transcripts too large for memory are streamed one line at a time
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "transcript.jsonl")
+            with open(path, "w") as transcript_file:
+                for request in requests:
+                    transcript_file.write(json.dumps(to_dict(request)) + "\n")
+            streamed = list(routing_service.iter_routing(read_conversation_requests(path)))
+        assert streamed == decisions
+        
+        print("\n✅ Batch routing tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Batch routing tests failed: {ex}")
+
+async def test_routing_cache():
+    """Test the routing decision cache keys, eviction, expiry and shared store"""
+    print("\n=== Testing Routing Decision Cache ===")
+    
+    try:
+        cache = RoutingDecisionCache(max_entries=2, ttl=60.0, context_keys=["channel"])
+        routing_service = AgentRoutingService(None, decision_cache=cache)
+        
+        first = await routing_service.determine_routing(ConversationRequest("u1", "Start approval workflow", context={"channel": "teams"}))
+        repeat = await routing_service.determine_routing(ConversationRequest("u2", "  start APPROVAL workflow! ", context={"channel": "teams", "locale": "en"}))
+        assert repeat == first
+        assert cache.hits == 1 and cache.misses == 1
+        
+        # Relevant context keys and the routing preference are part of the key
+        await routing_service.determine_routing(ConversationRequest("u1", "Start approval workflow", context={"channel": "web"}))
+        assert cache.misses == 2
+        await routing_service.determine_routing(ConversationRequest("u1", "Explain this code"))
+        assert cache.evictions == 1 and cache.snapshot()["size"] == 2
+        
+        expiring = RoutingDecisionCache(ttl=0.05)
+        request = ConversationRequest("u1", "Explain this code")
+        expiring.put(request, first)
+        await asyncio.sleep(0.1)
+        assert expiring.get(request) is None
+        
+        # A second process sees decisions through the shared store
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "routing-cache.db")
+            RoutingDecisionCache(shared_store=SqliteDecisionStore(path)).put(request, first)
+            other_process = RoutingDecisionCache(shared_store=SqliteDecisionStore(path))
+            assert other_process.get(request) == first
+            assert other_process.get(request) == first
+            assert other_process.shared_hits == 1 and other_process.hits == 1
+            
+            # Expired decisions are purged from the file as new ones are written
+            purging = SqliteDecisionStore(path, purge_interval=0)
+            purging.put("expired", to_dict(first), 0)
+            purging.put("current", to_dict(first), 60)
+            assert purging.purge_expired() == 0 and purging.get("current") is not None
+        
+        print(f"  Stats: {routing_service.get_routing_cache_stats()}")
+        print("\n✅ Routing decision cache tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Routing decision cache tests failed: {ex}")
+
 async def test_models():
     """Test data model serialization"""
     print("\n=== Testing Data Models ===")
@@ -104,6 +231,10 @@ async def test_models():
         multi_dict = to_dict(multi_request)
         print(f"\nMulti-Agent Request: {json.dumps(multi_dict, indent=2)}")
         
+        # Round trip, including the nested capabilities and their enums
+        assert from_dict(ConversationRequest, request_dict) == request
+        assert from_dict(MultiAgentRequest, json.loads(json.dumps(multi_dict))) == multi_request
+        
         print("\n✅ Data model tests passed!")
         
     except Exception as ex:
@@ -163,6 +294,1755 @@ async def test_collaboration_planning():
     except Exception as ex:
         print(f"\n❌ Collaboration planning tests failed: {ex}")
 
+async def test_connection_pool():
+    """Test that Power Platform requests share pooled connections"""
+    print("\n=== Testing Connection Pool ===")
+    
+    runner = None
+    service = None
+    saved_env = {}
+    try:
+        # Local stand-in for the Power Platform environment endpoint
+        async def environment_handler(request):
+            return web.json_response({"name": "test-environment"})
+        
+        app = web.Application()
+        app.router.add_get("/api/environments/current", environment_handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        
+        set_test_env(saved_env, "POWER_PLATFORM_ENVIRONMENT_URL", f"http://127.0.0.1:{port}")
+        service = PowerPlatformGraphService()
+        
+        async def mock_token():
+            return "test-token"
+        service._get_power_platform_token = mock_token
+        
+        for _ in range(5):
+            environment_info = await service.get_environment_info()
+            assert environment_info["name"] == "test-environment", environment_info
+        
+        stats = service.get_pool_stats()
+        print(f"Pool Stats: {json.dumps(stats, indent=2)}")
+        assert stats["connectionsCreated"] == 1, stats
+        assert stats["connectionsReused"] == 4, stats
+        
+        print("\n✅ Connection pool tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Connection pool tests failed: {ex}")
+    finally:
+        restore_test_env(saved_env)
+        if service:
+            await service.close()
+        if runner:
+            await runner.cleanup()
+
+async def test_token_cache():
+    """Test access token caching and proactive refresh"""
+    print("\n=== Testing Token Cache ===")
+    
+    try:
+        class MockCredential:
+            def __init__(self):
+                self.calls = 0
+            
+            def get_token(self, scope):
+                self.calls += 1
+                time.sleep(0.05)
+                return AccessToken(f"token-{self.calls}", int(time.time()) + 3600)
+        
+        credential = MockCredential()
+        cache = TokenCache(credential, refresh_margin=300)
+        scope = "https://service.powerapps.com/.default"
+        
+        # Concurrent cold requests share one credential call
+        tokens = await asyncio.gather(*[cache.get_token(scope) for _ in range(10)])
+        assert set(tokens) == {"token-1"}, tokens
+        assert credential.calls == 1, credential.calls
+        
+        # Warm requests are served from the cache
+        assert await cache.get_token(scope) == "token-1"
+        assert credential.calls == 1, credential.calls
+        
+        # Tokens close to expiry are still served while a refresh runs in the background
+        cache._tokens[scope] = AccessToken("token-1", int(time.time()) + 60)
+        assert await cache.get_token(scope) == "token-1"
+        await cache._pending[scope]
+        assert await cache.get_token(scope) == "token-2"
+        
+        stats = cache.snapshot()
+        print(f"Token Cache Stats: {json.dumps(stats, indent=2)}")
+        assert stats["misses"] == 10 and stats["refreshes"] == 1, stats
+        
+        print("\n✅ Token cache tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Token cache tests failed: {ex}")
+
+async def test_activity_runtime():
+    """Test that concurrently dispatched activities share one event loop"""
+    print("\n=== Testing Activity Runtime ===")
+    
+    runtime = ActivityRuntime()
+    try:
+        async def activity_body(item):
+            await asyncio.sleep(0.2)
+            return id(asyncio.get_running_loop()), item * item
+        
+        # Simulate the worker's thread pool dispatching activities concurrently
+        def activity(item):
+            return runtime.run(activity_body(item))
+        
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: list(executor.map(activity, range(16))))
+        elapsed = time.time() - start
+        
+        print(f"Ran {len(results)} activities in {elapsed:.2f}s")
+        assert len({loop_id for loop_id, _ in results}) == 1, "activities ran on different loops"
+        assert [result for _, result in results] == [i * i for i in range(16)]
+        assert elapsed < 1.0, elapsed
+        
+        print("\n✅ Activity runtime tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Activity runtime tests failed: {ex}")
+    finally:
+        runtime.stop()
+
+async def test_payload_codecs():
+    """Test payload codecs and envelope versioning"""
+    print("\n=== Testing Payload Codecs ===")
+    
+    try:
+        responses = [
+            AgentResponse(
+                message=f"Step {i} response " + "details " * 50,
+                agent_type="CopilotStudio",
+                agent_id="bot-123",
+                conversation_id="conversation-123",
+                context={"step": i, "items": list(range(20))},
+                requires_follow_up=i % 2 == 0
+            )
+            for i in range(5)
+        ]
+        
+        legacy_payload = json.dumps([to_dict(response) for response in responses])
+        payloads = {}
+        for codec_name in ["json", "json+zlib", "msgpack", "cbor"]:
+            set_payload_codec(codec_name)
+            payloads[codec_name] = encode_payload(responses)
+            decoded = [from_dict(AgentResponse, data) for data in decode_payload(payloads[codec_name])]
+            assert decoded == responses, codec_name
+            print(f"  {codec_name}: {len(payloads[codec_name])} chars (legacy JSON: {len(legacy_payload)} chars)")
+        
+        # The default stays plain JSON; compression is opt-in, and small payloads stay plain JSON for every codec
+        assert json.loads(payloads["json"]) == json.loads(legacy_payload)
+        assert json.loads(payloads["json+zlib"])["$codec"] == "json+zlib"
+        assert len(payloads["json+zlib"]) < len(payloads["json"])
+        small = {"step": 1, "message": "ok"}
+        for codec_name in ["json", "json+zlib", "msgpack", "cbor"]:
+            set_payload_codec(codec_name)
+            assert encode_payload(small) == json.dumps(small, separators=(",", ":")), codec_name
+        
+        # Payloads written before codecs existed, or by another codec, still decode
+        set_payload_codec("json")
+        assert decode_payload(legacy_payload) == decode_payload(payloads["msgpack"])
+        assert decode_payload(payloads["cbor"]) == decode_payload(payloads["json"])
+        compressed_v2 = json.dumps({**json.loads(payloads["json+zlib"]), "$codec": "json", "$v": 2})
+        assert decode_payload(compressed_v2) == decode_payload(payloads["json"])
+        
+        print("\n✅ Payload codec tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Payload codec tests failed: {ex}")
+    finally:
+        set_payload_codec("json")
+
+async def test_keyword_matcher():
+    """Test the compiled keyword matcher used for routing"""
+    print("\n=== Testing Keyword Matcher ===")
+    
+    try:
+        matcher = KeywordMatcher(COLLABORATION_KEYWORDS)
+        
+        # Keywords match on word starts, so stems match but embedded words do not
+        assert AgentType.POWER_AUTOMATE in matcher.match("Trigger the approval flows")
+        assert AgentType.POWER_AUTOMATE not in matcher.match("Design a workflow")
+        assert matcher.match("Analyze the complex, creative brief") == {
+            AgentType.AZURE_AI: {"complex": 1.0, "analyze": 1.0, "creative": 1.0}
+        }
+        
+        weighted = KeywordMatcher({AgentType.COPILOT_STUDIO: {"approval": 3.0}, AgentType.AZURE_AI: {"explain": 1.0, "code": 1.0}})
+        assert weighted.best_label("Explain the code behind this approval") == AgentType.COPILOT_STUDIO
+        assert weighted.best_label("Explain the code behind this approval", [AgentType.AZURE_AI]) == AgentType.AZURE_AI
+        assert KeywordMatcher(CAPABILITY_KEYWORDS, whole_words=True).match("processing") == {}
+        
+        # A large keyword table is still scanned in a single pass over the message
+        large = KeywordMatcher({AgentType.AZURE_AI: {f"keyword{i}": 1.0 for i in range(5000)}}, whole_words=True)
+        message = "please route this message " * 2000 + "keyword4999"
+        start = time.perf_counter()
+        assert large.score(message) == {AgentType.AZURE_AI: 1.0}
+        elapsed = time.perf_counter() - start
+        print(f"  {large.keyword_count} keywords over {len(message)} chars in {elapsed * 1000:.1f}ms")
+        assert elapsed < 1.0
+        
+        print("\n✅ Keyword matcher tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Keyword matcher tests failed: {ex}")
+
+async def test_pac_command_broker():
+    """Test PAC CLI caching, coalescing and bounded concurrency against a fake pac executable"""
+    print("\n=== Testing PAC CLI Command Broker ===")
+    
+    saved_env = {}
+    try:
+        set_test_env(saved_env, "POWER_PLATFORM_ENVIRONMENT_URL", os.environ.get("POWER_PLATFORM_ENVIRONMENT_URL", "http://127.0.0.1:9"))
+        with tempfile.TemporaryDirectory() as directory:
+            # Fake pac: logs its arguments, takes 0.3s and echoes them back as JSON
+            log_path = os.path.join(directory, "calls.log")
+            pac_path = os.path.join(directory, "pac")
+            with open(pac_path, "w") as pac_file:
+                pac_file.write(f"""#!{sys.executable}
+import json, sys, time
+with open({log_path!r}, "a") as log:
+    log.write(json.dumps(sys.argv[1:]) + "\\n")
+if "--hang" in sys.argv:
+    time.sleep(30)
+time.sleep(0.3)
+print(json.dumps([{{"args": sys.argv[1:]}}] if sys.argv[2] == "list" else {{"args": sys.argv[1:]}}))
+""")
+            os.chmod(pac_path, 0o755)
+            set_test_env(saved_env, "PATH", directory + os.pathsep + os.environ.get("PATH", ""))
+            
+            def calls():
+                with open(log_path) as log:
+                    return [json.loads(line) for line in log]
+            
+            pac_service = PacCliService(PacCommandBroker(max_concurrency=2, timeout=2.0))
+            
+            # Identical concurrent commands share one process, later calls hit the cache
+            results = await asyncio.gather(*[pac_service.list_copilot_studio_bots() for _ in range(5)])
+            assert all(result == [{"args": ["chatbot", "list", "--json"]}] for result in results)
+            await pac_service.list_copilot_studio_bots()
+            assert len(calls()) == 1
+            
+            # Arguments containing spaces reach pac intact, at most two processes run at once
+            start = time.perf_counter()
+            details = await asyncio.gather(*[pac_service.get_bot_details(f"My Bot {i}") for i in range(4)])
+            elapsed = time.perf_counter() - start
+            assert details[3]["args"] == ["chatbot", "show", "--chatbot-id", "My Bot 3", "--json"]
+            assert elapsed >= 0.55, elapsed
+            
+            # A command that is not cached, such as auth create, invalidates cached results
+            await pac_service.authenticate("tenant-1")
+            await pac_service.list_copilot_studio_bots()
+            assert len(calls()) == 7
+            
+            # Hung commands are killed after the timeout
+            result = await pac_service.broker.run(["chatbot", "show", "--hang"])
+            assert result["error"] == "Command timed out"
+            
+            stats = pac_service.get_command_stats()
+            print(f"  Stats: {stats}")
+            assert stats["coalesced"] == 4 and stats["cacheHits"] == 1 and stats["timeouts"] == 1
+        
+        print("\n✅ PAC CLI command broker tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ PAC CLI command broker tests failed: {ex}")
+    finally:
+        restore_test_env(saved_env)
+
+async def test_catalog_cache():
+    """Test catalog loading, conditional refresh and lookups"""
+    print("\n=== Testing Catalog Cache ===")
+    
+    runner = None
+    service = None
+    saved_env = {}
+    try:
+        topics = {"bot-1": [{"id": "greeting", "name": "Greeting", "status": "active"}],
+                  "bot-2": [{"id": "orders", "name": "Orders", "status": "active"}]}
+        
+        def conditional(request, body):
+            etag = f'"{hash(json.dumps(body, sort_keys=True))}"'
+            if request.headers.get("If-None-Match") == etag:
+                return web.Response(status=304, headers={"ETag": etag})
+            return web.json_response(body, headers={"ETag": etag})
+        
+        async def environment_handler(request):
+            return conditional(request, {"name": "test-environment"})
+        
+        topic_requests = 0
+        
+        async def topics_handler(request):
+            nonlocal topic_requests
+            topic_requests += 1
+            return conditional(request, {"topics": topics[request.match_info["bot_id"]]})
+        
+        app = web.Application()
+        app.router.add_get("/api/environments/current", environment_handler)
+        app.router.add_get("/api/botmanagement/v1/bots/{bot_id}/topics", topics_handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        
+        set_test_env(saved_env, "POWER_PLATFORM_ENVIRONMENT_URL", f"http://127.0.0.1:{port}")
+        service = PowerPlatformGraphService()
+        
+        async def mock_token():
+            return "test-token"
+        service._get_power_platform_token = mock_token
+        
+        class MockPacService:
+            bots = [{"botId": "bot-1", "name": "Support"}, {"botId": "bot-2", "name": "Sales"}]
+            
+            async def get_environment_info(self):
+                return {"orgId": "org-1"}
+            
+            async def fetch_copilot_studio_bots(self):
+                if self.bots is None:
+                    raise RuntimeError("pac chatbot list failed")
+                return list(self.bots)
+        
+        pac_service = MockPacService()
+        catalog = CatalogCache(service, pac_service, refresh_interval=0)
+        await catalog.start()
+        assert catalog.environment == {"name": "test-environment", "pacCliInfo": {"orgId": "org-1"}}
+        assert catalog.get_bot("bot-2")["name"] == "Sales"
+        assert catalog.get_topic("bot-1", "greeting").name == "Greeting"
+        
+        # Unchanged resources come back as 304 Not Modified, changed ones are re-read
+        topics["bot-1"].append({"id": "escalate", "name": "Escalate", "status": "active"})
+        await catalog.refresh()
+        assert catalog.not_modified == 2 and catalog.get_topic("bot-1", "escalate").name == "Escalate"
+        
+        # Bots that disappear take their topics with them
+        pac_service.bots = pac_service.bots[:1]
+        await catalog.refresh()
+        assert catalog.get_bot("bot-2") is None and catalog.get_topics("bot-2") == []
+        assert catalog.get_topic("bot-1", "greeting") is not None
+        
+        # A failed bot listing keeps the previous catalog and counts as a failed refresh
+        pac_service.bots = None
+        await catalog.start()
+        assert catalog.get_bot("bot-1") is not None and catalog.get_topic("bot-1", "greeting") is not None
+        
+        # Topics are served from the catalog, and only fetched for bots it does not have
+        requests_before = topic_requests
+        cached = await catalog.get_copilot_studio_topics("bot-1")
+        assert [topic.topic_id for topic in cached] == ["greeting", "escalate"] and topic_requests == requests_before
+        topics["bot-3"] = [{"id": "faq", "name": "FAQ", "status": "active"}]
+        fetched = await catalog.get_copilot_studio_topics("bot-3")
+        assert [topic.topic_id for topic in fetched] == ["faq"] and topic_requests == requests_before + 1
+        
+        stats = catalog.snapshot()
+        print(f"  Stats: {stats}")
+        assert stats["changed"] == 4 and stats["notModified"] == 4, stats
+        assert stats["refreshes"] == 3 and stats["refreshFailures"] == 1, stats
+        assert stats["topicHits"] == 1 and stats["topicMisses"] == 1, stats
+        
+        print("\n✅ Catalog cache tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Catalog cache tests failed: {ex}")
+    finally:
+        restore_test_env(saved_env)
+        if service:
+            await service.close()
+        if runner:
+            await runner.cleanup()
+
+async def test_request_coalescing():
+    """Test that concurrent identical topic starts share one upstream call"""
+    print("\n=== Testing Request Coalescing ===")
+    
+    runner = None
+    service = None
+    saved_env = {}
+    try:
+        upstream_calls = []
+        
+        async def conversation_handler(request):
+            payload = await request.json()
+            upstream_calls.append(payload)
+            await asyncio.sleep(0.2)
+            return web.json_response({"message": f"Started {payload['topic']}", "conversationId": "conversation-123",
+                                      "variables": payload["variables"]})
+        
+        app = web.Application()
+        app.router.add_post("/api/botmanagement/v1/bots/{bot_id}/conversations", conversation_handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        
+        set_test_env(saved_env, "POWER_PLATFORM_ENVIRONMENT_URL", f"http://127.0.0.1:{port}")
+        service = PowerPlatformGraphService()
+        
+        async def mock_token():
+            return "test-token"
+        service._get_power_platform_token = mock_token
+        
+        def start_topic(priority):
+            return CopilotStudioRequest("bot-123", "system", "Start topic: support", topic="support", variables={"priority": priority})
+        
+        responses = await asyncio.gather(*[service.send_message_to_copilot_studio(start_topic("high")) for _ in range(10)])
+        assert len(upstream_calls) == 1 and all(response.message == "Started support" for response in responses)
+        
+        # Every waiter gets its own copy of the shared response
+        responses[0].variables["priority"] = "changed"
+        assert responses[1].variables["priority"] == "high"
+        
+        # Different payloads and messages inside a conversation are not coalesced
+        await asyncio.gather(
+            service.send_message_to_copilot_studio(start_topic("low")),
+            service.send_message_to_copilot_studio(CopilotStudioRequest("bot-123", "u1", "Hi", conversation_id="c1", topic="support")),
+            service.send_message_to_copilot_studio(CopilotStudioRequest("bot-123", "u1", "Hi", conversation_id="c1", topic="support")))
+        assert len(upstream_calls) == 4, len(upstream_calls)
+        
+        stats = service.get_coalescing_stats()
+        print(f"  Stats: {stats}")
+        assert stats["executions"] == 2 and stats["coalesced"] == 9, stats
+        
+        print("\n✅ Request coalescing tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Request coalescing tests failed: {ex}")
+    finally:
+        restore_test_env(saved_env)
+        if service:
+            await service.close()
+        if runner:
+            await runner.cleanup()
+
+async def test_rate_limiter():
+    """Test that throttled requests back off, honour Retry-After and settle under the server's limit"""
+    print("\n=== Testing Rate Limiter ===")
+    
+    runner = None
+    service = None
+    saved_env = {}
+    try:
+        assert parse_retry_after("2") == 2.0
+        assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+        assert parse_retry_after("soon") is None
+        
+        # The server handles at most three requests at a time and throttles the rest
+        in_flight = 0
+        
+        async def environment_handler(request):
+            nonlocal in_flight
+            if in_flight >= 3:
+                return web.json_response({"error": "throttled"}, status=429, headers={"Retry-After": "0.1"})
+            in_flight += 1
+            try:
+                await asyncio.sleep(0.05)
+                return web.json_response({"name": "test-environment"})
+            finally:
+                in_flight -= 1
+        
+        app = web.Application()
+        app.router.add_get("/api/environments/current", environment_handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        
+        set_test_env(saved_env, "POWER_PLATFORM_ENVIRONMENT_URL", f"http://127.0.0.1:{port}")
+        service = PowerPlatformGraphService()
+        service.rate_limiter = RateLimiter(rate=200.0, burst=20.0, max_concurrency=12)
+        service.max_throttle_retries = 20
+        
+        async def mock_token():
+            return "test-token"
+        service._get_power_platform_token = mock_token
+        
+        results = await asyncio.gather(*[
+            service.get_json_if_modified("/api/environments/current", endpoint="environment") for _ in range(40)])
+        assert all(status == 200 for status, _, _ in results)
+        
+        limits = service.get_rate_limits()["environment"]
+        print(f"  Limits: {limits}")
+        assert limits["throttled"] > 0 and limits["concurrencyLimit"] < 12, limits
+        
+        # A burst of requests throttled together halves the limit once, not once per 429
+        limiter = RateLimiter(max_concurrency=8).for_endpoint("burst")
+        
+        async def throttled_request():
+            async with limiter.slot() as generation:
+                await asyncio.sleep(0.01)
+            limiter.on_throttle(None, generation)
+        
+        await asyncio.gather(*[throttled_request() for _ in range(8)])
+        assert limiter.snapshot()["concurrencyLimit"] == 4 and limiter.throttled == 8, limiter.snapshot()
+        await throttled_request()
+        assert limiter.snapshot()["concurrencyLimit"] == 2, limiter.snapshot()
+        
+        # Requests that are still throttled after every retry fail with ThrottledError
+        service.max_throttle_retries = 0
+        service.rate_limiter = RateLimiter(max_concurrency=12)
+        in_flight = 3
+        try:
+            await service.get_json_if_modified("/api/environments/current", endpoint="environment")
+            raise AssertionError("Expected ThrottledError")
+        except ThrottledError as ex:
+            assert ex.retry_after == 0.1
+        
+        print("\n✅ Rate limiter tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Rate limiter tests failed: {ex}")
+    finally:
+        restore_test_env(saved_env)
+        if service:
+            await service.close()
+        if runner:
+            await runner.cleanup()
+
+async def test_circuit_breaker():
+    """Test that a failing Copilot Studio endpoint opens its circuit, reroutes and recovers after a probe"""
+    print("\n=== Testing Circuit Breaker ===")
+    
+    runner = None
+    service = None
+    saved_env = {}
+    try:
+        mode = "ok"
+        
+        async def conversation_handler(request):
+            if mode == "hang":
+                await asyncio.sleep(5)
+            if mode == "error":
+                return web.json_response({"error": "unavailable"}, status=500)
+            return web.json_response({"message": "Copilot Studio response", "conversationId": "conversation-123",
+                                      "topicCompleted": True})
+        
+        app = web.Application()
+        app.router.add_post("/api/botmanagement/v1/bots/{bot_id}/conversations", conversation_handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        
+        set_test_env(saved_env, "POWER_PLATFORM_ENVIRONMENT_URL", f"http://127.0.0.1:{port}")
+        set_test_env(saved_env, "POWER_PLATFORM_REQUEST_TIMEOUT", "0.2")
+        service = PowerPlatformGraphService()
+        service.circuit_breakers = CircuitBreakers(failure_threshold=2, probe_interval=0.3)
+        
+        async def mock_token():
+            return "test-token"
+        service._get_power_platform_token = mock_token
+        
+        message = CopilotStudioRequest("bot-123", "u1", "Hi", conversation_id="c1")
+        
+        # A timeout and then a server error open the circuit
+        for mode in ["hang", "error"]:
+            try:
+                await service.send_message_to_copilot_studio(message)
+            except Exception as ex:
+                print(f"  {mode}: {type(ex).__name__}")
+            else:
+                raise AssertionError(f"Expected the {mode} request to fail")
+        assert service.get_circuit_states()["copilot_studio_conversations"]["state"] == "open"
+        
+        # While open, requests fail fast and routing moves to Azure AI
+        start = time.perf_counter()
+        try:
+            await service.send_message_to_copilot_studio(message)
+            raise AssertionError("Expected CircuitOpenError")
+        except CircuitOpenError:
+            assert time.perf_counter() - start < 0.05
+        
+        routing_service = AgentRoutingService(service, decision_cache=RoutingDecisionCache())
+        response = await routing_service.route_and_execute(ConversationRequest("u1", "Help me create an approval workflow"))
+        assert response.agent_type == "AzureAI", response
+        try:
+            await routing_service.route_and_execute(ConversationRequest(
+                "u1", "Hi", routing_preference=AgentRoutingPreference.COPILOT_STUDIO_ONLY))
+            raise AssertionError("Expected CircuitOpenError")
+        except CircuitOpenError:
+            pass
+        
+        # While a probe is in flight the circuit still counts as open, so other requests are rerouted
+        probing = CircuitBreakers(failure_threshold=1, probe_interval=0.01)
+        breaker = probing.for_endpoint("probe")
+        breaker.on_failure()
+        await asyncio.sleep(0.02)
+        assert not probing.is_open("probe")
+        breaker.before_request()
+        assert breaker.state == "half_open" and probing.is_open("probe")
+        
+        # After the probe interval one probe goes through and closes the circuit
+        mode = "ok"
+        await asyncio.sleep(0.35)
+        response = await routing_service.route_and_execute(ConversationRequest("u1", "Help me create an approval workflow"))
+        assert response.agent_type == "CopilotStudio", response
+        
+        states = service.get_circuit_states()
+        print(f"  States: {states}")
+        assert states["copilot_studio_conversations"]["state"] == "closed"
+        assert states["copilot_studio_conversations"]["opened"] == 1
+        
+        print("\n✅ Circuit breaker tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Circuit breaker tests failed: {ex}")
+    finally:
+        restore_test_env(saved_env)
+        if service:
+            await service.close()
+        if runner:
+            await runner.cleanup()
+
+async def test_parallel_collaboration():
+    """Test that independent collaboration steps run in parallel and dependent steps join"""
+    print("\n=== Testing Parallel Collaboration ===")
+    
+    backend = None
+    dt_worker = None
+    saved_env = {}
+    try:
+        from durabletask.client import TaskHubGrpcClient
+        from durabletask.testing import create_test_backend
+        from durabletask.worker import TaskHubGrpcWorker
+        
+        set_test_env(saved_env, "POWER_PLATFORM_ENVIRONMENT_URL", os.environ.get("POWER_PLATFORM_ENVIRONMENT_URL", "http://127.0.0.1:9"))
+        import worker
+        
+        # Stand-in for the real activity: every step takes the same time
+        def execute_agent_request(ctx, input_json):
+            input_data = decode_payload(input_json)
+            time.sleep(0.5)
+            step = input_data["routing"]["reason"].split(":")[0]
+            return encode_payload(AgentResponse(
+                message=f"{step} done",
+                agent_type="Test",
+                agent_id="test",
+                context={step: True, "seen": sorted(input_data["request"]["context"])}
+            ))
+        
+        backend = create_test_backend(port=50061)
+        dt_worker = TaskHubGrpcWorker(host_address="localhost:50061")
+        dt_worker.add_orchestrator(worker.multi_agent_collaboration_orchestrator)
+        dt_worker.add_activity(worker.plan_agent_collaboration)
+        dt_worker.add_activity(execute_agent_request)
+        dt_worker.start()
+        
+        request = MultiAgentRequest(
+            task_description="Develop a comprehensive customer onboarding strategy",
+            required_capabilities=[
+                AgentCapability("process_design", "Design onboarding workflows", [AgentType.COPILOT_STUDIO]),
+                AgentCapability("data_analysis", "Analyze customer behavior", [AgentType.AZURE_AI]),
+                AgentCapability("automation", "Automate notifications", [AgentType.POWER_AUTOMATE],
+                                depends_on=["process_design"])
+            ],
+            user_id="test-user"
+        )
+        
+        client = TaskHubGrpcClient(host_address="localhost:50061")
+        start = time.time()
+        instance_id = client.schedule_new_orchestration(
+            worker.multi_agent_collaboration_orchestrator, input=encode_payload(request))
+        state = client.wait_for_orchestration_completion(instance_id, timeout=30)
+        elapsed = time.time() - start
+        
+        responses = [from_dict(AgentResponse, data) for data in decode_payload(json.loads(state.serialized_output))]
+        print(f"Completed {len(responses)} steps in {elapsed:.2f}s")
+        assert [response.message for response in responses] == [
+            "Handle process_design done", "Handle data_analysis done", "Handle automation done"]
+        
+        # The dependent step sees the context of the step it depends on, and only that one
+        assert "Handle process_design" in responses[2].context["seen"], responses[2].context
+        assert "Handle data_analysis" not in responses[2].context["seen"], responses[2].context
+        
+        # Critical path is two steps long, not three
+        assert elapsed < 1.4, elapsed
+        
+        print("\n✅ Parallel collaboration tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Parallel collaboration tests failed: {ex}")
+    finally:
+        restore_test_env(saved_env)
+        if dt_worker:
+            dt_worker.stop()
+        if backend:
+            backend.stop()
+
+async def test_sticky_routing():
+    """Test that follow-up messages in an open topic skip the routing activity"""
+    print("\n=== Testing Sticky Conversation Routing ===")
+    
+    backend = None
+    dt_worker = None
+    saved_env = {}
+    try:
+        from durabletask.client import TaskHubGrpcClient
+        from durabletask.testing import create_test_backend
+        from durabletask.worker import TaskHubGrpcWorker
+        
+        set_test_env(saved_env, "POWER_PLATFORM_ENVIRONMENT_URL", os.environ.get("POWER_PLATFORM_ENVIRONMENT_URL", "http://127.0.0.1:9"))
+        import worker
+        
+        routing_calls = []
+        
+        def determine_agent_routing(ctx, request_json):
+            routing_calls.append(decode_payload(request_json)["message"])
+            return encode_payload(AgentRoutingDecision(AgentType.COPILOT_STUDIO, "Test routing", 0.8))
+        
+        # The topic stays open until the user says "done"
+        def execute_agent_request(ctx, input_json):
+            request = from_dict(ConversationRequest, decode_payload(input_json)["request"])
+            return encode_payload(AgentResponse(
+                message=f"Handled: {request.message}",
+                agent_type="CopilotStudio",
+                agent_id="bot-123",
+                conversation_id="conversation-123",
+                requires_follow_up=request.message != "done"
+            ))
+        
+        backend = create_test_backend(port=50062)
+        dt_worker = TaskHubGrpcWorker(host_address="localhost:50062")
+        dt_worker.add_orchestrator(worker.hybrid_agent_conversation_orchestrator)
+        dt_worker.add_activity(determine_agent_routing)
+        dt_worker.add_activity(execute_agent_request)
+        dt_worker.start()
+        
+        client = TaskHubGrpcClient(host_address="localhost:50062")
+        affinity = ConversationAffinity()
+        conversation_id = None
+        
+        for message in ["Start an approval workflow", "Approver is Alex", "done", "New question"]:
+            request = affinity.apply(ConversationRequest("test-user", message, conversation_id=conversation_id))
+            instance_id = client.schedule_new_orchestration(
+                worker.hybrid_agent_conversation_orchestrator, input=encode_payload(request))
+            state = client.wait_for_orchestration_completion(instance_id, timeout=30)
+            response = from_dict(AgentResponse, decode_payload(json.loads(state.serialized_output)))
+            assert response.routing_decision.reason == "Test routing", response
+            conversation_id = response.conversation_id
+            affinity.record(response)
+        
+        # Only the first message and the one after the topic completed were routed
+        assert routing_calls == ["Start an approval workflow", "New question"], routing_calls
+        assert affinity.hits == 2, affinity.snapshot()
+        print(f"  Affinity stats: {affinity.snapshot()}")
+        
+        print("\n✅ Sticky conversation routing tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Sticky conversation routing tests failed: {ex}")
+    finally:
+        restore_test_env(saved_env)
+        if dt_worker:
+            dt_worker.stop()
+        if backend:
+            backend.stop()
+
+async def test_speculative_hybrid():
+    """Test that uncertain hybrid requests run Copilot Studio and Azure AI concurrently"""
+    print("\n=== Testing Speculative Hybrid Execution ===")
+    
+    backend = None
+    dt_worker = None
+    saved_env = {}
+    try:
+        class SlowPowerPlatformService:
+            async def send_message_to_copilot_studio(self, request):
+                await asyncio.sleep(0.2)
+                escalate = "escalate" in request.message
+                return CopilotStudioResponse(
+                    message="Copilot Studio response",
+                    conversation_id="conversation-123",
+                    topic_completed=not escalate,
+                    next_topic="escalate" if escalate else None
+                )
+        
+        class SlowRoutingService(AgentRoutingService):
+            async def _execute_azure_ai_request(self, request, decision):
+                await asyncio.sleep(0.2)
+                return await super()._execute_azure_ai_request(request, decision)
+        
+        routing_service = SlowRoutingService(SlowPowerPlatformService())
+        routing_service.speculation_threshold = 0.7
+        uncertain = AgentRoutingDecision(AgentType.HYBRID, "Test", 0.5)
+        
+        start = time.perf_counter()
+        response = await routing_service._execute_hybrid_request(ConversationRequest("u1", "please escalate"), uncertain)
+        elapsed = time.perf_counter() - start
+        assert response.agent_type == "Hybrid" and elapsed < 0.35, elapsed
+        
+        response = await routing_service._execute_hybrid_request(ConversationRequest("u1", "thanks"), uncertain)
+        assert response.agent_type == "CopilotStudio"
+        
+        # Confident decisions are not speculated on
+        await routing_service._execute_hybrid_request(ConversationRequest("u1", "please escalate"), AgentRoutingDecision(AgentType.HYBRID, "Test", 0.9))
+        stats = routing_service.get_speculation_stats()
+        print(f"  Service stats: {stats}")
+        assert stats["speculations"] == 2 and stats["paidOff"] == 1
+        
+        # Routing flags uncertain Copilot Studio decisions, so the orchestrator never reads the threshold itself
+        flagged = await routing_service.determine_routing(ConversationRequest("u1", "Hi"))
+        confident = await routing_service.determine_routing(ConversationRequest("u1", "Help me create an approval workflow"))
+        assert flagged.routing_context == {"speculate": True} and "speculate" not in confident.routing_context
+        
+        # The orchestrator starts the escalation alongside Copilot Studio
+        from durabletask.client import TaskHubGrpcClient
+        from durabletask.testing import create_test_backend
+        from durabletask.worker import TaskHubGrpcWorker
+        
+        set_test_env(saved_env, "POWER_PLATFORM_ENVIRONMENT_URL", os.environ.get("POWER_PLATFORM_ENVIRONMENT_URL", "http://127.0.0.1:9"))
+        import worker
+        
+        def determine_agent_routing(ctx, request_json):
+            request = from_dict(ConversationRequest, decode_payload(request_json))
+            return encode_payload(AgentRoutingDecision(AgentType.COPILOT_STUDIO, "Test routing", 0.6,
+                                                       {"speculate": request.message == "Help me"}))
+        
+        def execute_agent_request(ctx, input_json):
+            input_data = decode_payload(input_json)
+            time.sleep(0.5)
+            if input_data["routing"]["selected_agent"] == AgentType.AZURE_AI.value:
+                return encode_payload(AgentResponse("Azure AI response", "AzureAI", "agent-1"))
+            return encode_payload(AgentResponse("Copilot Studio response", "CopilotStudio", "bot-123",
+                                                requires_follow_up=True, next_action="escalate"))
+        
+        backend = create_test_backend(port=50063)
+        dt_worker = TaskHubGrpcWorker(host_address="localhost:50063")
+        dt_worker.add_orchestrator(worker.hybrid_agent_conversation_orchestrator)
+        dt_worker.add_activity(determine_agent_routing)
+        dt_worker.add_activity(execute_agent_request)
+        dt_worker.add_activity(worker.record_speculation_outcome)
+        dt_worker.start()
+        
+        client = TaskHubGrpcClient(host_address="localhost:50063")
+        start = time.time()
+        instance_id = client.schedule_new_orchestration(
+            worker.hybrid_agent_conversation_orchestrator, input=encode_payload(ConversationRequest("u1", "Help me")))
+        state = client.wait_for_orchestration_completion(instance_id, timeout=30)
+        elapsed = time.time() - start
+        
+        response = from_dict(AgentResponse, decode_payload(json.loads(state.serialized_output)))
+        print(f"  Escalated orchestration completed in {elapsed:.2f}s")
+        assert response.agent_type == "Hybrid" and "Azure AI response" in response.message, response
+        assert elapsed < 0.9, elapsed
+        assert worker.services.routing.speculation_stats.paid_off == 1
+        
+        # Without the flag from routing, the escalation only starts after Copilot Studio answers
+        start = time.time()
+        instance_id = client.schedule_new_orchestration(
+            worker.hybrid_agent_conversation_orchestrator, input=encode_payload(ConversationRequest("u1", "Help")))
+        state = client.wait_for_orchestration_completion(instance_id, timeout=30)
+        assert time.time() - start > 1.0 and worker.services.routing.speculation_stats.speculations == 1
+        
+        print("\n✅ Speculative hybrid execution tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Speculative hybrid execution tests failed: {ex}")
+    finally:
+        restore_test_env(saved_env)
+        if dt_worker:
+            dt_worker.stop()
+        if backend:
+            backend.stop()
+
+async def test_flow_run_tracker():
+    """Test that outstanding flow runs are polled in batches and reported when they finish"""
+    print("\n=== Testing Flow Run Tracker ===")
+    
+    runner = None
+    service = None
+    tracker_service = None
+    backend = None
+    dt_worker = None
+    saved_env = {}
+    try:
+        # Each run finishes after it has been polled a few times
+        polls = {}
+        status_calls = 0
+        late_done = False
+        
+        async def runs_handler(request):
+            nonlocal status_calls
+            status_calls += 1
+            runs = []
+            for run_id in request.query["runIds"].split(","):
+                polls[run_id] = polls.get(run_id, 0) + 1
+                if run_id.startswith("late"):
+                    done = late_done
+                else:
+                    done = not run_id.startswith("stuck") and polls[run_id] >= int(run_id.rsplit("-", 1)[1]) % 3 + 1
+                runs.append({"runId": run_id, "status": "Succeeded" if done else "Running",
+                             "outputs": {"run": run_id} if done else None})
+            return web.json_response({"runs": runs})
+        
+        app = web.Application()
+        app.router.add_get("/api/flows/{flow_id}/runs", runs_handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        
+        set_test_env(saved_env, "POWER_PLATFORM_ENVIRONMENT_URL", f"http://127.0.0.1:{port}")
+        service = PowerPlatformGraphService()
+        
+        async def mock_token():
+            return "test-token"
+        service._get_power_platform_token = mock_token
+        
+        tracker = FlowRunTracker(service, min_interval=0.02, max_interval=0.1, batch_size=10)
+        runs = [(f"flow-{i % 2}", f"run-{i}") for i in range(40)]
+        results = await asyncio.gather(*[tracker.wait(flow_id, run_id, timeout=10) for flow_id, run_id in runs])
+        assert [result.run_id for result in results] == [run_id for _, run_id in runs]
+        assert all(result.status == "Succeeded" and result.output_data == {"run": result.run_id} for result in results)
+        
+        stats = tracker.snapshot()
+        print(f"  Tracker stats: {stats}, {sum(polls.values())} run polls in {status_calls} status calls")
+        assert stats["completed"] == 40 and stats["outstanding"] == 0
+        assert stats["statusCalls"] == status_calls and status_calls < sum(polls.values()) / 5
+        await tracker.stop()
+        
+        # Runs are dropped once their deadline passes, and event delivery is retried with backoff
+        attempts = []
+        
+        async def flaky_sink(instance_id, event_name, response):
+            attempts.append(event_name)
+            if len(attempts) < 3:
+                raise ConnectionError("sidecar unavailable")
+        
+        tracker = FlowRunTracker(service, min_interval=0.02, max_interval=0.1, event_sink=flaky_sink,
+                                 event_retry_delay=0.01)
+        try:
+            await tracker.wait("flow-0", "stuck-1", timeout=0.2)
+            raise AssertionError("Expected TimeoutError")
+        except asyncio.TimeoutError:
+            pass
+        await tracker.track("flow-0", "stuck-2", "instance-1", "stuck", timeout=0.1)
+        await tracker.track("flow-0", "run-3", "instance-1", "done", timeout=10)
+        await asyncio.sleep(0.3)
+        await tracker.stop()
+        stats = tracker.snapshot()
+        assert stats["outstanding"] == 0 and stats["expired"] == 2 and stats["completed"] == 1, stats
+        assert attempts == ["done"] * 3 and stats["eventRetries"] == 2 and stats["eventFailures"] == 0, stats
+        
+        # The flow orchestrator waits for an event raised by the tracker rather than polling with timers
+        from durabletask.client import TaskHubGrpcClient
+        from durabletask.testing import create_test_backend
+        import worker
+        
+        triggered_run = "run-durable-2"
+        
+        def trigger_power_automate_flow(ctx, request_json):
+            return encode_payload(PowerAutomateFlowResponse("flow-0", triggered_run, "Running"))
+        
+        backend = create_test_backend(port=50064)
+        dt_worker = AsyncTaskHubGrpcWorker(host_address="localhost:50064")
+        dt_worker.add_orchestrator(worker.power_automate_flow_orchestrator)
+        dt_worker.add_activity(trigger_power_automate_flow)
+        dt_worker.add_activity(worker.track_power_automate_flow_run)
+        dt_worker.add_activity(worker.check_power_automate_flow_run)
+        dt_worker.start()
+        
+        tracker_service = PowerPlatformGraphService()
+        tracker_service._get_power_platform_token = mock_token
+        worker.services.flow_run_tracker.power_platform_service = tracker_service
+        worker.services.flow_run_tracker.min_interval = 0.02
+        worker.services.flow_run_tracker.max_interval = 0.1
+        worker.event_client = TaskHubGrpcClient(host_address="localhost:50064")
+        
+        client = TaskHubGrpcClient(host_address="localhost:50064")
+        instance_id = client.schedule_new_orchestration(
+            worker.power_automate_flow_orchestrator, input=encode_payload(PowerAutomateFlowRequest("flow-0", "manual", {})))
+        state = await asyncio.to_thread(client.wait_for_orchestration_completion, instance_id, timeout=30)
+        
+        response = from_dict(PowerAutomateFlowResponse, decode_payload(json.loads(state.serialized_output)))
+        assert response.status == "Succeeded" and response.output_data == {"run": "run-durable-2"}, response
+        
+        # A run forgotten by a restarted worker is tracked again when the orchestration re-arms
+        worker.FLOW_RUN_REARM_INTERVAL = 1
+        triggered_run = "late-1"
+        instance_id = client.schedule_new_orchestration(
+            worker.power_automate_flow_orchestrator, input=encode_payload(PowerAutomateFlowRequest("flow-0", "manual", {})))
+        for _ in range(100):
+            if polls.get("late-1"):
+                break
+            await asyncio.sleep(0.05)
+        await asyncio.wrap_future(worker.activity_runtime.submit(worker.services.flow_run_tracker.stop()))
+        late_done = True
+        state = await asyncio.to_thread(client.wait_for_orchestration_completion, instance_id, timeout=30)
+        response = from_dict(PowerAutomateFlowResponse, decode_payload(json.loads(state.serialized_output)))
+        assert response.status == "Succeeded" and response.run_id == "late-1", response
+        
+        # When the deadline passes, a final status check catches a run whose event never arrived
+        async def failing_sink(instance_id, event_name, response):
+            raise ConnectionError("sidecar unavailable")
+        
+        worker.FLOW_RUN_TIMEOUT = 2
+        worker.services.flow_run_tracker.event_sink = failing_sink
+        worker.services.flow_run_tracker.event_retries = 0
+        for run_id, expected in [("run-durable-5", "Succeeded"), ("stuck-3", "TimedOut")]:
+            triggered_run = run_id
+            instance_id = client.schedule_new_orchestration(
+                worker.power_automate_flow_orchestrator,
+                input=encode_payload(PowerAutomateFlowRequest("flow-0", "manual", {})))
+            state = await asyncio.to_thread(client.wait_for_orchestration_completion, instance_id, timeout=30)
+            response = from_dict(PowerAutomateFlowResponse, decode_payload(json.loads(state.serialized_output)))
+            assert response.status == expected and response.run_id == run_id, response
+        
+        print("\n✅ Flow run tracker tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Flow run tracker tests failed: {ex}")
+    finally:
+        restore_test_env(saved_env)
+        if dt_worker:
+            dt_worker.stop()
+        if backend:
+            backend.stop()
+        if "worker" in sys.modules:
+            worker_module = sys.modules["worker"]
+            worker_module.event_client = None
+            worker_module.FLOW_RUN_TIMEOUT = int(os.getenv("FLOW_RUN_TIMEOUT", "3600"))
+            worker_module.FLOW_RUN_REARM_INTERVAL = int(os.getenv("FLOW_RUN_REARM_INTERVAL", "300"))
+            worker_module.services.flow_run_tracker.event_sink = worker_module._raise_flow_run_event
+            worker_module.services.flow_run_tracker.event_retries = 3
+            worker_module.services.flow_run_tracker.power_platform_service = worker_module.services.power_platform
+            if tracker_service:
+                await asyncio.wrap_future(worker_module.activity_runtime.submit(tracker_service.close()))
+        if service:
+            await service.close()
+        if runner:
+            await runner.cleanup()
+
+async def test_batched_flow_triggers():
+    """Test that a batch of flows is triggered concurrently with bounded parallelism and per-item errors"""
+    print("\n=== Testing Batched Flow Triggers ===")
+    
+    runner = None
+    service = None
+    saved_env = {}
+    try:
+        in_flight = 0
+        max_in_flight = 0
+        
+        async def trigger_handler(request):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            try:
+                await asyncio.sleep(0.05)
+                flow_id = request.match_info["flow_id"]
+                if flow_id == "broken-flow":
+                    return web.json_response({"error": "flow is turned off"}, status=400)
+                return web.json_response({"runId": f"run-{flow_id}", "status": "Running"})
+            finally:
+                in_flight -= 1
+        
+        app = web.Application()
+        app.router.add_post("/api/flows/{flow_id}/triggers/{trigger_name}/run", trigger_handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        
+        set_test_env(saved_env, "POWER_PLATFORM_ENVIRONMENT_URL", f"http://127.0.0.1:{port}")
+        service = PowerPlatformGraphService()
+        service.flow_batch_concurrency = 4
+        
+        async def mock_token():
+            return "test-token"
+        service._get_power_platform_token = mock_token
+        
+        flow_ids = [f"flow-{i}" for i in range(15)] + ["broken-flow"]
+        requests = [PowerAutomateFlowRequest(flow_id, "manual", {"index": i}) for i, flow_id in enumerate(flow_ids)]
+        start = time.perf_counter()
+        responses = await service.trigger_power_automate_flows(requests)
+        elapsed = time.perf_counter() - start
+        
+        print(f"  Triggered {len(responses)} flows in {elapsed:.2f}s, at most {max_in_flight} at a time")
+        assert [response.flow_id for response in responses] == flow_ids
+        assert all(response.run_id == f"run-{response.flow_id}" for response in responses[:-1])
+        assert responses[-1].status == "Failed" and "400" in responses[-1].error_message
+        assert max_in_flight == 4 and elapsed < 16 * 0.05, elapsed
+        
+        print("\n✅ Batched flow trigger tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Batched flow trigger tests failed: {ex}")
+    finally:
+        restore_test_env(saved_env)
+        if service:
+            await service.close()
+        if runner:
+            await runner.cleanup()
+
+async def test_context_deltas():
+    """Test that collaboration steps pass contexts by reference and rehydrate them from the context store"""
+    print("\n=== Testing Context Deltas ===")
+    
+    backend = None
+    dt_worker = None
+    original_routing_service = None
+    try:
+        # Versions are stored as deltas against their base and deduplicated by content
+        with tempfile.TemporaryDirectory() as directory:
+            store = ContextStore(directory, max_chain=2)
+            base_ref = store.put({"a": 1, "b": "x" * 1000})
+            ref = store.put({"a": 2, "b": "x" * 1000}, base_ref)
+            assert store.put({"b": "x" * 1000, "a": 2}) == ref and store.snapshot()["deduplicated"] == 1
+            assert store.snapshot()["bytesStored"] < 2 * 1000 + 200
+            
+            # Another worker sharing the directory resolves the delta chain
+            other = ContextStore(directory)
+            assert other.get(ref) == {"a": 2, "b": "x" * 1000}
+            delta = ContextDelta([base_ref, ref], {"c": 3}, ["b"])
+            assert other.rehydrate(delta) == {"a": 2, "c": 3}
+            try:
+                other.get("sha256:unknown")
+                raise AssertionError("Expected KeyError")
+            except KeyError:
+                pass
+            
+            # A directory store only keeps its bounded cache in memory
+            bounded = ContextStore(directory, cache_size=4)
+            refs = [bounded.put({"version": i}) for i in range(20)]
+            assert bounded.get(refs[0]) == {"version": 0} and bounded.put({"version": 0}) == refs[0]
+            assert not bounded._entries and bounded.snapshot()["cached"] == 4
+        
+        # The in-memory store keeps its own copy of each version and evicts the least recently used ones
+        memory = ContextStore(max_entries=4, cache_size=2)
+        context = {"history": ["turn 1"]}
+        ref = memory.put(context)
+        context["history"].append("turn 2")
+        memory.get(ref)["history"].append("turn 3")
+        assert memory.get(ref) == {"history": ["turn 1"]}
+        refs = [memory.put({"version": i}) for i in range(5)]
+        assert memory.get(refs[4]) == {"version": 4} and memory.snapshot()["evicted"] == 2
+        try:
+            memory.get(ref)
+            raise AssertionError("Expected KeyError")
+        except KeyError:
+            pass
+        
+        # A chain of collaboration steps, each adding a large result to the context it was given
+        from durabletask.client import TaskHubGrpcClient
+        from durabletask.testing import create_test_backend
+        import worker
+        
+        class ContextGrowingRoutingService:
+            async def route_and_execute(self, request):
+                # Seeded random results, so payload compression does not hide how large the inline contexts grow
+                step = len(request.context or {})
+                context = {**(request.context or {}), f"result-{step}": random.Random(step).randbytes(1500).hex()}
+                return AgentResponse("Step done", "AzureAI", "agent-1", context=context)
+        
+        input_sizes = []
+        
+        async def execute_agent_request(ctx, input_json):
+            input_sizes.append(len(input_json))
+            return await worker.execute_agent_request(ctx, input_json)
+        
+        backend = create_test_backend(port=50065)
+        dt_worker = AsyncTaskHubGrpcWorker(host_address="localhost:50065")
+        dt_worker.add_orchestrator(worker.multi_agent_collaboration_orchestrator)
+        dt_worker.add_activity(worker.plan_agent_collaboration)
+        dt_worker.add_activity(worker.load_agent_contexts)
+        dt_worker.add_activity(execute_agent_request)
+        dt_worker.start()
+        client = TaskHubGrpcClient(host_address="localhost:50065")
+        
+        original_routing_service = worker.services.routing
+        worker.services.routing = ContextGrowingRoutingService()
+        capabilities = [AgentCapability(f"step{i}", f"Step {i}", [AgentType.AZURE_AI],
+                                        depends_on=[f"step{i - 1}"] if i else []) for i in range(6)]
+        request = MultiAgentRequest("Grow the context", capabilities, "u1", context={"session": "s" * 500})
+        
+        results = {}
+        for name, store in [("inline", None), ("by reference", ContextStore())]:
+            worker.context_store = store
+            input_sizes.clear()
+            instance_id = client.schedule_new_orchestration(
+                worker.multi_agent_collaboration_orchestrator, input=encode_payload(request))
+            state = client.wait_for_orchestration_completion(instance_id, timeout=30)
+            responses = [from_dict(AgentResponse, data) for data in decode_payload(json.loads(state.serialized_output))]
+            results[name] = [response.context for response in responses]
+            print(f"  Contexts {name}: step inputs of {min(input_sizes)}-{max(input_sizes)} bytes")
+            if store is not None:
+                assert max(input_sizes) < 1000, input_sizes
+                print(f"  Store stats: {store.snapshot()}")
+            else:
+                assert max(input_sizes) > 10000, input_sizes
+        
+        assert results["inline"] == results["by reference"]
+        assert len(results["inline"][-1]) == 7
+        
+        print("\n✅ Context delta tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Context delta tests failed: {ex}")
+    finally:
+        if dt_worker:
+            dt_worker.stop()
+        if backend:
+            backend.stop()
+        if "worker" in sys.modules:
+            sys.modules["worker"].context_store = None
+            if original_routing_service is not None:
+                sys.modules["worker"].services.routing = original_routing_service
+
+async def test_payload_offloading():
+    """Test that payloads over the threshold travel as claim-check tokens and are read back from the payload store"""
+    print("\n=== Testing Payload Offloading ===")
+    
+    backend = None
+    dt_worker = None
+    try:
+        from durabletask import task
+        from durabletask.client import TaskHubGrpcClient
+        from durabletask.payload.store import LargePayloadStorageOptions
+        from durabletask.testing import create_test_backend
+        from durabletask.worker import TaskHubGrpcWorker
+        
+        with tempfile.TemporaryDirectory() as directory:
+            store = CachedPayloadStore(LocalPayloadStore(directory, LargePayloadStorageOptions(threshold_bytes=16 * 1024)))
+            token = store.upload(b"payload")
+            assert store.is_known_token(token) and not store.is_known_token("payload")
+            assert LocalPayloadStore(directory).download(token) == b"payload"
+            
+            # Payloads are content addressed, so uploading the same bytes later reuses the same file
+            await asyncio.sleep(1.1)
+            assert store.upload(b"payload") == token and len(os.listdir(directory)) == 1
+            
+            # A response larger than the gRPC message limit is passed between steps by reference
+            def create_response(ctx, size):
+                # Random text, so payload compression cannot shrink it back under the gRPC limit
+                response = AgentResponse(os.urandom(size // 2).hex(), "AzureAI", "agent-1",
+                                         context={"history": ["turn"] * 1000})
+                return encode_payload(response)
+            
+            def measure_response(ctx, response_json):
+                return len(from_dict(AgentResponse, decode_payload(response_json)).message)
+            
+            def offloading_orchestrator(ctx, size):
+                response_json = yield ctx.call_activity(create_response, input=size)
+                lengths = yield task.when_all([ctx.call_activity(measure_response, input=response_json) for _ in range(3)])
+                return lengths
+            
+            backend = create_test_backend(port=50066)
+            dt_worker = TaskHubGrpcWorker(host_address="localhost:50066", payload_store=store)
+            dt_worker.add_orchestrator(offloading_orchestrator)
+            dt_worker.add_activity(create_response)
+            dt_worker.add_activity(measure_response)
+            dt_worker.start()
+            
+            client = TaskHubGrpcClient(host_address="localhost:50066", payload_store=store)
+            size = 6 * 1024 * 1024
+            instance_id = client.schedule_new_orchestration(offloading_orchestrator, input=size)
+            state = client.wait_for_orchestration_completion(instance_id, timeout=60)
+            assert state.failure_details is None, state.failure_details
+            assert json.loads(state.serialized_output) == [size] * 3
+            
+            stats = store.snapshot()
+            print(f"  Payload store stats: {stats}, {len(os.listdir(directory))} files")
+            assert stats["uploads"] >= 2 and stats["cacheHits"] > 0, stats
+        
+        print("\n✅ Payload offloading tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Payload offloading tests failed: {ex}")
+    finally:
+        if dt_worker:
+            dt_worker.stop()
+        if backend:
+            backend.stop()
+
+async def test_lazy_worker_startup():
+    """Test that importing the worker creates no services and does not need Power Platform settings"""
+    print("\n=== Testing Lazy Worker Startup ===")
+    
+    saved_env = {}
+    try:
+        import subprocess
+        from runtime import profile_imports
+        
+        env = {key: value for key, value in os.environ.items() if key != "POWER_PLATFORM_ENVIRONMENT_URL"}
+        script = ("import sys, worker; "
+                  "print(worker.IMPORT_TIME, 'aiohttp' in sys.modules, 'azure.identity' in sys.modules, "
+                  "worker.services.is_created('power_platform'))")
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, env=env, timeout=60)
+        assert result.returncode == 0, result.stderr
+        import_time, *loaded = result.stdout.split()
+        print(f"  Worker imported in {float(import_time):.3f}s")
+        assert loaded == ["False", "False", "False"], loaded
+        
+        # Services are created on first use
+        set_test_env(saved_env, "POWER_PLATFORM_ENVIRONMENT_URL", os.environ.get("POWER_PLATFORM_ENVIRONMENT_URL", "http://127.0.0.1:9"))
+        import worker
+        services = worker.WorkerServices()
+        assert not services.is_created("routing")
+        assert services.routing.power_platform_service is services.power_platform
+        assert services.is_created("routing") and services.is_created("power_platform")
+        
+        slowest = profile_imports("worker", top=5)
+        print(f"  Slowest imports: {[(name, round(seconds * 1000, 1)) for name, seconds in slowest]}")
+        assert 0 < len(slowest) <= 5 and "services" not in [name for name, _ in slowest]
+        
+        print("\n✅ Lazy worker startup tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Lazy worker startup tests failed: {ex}")
+    finally:
+        restore_test_env(saved_env)
+
+async def test_async_activities():
+    """Test that async def activities are awaited on the worker loop, alongside plain activities on the thread pool"""
+    print("\n=== Testing Async Activities ===")
+    
+    backend = None
+    dt_worker = None
+    try:
+        from durabletask import task
+        from durabletask.client import TaskHubGrpcClient
+        from durabletask.testing import create_test_backend
+        from durabletask.worker import ConcurrencyOptions
+        
+        async def wait_on_io(ctx, seconds):
+            await asyncio.sleep(seconds)
+            return ctx.task_id
+        
+        async def failing_io(ctx, message):
+            await asyncio.sleep(0)
+            raise ValueError(message)
+        
+        def blocking_io(ctx, seconds):
+            time.sleep(seconds)
+            return "done"
+        
+        def async_fan_out(ctx, count):
+            task_ids = yield task.when_all(
+                [ctx.call_activity(wait_on_io, input=0.5) for _ in range(count)] + [ctx.call_activity(blocking_io, input=0.1)])
+            try:
+                yield ctx.call_activity(failing_io, input="flow unavailable")
+            except task.TaskFailedError as ex:
+                return {"completed": len(task_ids), "error": ex.details.message}
+        
+        # Far more activities in flight than the two pool threads could hold with blocking waits
+        backend = create_test_backend(port=50067)
+        dt_worker = AsyncTaskHubGrpcWorker(
+            host_address="localhost:50067", concurrency_options=ConcurrencyOptions(maximum_thread_pool_workers=2))
+        dt_worker.add_orchestrator(async_fan_out)
+        dt_worker.add_activity(wait_on_io)
+        dt_worker.add_activity(failing_io)
+        dt_worker.add_activity(blocking_io)
+        
+        # Record the handlers the pinned SDK hands the work item manager, to check they unwrap as expected
+        handlers = []
+        run_func = dt_worker._async_worker_manager._run_func
+        
+        async def recording_run_func(func, *args, **kwargs):
+            handlers.append(func)
+            return await run_func(func, *args, **kwargs)
+        
+        dt_worker._async_worker_manager._run_func = recording_run_func
+        dt_worker.start()
+        
+        client = TaskHubGrpcClient(host_address="localhost:50067")
+        start = time.time()
+        instance_id = client.schedule_new_orchestration(async_fan_out, input=50)
+        state = await asyncio.to_thread(client.wait_for_orchestration_completion, instance_id, timeout=30)
+        elapsed = time.time() - start
+        
+        assert state.failure_details is None, state.failure_details
+        result = json.loads(state.serialized_output)
+        print(f"  Ran 50 async activities with 2 pool threads in {elapsed:.2f}s: {result}")
+        assert result == {"completed": 51, "error": "flow unavailable"}, result
+        assert elapsed < 5, elapsed
+        
+        # The pinned SDK wraps every handler in the release closure the worker manager unwraps
+        assert _has_release_wrapper(TaskHubGrpcWorker._async_run_loop.__code__)
+        unwrapped = {_unwrap_release(func)[0].__name__ for func in handlers}
+        assert unwrapped == {"_execute_activity", "_execute_orchestrator"}, unwrapped
+        try:
+            _unwrap_release(blocking_io)
+            raise AssertionError("Expected RuntimeError")
+        except RuntimeError:
+            pass
+        
+        # A worker on an SDK that wraps handlers differently refuses to start rather than misbehaving later
+        class ChangedSdkWorker(AsyncTaskHubGrpcWorker):
+            async def _async_run_loop(self):
+                pass
+        
+        try:
+            ChangedSdkWorker(host_address="localhost:50067")
+            raise AssertionError("Expected RuntimeError")
+        except RuntimeError as ex:
+            assert "durabletask 1.11" in str(ex), ex
+        
+        print("\n✅ Async activity tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Async activity tests failed: {ex}")
+    finally:
+        if dt_worker:
+            dt_worker.stop()
+        if backend:
+            backend.stop()
+
+SUPERVISED_WORKER = """
+import asyncio, os, sys
+
+def marker(name):
+    open(os.path.join(os.environ["SUPERVISED_DIR"], name), "a").close()
+
+async def main():
+    index = os.environ["WORKER_PROCESS_INDEX"]
+    marker(f"started-{index}-{os.getpid()}")
+    if index == "0" and not os.path.exists(os.path.join(os.environ["SUPERVISED_DIR"], "crashed")):
+        marker("crashed")
+        sys.exit(3)
+    try:
+        while True:
+            await asyncio.sleep(0.05)
+    except asyncio.CancelledError:
+        marker(f"drained-{index}")
+
+def crunch(ctx, n):
+    return sum(i * i for i in range(n)), os.getpid()
+"""
+
+async def test_worker_supervisor():
+    """Test that the launcher restarts crashed worker processes and drains them all on shutdown"""
+    print("\n=== Testing Worker Supervisor ===")
+    
+    from launcher import WorkerSupervisor
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "supervised_worker.py"), "w") as f:
+            f.write(SUPERVISED_WORKER)
+        saved_env = {}
+        set_test_env(saved_env, "SUPERVISED_DIR", directory)
+        sys.path.insert(0, directory)
+        supervisor = WorkerSupervisor("supervised_worker:main", processes=2, drain_timeout=10, restart_backoff=0.1)
+        try:
+            supervisor.start()
+            
+            # Worker 0 crashes on its first start and is restarted
+            deadline = time.time() + 30
+            while time.time() < deadline:
+                await asyncio.sleep(0.05)
+                supervisor.check()
+                started = [name for name in os.listdir(directory) if name.startswith("started-")]
+                if supervisor.restarts == 1 and len(started) == 3:
+                    break
+            await asyncio.sleep(0.5)
+            stats = supervisor.snapshot()
+            print(f"  Supervisor stats: {stats}")
+            assert stats["restarts"] == 1 and stats["alive"] == 2, stats
+            
+            duration = await asyncio.to_thread(supervisor.stop)
+            print(f"  Drained in {duration:.2f}s")
+            assert os.path.exists(os.path.join(directory, "drained-0"))
+            assert os.path.exists(os.path.join(directory, "drained-1"))
+            assert duration < 10 and supervisor.snapshot()["alive"] == 0
+            
+            # CPU-bound activities can opt into a process pool
+            from durabletask import task
+            from runtime import ProcessPoolActivities
+            from supervised_worker import crunch
+            pool = ProcessPoolActivities(2)
+            try:
+                activity = pool.wrap(crunch)
+                assert activity.__name__ == "crunch" and inspect.iscoroutinefunction(activity)
+                results = await asyncio.gather(*[activity(task.ActivityContext("instance", i), 10000) for i in range(4)])
+                assert {total for total, _ in results} == {sum(i * i for i in range(10000))}
+                assert os.getpid() not in {pid for _, pid in results}
+                print(f"  Process pool stats: {pool.snapshot()}")
+                assert pool.snapshot()["completed"] == 4
+                
+                # finish runs back in this process, for steps that need its state
+                renamed = pool.wrap(crunch, finish=lambda result: (result[1], os.getpid()), name="crunch_here")
+                child_pid, parent_pid = await renamed(task.ActivityContext("instance", 5), 100)
+                assert renamed.__name__ == "crunch_here" and child_pid != parent_pid == os.getpid()
+                
+                # A plan made in the pool stores its contexts in this process's in-memory context store
+                import worker
+                worker.context_store = ContextStore()
+                try:
+                    planner = pool.wrap(worker._plan_collaboration_steps, finish=worker._store_step_contexts,
+                                        name="plan_agent_collaboration")
+                    request = MultiAgentRequest("Plan", [AgentCapability("step", "Step", [AgentType.AZURE_AI])], "u1",
+                                                context={"session": "s1"})
+                    steps = decode_payload(await planner(task.ActivityContext("instance", 6), encode_payload(request)))
+                    assert steps[0]["input_context"] is None
+                    assert worker.context_store.get(steps[0]["input_context_ref"]) == {"session": "s1"}
+                finally:
+                    worker.context_store = None
+            finally:
+                pool.shutdown()
+            
+            print("\n✅ Worker supervisor tests passed!")
+            
+        except Exception as ex:
+            print(f"\n❌ Worker supervisor tests failed: {ex}")
+        finally:
+            restore_test_env(saved_env)
+            supervisor.stop()
+            sys.path.remove(directory)
+
+async def test_work_scheduler():
+    """Test per-registration concurrency limits and priorities for activities"""
+    print("\n=== Testing Work Scheduler ===")
+    
+    backend = None
+    dt_worker = None
+    try:
+        # Two slots: slow agent calls are capped at one, so a burst of them cannot hold back cheap planning steps
+        scheduler = WorkScheduler(capacity=2)
+        scheduler.configure("execute_agent_request", max_concurrency=1)
+        scheduler.configure("plan_agent_collaboration", priority=10)
+        order = []
+        
+        async def run(name, seconds):
+            async with scheduler.slot(name):
+                order.append(name)
+                await asyncio.sleep(seconds)
+        
+        start = time.time()
+        slow = [asyncio.create_task(run("execute_agent_request", 0.2)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        background = [asyncio.create_task(run("manage_topic", 0.05)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        cheap = [asyncio.create_task(run("plan_agent_collaboration", 0.05)) for _ in range(2)]
+        await asyncio.gather(*cheap)
+        cheap_elapsed = time.time() - start
+        await asyncio.gather(*slow, *background)
+        
+        stats = scheduler.snapshot()
+        print(f"  Admission order: {order}")
+        print(f"  Scheduler stats: {json.dumps(stats['names']['execute_agent_request'])}")
+        assert order[2:4] == ["plan_agent_collaboration"] * 2, order
+        assert cheap_elapsed < 0.2, cheap_elapsed
+        assert stats["running"] == 0 and stats["queued"] == 0, stats
+        assert stats["names"]["execute_agent_request"]["maxQueued"] == 2
+        assert stats["names"]["execute_agent_request"]["maxWaitMs"] >= 350
+        assert stats["names"]["plan_agent_collaboration"]["maxWaitMs"] < 100
+        
+        # A waiter that is cancelled gives up its place in the queue
+        blocker = asyncio.create_task(run("execute_agent_request", 0.1))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(scheduler.acquire("execute_agent_request"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await blocker
+        assert scheduler.snapshot()["running"] == 0 and scheduler.snapshot()["queued"] == 0
+        
+        # Limits declared at registration apply to work items from the backend
+        from durabletask import task
+        from durabletask.client import TaskHubGrpcClient
+        from durabletask.testing import create_test_backend
+        from durabletask.worker import ConcurrencyOptions
+        
+        in_flight = []
+        
+        async def call_agent(ctx, seconds):
+            in_flight.append(1)
+            peak = len(in_flight)
+            await asyncio.sleep(seconds)
+            in_flight.pop()
+            return peak
+        
+        def limited_fan_out(ctx, count):
+            peaks = yield task.when_all([ctx.call_activity(call_agent, input=0.1) for _ in range(count)])
+            return max(peaks)
+        
+        backend = create_test_backend(port=50068)
+        dt_worker = AsyncTaskHubGrpcWorker(host_address="localhost:50068")
+        dt_worker.add_orchestrator(limited_fan_out)
+        dt_worker.add_activity(call_agent, max_concurrency=3)
+        dt_worker.start()
+        
+        client = TaskHubGrpcClient(host_address="localhost:50068")
+        instance_id = client.schedule_new_orchestration(limited_fan_out, input=12)
+        state = await asyncio.to_thread(client.wait_for_orchestration_completion, instance_id, timeout=30)
+        assert state.failure_details is None, state.failure_details
+        activity_stats = dt_worker.activity_scheduler.snapshot()["names"]["call_agent"]
+        print(f"  Peak concurrency {state.serialized_output}, backend stats: {json.dumps(activity_stats)}")
+        assert json.loads(state.serialized_output) == 3
+        assert activity_stats["admitted"] == 12 and activity_stats["waited"] > 0, activity_stats
+        
+        # The scheduler enforces the SDK's concurrency limit itself, so a burst of capped work queued in it larger
+        # than that limit cannot keep higher-priority work from being dequeued
+        dt_worker.stop()
+        backend.stop()
+        started_at = {}
+        
+        async def slow_call(ctx, seconds):
+            await asyncio.sleep(seconds)
+            return seconds
+        
+        def cheap_step(ctx, _):
+            started_at.setdefault("cheap", time.time())
+            return "planned"
+        
+        def slow_fan_out(ctx, count):
+            results = yield task.when_all([ctx.call_activity(slow_call, input=0.2) for _ in range(count)])
+            return len(results)
+        
+        def cheap_orchestrator(ctx, _):
+            result = yield ctx.call_activity(cheap_step)
+            return result
+        
+        backend = create_test_backend(port=50071)
+        dt_worker = AsyncTaskHubGrpcWorker(
+            host_address="localhost:50071", concurrency_options=ConcurrencyOptions(maximum_concurrent_activity_work_items=4))
+        dt_worker.add_orchestrator(slow_fan_out)
+        dt_worker.add_orchestrator(cheap_orchestrator)
+        dt_worker.add_orchestrator(limited_fan_out)
+        dt_worker.add_activity(slow_call, max_concurrency=1)
+        dt_worker.add_activity(cheap_step, priority=10)
+        dt_worker.add_activity(call_agent)
+        dt_worker.start()
+        
+        client = TaskHubGrpcClient(host_address="localhost:50071")
+        slow_id = client.schedule_new_orchestration(slow_fan_out, input=10)
+        await asyncio.sleep(0.3)
+        scheduled = time.time()
+        cheap_id = client.schedule_new_orchestration(cheap_orchestrator)
+        state = await asyncio.to_thread(client.wait_for_orchestration_completion, cheap_id, timeout=30)
+        assert state.failure_details is None, state.failure_details
+        cheap_delay = started_at["cheap"] - scheduled
+        state = await asyncio.to_thread(client.wait_for_orchestration_completion, slow_id, timeout=30)
+        assert state.failure_details is None and state.serialized_output == "10", state.failure_details
+        # The slot is given back just after the result is reported, so allow the last release a moment
+        for _ in range(20):
+            slow_stats = dt_worker.activity_scheduler.snapshot()["names"]["slow_call"]
+            if slow_stats["running"] == 0:
+                break
+            await asyncio.sleep(0.05)
+        print(f"  Priority step started {cheap_delay * 1000:.0f}ms after a burst of 10 capped calls, "
+              f"slow stats: {json.dumps(slow_stats)}")
+        assert cheap_delay < 0.5, cheap_delay
+        assert slow_stats["maxQueued"] > 4 and slow_stats["running"] == 0, slow_stats
+        
+        # Uncapped activities are still held to the SDK's concurrency limit
+        instance_id = client.schedule_new_orchestration(limited_fan_out, input=12)
+        state = await asyncio.to_thread(client.wait_for_orchestration_completion, instance_id, timeout=30)
+        assert state.failure_details is None, state.failure_details
+        assert dt_worker.activity_scheduler.capacity == 4 and json.loads(state.serialized_output) == 4, state.serialized_output
+        
+        print("\n✅ Work scheduler tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Work scheduler tests failed: {ex}")
+    finally:
+        if dt_worker:
+            dt_worker.stop()
+        if backend:
+            backend.stop()
+
+async def test_worker_host():
+    """Test that stopping the worker host drains in-flight activities and reports them instead of abandoning them"""
+    print("\n=== Testing Worker Host ===")
+    
+    backend = None
+    workers = []
+    try:
+        from durabletask import task
+        from durabletask.client import TaskHubGrpcClient
+        from durabletask.testing import create_test_backend
+        from runtime import WorkerHost
+        
+        started = []
+        executions = []
+        
+        async def slow_agent_call(ctx, seconds):
+            started.append(ctx.task_id)
+            await asyncio.sleep(seconds)
+            executions.append(ctx.task_id)
+            return seconds
+        
+        def slow_planning(ctx, seconds):
+            started.append(ctx.task_id)
+            time.sleep(seconds)
+            executions.append(ctx.task_id)
+            return seconds
+        
+        def drained_orchestrator(ctx, seconds):
+            results = yield task.when_all([ctx.call_activity(slow_agent_call, input=seconds),
+                                           ctx.call_activity(slow_planning, input=seconds)])
+            return sum(results)
+        
+        def create_worker():
+            dt_worker = AsyncTaskHubGrpcWorker(host_address="localhost:50069")
+            dt_worker.add_orchestrator(drained_orchestrator)
+            dt_worker.add_activity(slow_agent_call)
+            dt_worker.add_activity(slow_planning)
+            dt_worker.start()
+            workers.append(dt_worker)
+            return dt_worker
+        
+        backend = create_test_backend(port=50069)
+        host = WorkerHost(create_worker(), drain_timeout=10, exit_on_timeout=False)
+        flushed = []
+        host.on_shutdown(lambda: flushed.append("sync"))
+        
+        async def flush():
+            flushed.append("async")
+        
+        host.on_shutdown(flush)
+        
+        client = TaskHubGrpcClient(host_address="localhost:50069")
+        instance_id = client.schedule_new_orchestration(drained_orchestrator, input=0.5)
+        while len(started) < 2:
+            await asyncio.sleep(0.01)
+        
+        # Stop while both activities are running: they finish and their results reach the backend
+        host.request_stop()
+        assert await host.run()
+        print(f"  Drained in {host.drain_duration:.2f}s")
+        assert len(executions) == 2 and flushed == ["sync", "async"], (executions, flushed)
+        assert 0.3 < host.drain_duration < 5, host.drain_duration
+        
+        # A replacement worker finishes the orchestration without running the activities again
+        create_worker()
+        state = await asyncio.to_thread(client.wait_for_orchestration_completion, instance_id, timeout=30)
+        assert state.failure_details is None and json.loads(state.serialized_output) == 1.0, state.serialized_output
+        assert len(executions) == 2, executions
+        
+        # Work that outlives the deadline is left for the scheduler to redeliver
+        host = WorkerHost(workers[-1], drain_timeout=0.2, exit_on_timeout=False)
+        client.schedule_new_orchestration(drained_orchestrator, input=1.0)
+        while len(started) < 4:
+            await asyncio.sleep(0.01)
+        host.request_stop()
+        assert not await host.run()
+        print(f"  Gave up after {host.drain_duration:.2f}s")
+        assert host.drain_duration < 1, host.drain_duration
+        
+        print("\n✅ Worker host tests passed!")
+        
+    except Exception as ex:
+        print(f"\n❌ Worker host tests failed: {ex}")
+    finally:
+        for dt_worker in workers:
+            await asyncio.to_thread(dt_worker.stop)
+        if backend:
+            backend.stop()
+
 async def main():
     """Run all tests"""
     print("Copilot Studio Extensibility - Integration Tests")
@@ -170,7 +2050,31 @@ async def main():
     
     await test_models()
     await test_agent_routing()
+    await test_keyword_matcher()
+    await test_batch_routing()
+    await test_routing_cache()
     await test_collaboration_planning()
+    await test_connection_pool()
+    await test_token_cache()
+    await test_activity_runtime()
+    await test_payload_codecs()
+    await test_pac_command_broker()
+    await test_catalog_cache()
+    await test_request_coalescing()
+    await test_rate_limiter()
+    await test_circuit_breaker()
+    await test_parallel_collaboration()
+    await test_sticky_routing()
+    await test_speculative_hybrid()
+    await test_flow_run_tracker()
+    await test_batched_flow_triggers()
+    await test_context_deltas()
+    await test_payload_offloading()
+    await test_lazy_worker_startup()
+    await test_async_activities()
+    await test_worker_supervisor()
+    await test_work_scheduler()
+    await test_worker_host()
     
     print("\n" + "=" * 60)
     print("🎉 All tests completed!")
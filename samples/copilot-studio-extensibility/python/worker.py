@@ -2,41 +2,119 @@
 Worker for Copilot Studio extensibility with Azure Durable Task SDKs
 """
 
+import time
+_import_started = time.perf_counter()
+
 import asyncio
 import logging
 import os
-import json
-from datetime import datetime
-from azure.identity import DefaultAzureCredential, ManagedIdentityCredential
-from durabletask.azuremanaged.worker import DurableTaskSchedulerWorker
-from models import *
-from services import PowerPlatformGraphService, PacCliService, AgentRoutingService
+from datetime import datetime, timedelta, timezone
+from functools import cached_property
+from typing import Any, Dict, List
+from durabletask import task
+from durabletask.azuremanaged.client import DurableTaskSchedulerClient
+from models import (
+    AgentCapability, AgentCollaborationStep, AgentResponse, AgentRoutingDecision, AgentRoutingPreference, AgentType,
+    ContextDelta, ConversationRequest, CopilotStudioRequest, MultiAgentRequest, PowerAutomateFlowRequest,
+    PowerAutomateFlowResponse, TopicAction, TopicManagementRequest, from_dict, to_dict
+)
+from runtime import ActivityRuntime, AsyncDurableTaskSchedulerWorker, ProcessPoolActivities, WorkerHost, profile_imports
+from codec import encode_payload, decode_payload
+from routing import KeywordMatcher, CAPABILITY_KEYWORDS, COLLABORATION_KEYWORDS
+from flows import FlowRunTracker, TERMINAL_RUN_STATUSES
+from contexts import create_context_store
+from payloads import create_payload_store
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize services
-power_platform_service = PowerPlatformGraphService()
-pac_service = PacCliService()
-routing_service = AgentRoutingService(power_platform_service)
+class WorkerServices:
+    """Services used by the activities, each created on first use so importing the worker stays cheap"""
+    
+    @cached_property
+    def power_platform(self):
+        # Importing services pulls in aiohttp and azure.identity, so wait until an activity needs it
+        from services import PowerPlatformGraphService
+        return PowerPlatformGraphService()
+    
+    @cached_property
+    def pac(self):
+        from services import PacCliService
+        return PacCliService()
+    
+    @cached_property
+    def routing(self):
+        from services import AgentRoutingService
+        return AgentRoutingService(self.power_platform)
+    
+    @cached_property
+    def catalog(self):
+        """Bots, topics and environment info, loaded in the background and refreshed periodically"""
+        from catalog import CatalogCache
+        return CatalogCache(self.power_platform, self.pac, float(os.getenv("CATALOG_REFRESH_INTERVAL", "300")))
+    
+    @cached_property
+    def flow_run_tracker(self) -> FlowRunTracker:
+        """One poller for every outstanding flow run instead of a timer loop per orchestration"""
+        return FlowRunTracker(
+            self.power_platform,
+            min_interval=float(os.getenv("FLOW_RUN_POLL_MIN_INTERVAL", "1")),
+            max_interval=float(os.getenv("FLOW_RUN_POLL_MAX_INTERVAL", "30")),
+            batch_size=int(os.getenv("FLOW_RUN_POLL_BATCH_SIZE", "50")),
+            event_sink=_raise_flow_run_event
+        )
+    
+    def is_created(self, name: str) -> bool:
+        """Whether a service has been created yet"""
+        return name in self.__dict__
+
+services = WorkerServices()
+
+# Versioned store that lets collaboration steps pass contexts by reference, when CONTEXT_STORE is set
+context_store = create_context_store()
+
+# Keyword matchers used when planning collaborations
+capability_matcher = KeywordMatcher(CAPABILITY_KEYWORDS)
+collaboration_matcher = KeywordMatcher(COLLABORATION_KEYWORDS)
+
+# Shared event loop for all service calls, so sessions and caches stay warm between invocations;
+# async activities await it from the worker loop without holding a pool thread
+activity_runtime = ActivityRuntime()
+
+# Claim-check store for payloads over PAYLOAD_OFFLOAD_THRESHOLD, when PAYLOAD_STORE is set
+payload_store = create_payload_store()
+
+# Process pool for CPU-bound activities, used when WORKER_CPU_PROCESSES is set
+cpu_processes = int(os.getenv("WORKER_CPU_PROCESSES", "0"))
+process_pool = ProcessPoolActivities(cpu_processes) if cpu_processes > 0 else None
+
+# Client used to raise flow run completion events, created in main()
+event_client = None
+
+# How long a flow orchestration waits for its run to finish
+FLOW_RUN_TIMEOUT = int(os.getenv("FLOW_RUN_TIMEOUT", "3600"))
+# How often a waiting flow orchestration registers its run again, so a restarted worker picks it up
+FLOW_RUN_REARM_INTERVAL = int(os.getenv("FLOW_RUN_REARM_INTERVAL", "300"))
+
+async def _raise_flow_run_event(instance_id: str, event_name: str, response: PowerAutomateFlowResponse) -> None:
+    # The gRPC client is synchronous, so keep it off the activity loop
+    await asyncio.get_running_loop().run_in_executor(
+        None, lambda: event_client.raise_orchestration_event(instance_id, event_name, data=encode_payload(response)))
+
+IMPORT_TIME = time.perf_counter() - _import_started
 
 # Activity functions
-def determine_agent_routing(ctx, request_json: str) -> str:
+async def determine_agent_routing(ctx, request_json: str) -> str:
     """Determine which agent should handle a conversation request"""
     logger.info("Determining agent routing")
     
     try:
-        request = from_dict(ConversationRequest, json.loads(request_json))
+        request = from_dict(ConversationRequest, decode_payload(request_json))
         
-        # Run the async function in a new event loop
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            decision = loop.run_until_complete(routing_service.determine_routing(request))
-            return json.dumps(to_dict(decision))
-        finally:
-            loop.close()
+        # Run the async function on the shared activity runtime loop
+        decision = await activity_runtime.run_async(services.routing.determine_routing(request))
+        return encode_payload(decision)
     
     except Exception as ex:
         logger.error(f"Error determining agent routing: {ex}")
@@ -45,24 +123,40 @@ def determine_agent_routing(ctx, request_json: str) -> str:
             reason="Error in routing, defaulting to Copilot Studio",
             confidence=0.5
         )
-        return json.dumps(to_dict(decision))
+        return encode_payload(decision)
+
+async def determine_agent_routing_batch(ctx, requests_json: str) -> str:
+    """Determine which agent should handle each of a batch of conversation requests"""
+    logger.info("Determining agent routing for a batch of requests")
+    
+    requests = [from_dict(ConversationRequest, data) for data in decode_payload(requests_json)]
+    decisions = await activity_runtime.run_async(services.routing.determine_routing_many(requests))
+    return encode_payload(decisions)
 
-def execute_agent_request(ctx, input_json: str) -> str:
+async def execute_agent_request(ctx, input_json: str) -> str:
     """Execute a request with the specified agent"""
     logger.info("Executing agent request")
     
     try:
-        input_data = json.loads(input_json)
+        input_data = decode_payload(input_json)
         request = from_dict(ConversationRequest, input_data["request"])
         
-        # Run the async function in a new event loop
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            response = loop.run_until_complete(routing_service.route_and_execute(request))
-            return json.dumps(to_dict(response))
-        finally:
-            loop.close()
+        # Rebuild a context that was sent as references to earlier versions plus changes
+        base_ref = None
+        if request.context_delta is not None:
+            base_ref = request.context_delta.base_refs[-1] if request.context_delta.base_refs else None
+            request.context = context_store.rehydrate(request.context_delta)
+            request.context_delta = None
+        
+        # Run the async function on the shared activity runtime loop
+        response = await activity_runtime.run_async(services.routing.route_and_execute(request))
+        
+        # Return a reference instead of the context, so it is not copied into every later step's input
+        if input_data.get("context_by_ref") and context_store is not None:
+            response.context_ref = context_store.put(response.context, base_ref)
+            response.context = None
+        
+        return encode_payload(response)
     
     except Exception as ex:
         logger.error(f"Error executing agent request: {ex}")
@@ -72,16 +166,21 @@ def execute_agent_request(ctx, input_json: str) -> str:
             agent_id="system",
             context={"error": str(ex)}
         )
-        return json.dumps(to_dict(response))
+        return encode_payload(response)
 
 def plan_agent_collaboration(ctx, request_json: str) -> str:
     """Plan multi-agent collaboration steps"""
+    return _store_step_contexts(_plan_collaboration_steps(ctx, request_json))
+
+def _plan_collaboration_steps(ctx, request_json: str) -> str:
+    """Build the collaboration plan; pure CPU work that can run in the process pool"""
     logger.info("Planning agent collaboration")
     
     try:
-        request = from_dict(MultiAgentRequest, json.loads(request_json))
+        request = from_dict(MultiAgentRequest, decode_payload(request_json))
         
         steps = []
+        step_indexes = {capability.name: i for i, capability in enumerate(request.required_capabilities)}
         
         # Analyze required capabilities and create collaboration plan
         for capability in request.required_capabilities:
@@ -91,7 +190,8 @@ def plan_agent_collaboration(ctx, request_json: str) -> str:
                 agent_type=selected_agent,
                 description=f"Handle {capability.name}: {capability.description}",
                 prompt=_create_prompt_for_capability(capability, request.task_description),
-                input_context=request.context
+                input_context=request.context,
+                depends_on=_get_step_dependencies(capability, step_indexes)
             )
             
             steps.append(step)
@@ -101,7 +201,7 @@ def plan_agent_collaboration(ctx, request_json: str) -> str:
             steps = _create_general_collaboration_plan(request)
         
         logger.info(f"Created collaboration plan with {len(steps)} steps")
-        return json.dumps([to_dict(step) for step in steps])
+        return encode_payload(steps)
     
     except Exception as ex:
         logger.error(f"Error planning agent collaboration: {ex}")
@@ -110,25 +210,41 @@ def plan_agent_collaboration(ctx, request_json: str) -> str:
         default_step = AgentCollaborationStep(
             agent_type=AgentType.COPILOT_STUDIO,
             description="Handle request with error recovery",
-            prompt=f"Process this request with error handling: {json.loads(request_json).get('task_description', 'Unknown task')}"
+            prompt=f"Process this request with error handling: {decode_payload(request_json).get('task_description', 'Unknown task')}"
         )
-        return json.dumps([to_dict(default_step)])
+        return encode_payload([default_step])
 
-def manage_topic(ctx, request_json: str) -> str:
+def _store_step_contexts(steps_json: str) -> str:
+    """Store the shared input context once rather than copying it into every step"""
+    # Runs in the worker process, since a pool process would write to its own in-memory context store
+    if context_store is None:
+        return steps_json
+    
+    steps = [from_dict(AgentCollaborationStep, data) for data in decode_payload(steps_json)]
+    for step in steps:
+        if step.input_context:
+            step.input_context_ref = context_store.put(step.input_context)
+            step.input_context = None
+    return encode_payload(steps)
+
+def load_agent_contexts(ctx, responses_json: str) -> str:
+    """Fill in the contexts of agent responses that were passed by reference"""
+    responses = [from_dict(AgentResponse, data) for data in decode_payload(responses_json)]
+    for response in responses:
+        if response.context_ref:
+            response.context = context_store.get(response.context_ref)
+    return encode_payload(responses)
+
+async def manage_topic(ctx, request_json: str) -> str:
     """Manage Copilot Studio topics"""
     logger.info("Managing Copilot Studio topic")
     
     try:
-        request = from_dict(TopicManagementRequest, json.loads(request_json))
+        request = from_dict(TopicManagementRequest, decode_payload(request_json))
         
-        # Run the async function in a new event loop
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            response = loop.run_until_complete(_manage_topic_async(request))
-            return json.dumps(to_dict(response))
-        finally:
-            loop.close()
+        # Run the async function on the shared activity runtime loop
+        response = await activity_runtime.run_async(_manage_topic_async(request))
+        return encode_payload(response)
     
     except Exception as ex:
         logger.error(f"Error managing topic: {ex}")
@@ -138,90 +254,128 @@ def manage_topic(ctx, request_json: str) -> str:
             agent_id="topic-manager",
             context={"error": str(ex)}
         )
-        return json.dumps(to_dict(response))
+        return encode_payload(response)
 
-def trigger_power_automate_flow(ctx, request_json: str) -> str:
+async def trigger_power_automate_flow(ctx, request_json: str) -> str:
     """Trigger a Power Automate flow"""
     logger.info("Triggering Power Automate flow")
     
     try:
-        request = from_dict(PowerAutomateFlowRequest, json.loads(request_json))
+        request = from_dict(PowerAutomateFlowRequest, decode_payload(request_json))
         
-        # Run the async function in a new event loop
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            response = loop.run_until_complete(power_platform_service.trigger_power_automate_flow(request))
-            return json.dumps(to_dict(response))
-        finally:
-            loop.close()
+        # Run the async function on the shared activity runtime loop
+        response = await activity_runtime.run_async(services.power_platform.trigger_power_automate_flow(request))
+        return encode_payload(response)
     
     except Exception as ex:
         logger.error(f"Error triggering Power Automate flow: {ex}")
         response = PowerAutomateFlowResponse(
-            flow_id=json.loads(request_json).get("flow_id", ""),
+            flow_id=decode_payload(request_json).get("flow_id", ""),
             run_id="",
             status="Error",
             error_message=str(ex)
         )
-        return json.dumps(to_dict(response))
+        return encode_payload(response)
+
+async def trigger_power_automate_flows(ctx, requests_json: str) -> str:
+    """Trigger a batch of Power Automate flows in one activity, with an error response for each flow that failed"""
+    logger.info("Triggering a batch of Power Automate flows")
+    
+    requests = [from_dict(PowerAutomateFlowRequest, data) for data in decode_payload(requests_json)]
+    responses = await activity_runtime.run_async(services.power_platform.trigger_power_automate_flows(requests))
+    return encode_payload(responses)
+
+async def track_power_automate_flow_run(ctx, input_json: str) -> str:
+    """Register a flow run with the tracker, which raises an event on the orchestration when the run finishes"""
+    input_data = decode_payload(input_json)
+    # Stop polling once the orchestration has given up waiting for the run
+    deadline = input_data.get("deadline")
+    timeout = max(deadline - time.time(), 0.0) if deadline is not None else None
+    await activity_runtime.run_async(services.flow_run_tracker.track(
+        input_data["flow_id"], input_data["run_id"], ctx.orchestration_id, input_data["event_name"], timeout))
+    return encode_payload(True)
+
+async def check_power_automate_flow_run(ctx, input_json: str) -> str:
+    """Get the current status of a flow run, or an Unknown status when the run cannot be found"""
+    input_data = decode_payload(input_json)
+    flow_id, run_id = input_data["flow_id"], input_data["run_id"]
+    try:
+        status = await activity_runtime.run_async(services.flow_run_tracker.check(flow_id, run_id))
+    except Exception as ex:
+        logger.warning(f"Failed to get the status of flow run {run_id}: {ex}")
+        status = None
+    return encode_payload(status or PowerAutomateFlowResponse(flow_id=flow_id, run_id=run_id, status="Unknown"))
 
-def get_environment_info(ctx, input_data: str) -> str:
+def record_speculation_outcome(ctx, paid_off_json: str) -> str:
+    """Count whether a speculative Azure AI execution started by a hybrid orchestration was used"""
+    services.routing.speculation_stats.record(decode_payload(paid_off_json))
+    return encode_payload(True)
+
+async def get_environment_info(ctx, input_data: str) -> str:
     """Get Power Platform environment information"""
     logger.info("Getting Power Platform environment information")
     
     try:
-        # Run the async function in a new event loop
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            environment_info = loop.run_until_complete(power_platform_service.get_environment_info())
-            
-            # Enhance with PAC CLI information
-            pac_info = loop.run_until_complete(pac_service.get_environment_info())
-            if pac_info:
-                environment_info["pacCliInfo"] = pac_info
-            
-            return json.dumps(environment_info)
-        finally:
-            loop.close()
+        if services.catalog.environment:
+            return encode_payload(services.catalog.environment)
+        
+        # Run the async function on the shared activity runtime loop
+        environment_info = await activity_runtime.run_async(services.power_platform.get_environment_info())
+        
+        # Enhance with PAC CLI information
+        pac_info = await activity_runtime.run_async(services.pac.get_environment_info())
+        if pac_info:
+            environment_info["pacCliInfo"] = pac_info
+        
+        return encode_payload(environment_info)
     
     except Exception as ex:
         logger.error(f"Error getting environment information: {ex}")
-        return json.dumps({"error": str(ex)})
+        return encode_payload({"error": str(ex)})
 
-def list_copilot_studio_bots(ctx, input_data: str) -> str:
+async def list_copilot_studio_bots(ctx, input_data: str) -> str:
     """List available Copilot Studio bots"""
     logger.info("Listing Copilot Studio bots")
     
     try:
-        # Run the async function in a new event loop
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            bots = loop.run_until_complete(pac_service.list_copilot_studio_bots())
-            logger.info(f"Found {len(bots)} Copilot Studio bots")
-            return json.dumps(bots)
-        finally:
-            loop.close()
+        if services.catalog.is_loaded:
+            return encode_payload(services.catalog.list_bots())
+        
+        # Run the async function on the shared activity runtime loop
+        bots = await activity_runtime.run_async(services.pac.list_copilot_studio_bots())
+        logger.info(f"Found {len(bots)} Copilot Studio bots")
+        return encode_payload(bots)
     
     except Exception as ex:
         logger.error(f"Error listing Copilot Studio bots: {ex}")
-        return json.dumps([])
+        return encode_payload([])
+
+async def list_copilot_studio_topics(ctx, bot_id_json: str) -> str:
+    """List the topics of a Copilot Studio bot"""
+    bot_id = decode_payload(bot_id_json)
+    logger.info(f"Listing topics of Copilot Studio bot {bot_id}")
+    
+    # Served from the catalog, which fetches them only for bots it has not loaded
+    topics = await activity_runtime.run_async(services.catalog.get_copilot_studio_topics(bot_id))
+    return encode_payload(topics)
 
 # Orchestrator functions
 def hybrid_agent_conversation_orchestrator(ctx, request_json: str) -> str:
     """Orchestrate hybrid agent conversations"""
     logger.info("Starting hybrid agent conversation orchestration")
     
-    request = from_dict(ConversationRequest, json.loads(request_json))
+    request = from_dict(ConversationRequest, decode_payload(request_json))
     logger.info(f"Starting hybrid agent conversation for user {request.user_id}")
     
     try:
-        # Step 1: Determine routing
-        logger.info("Step 1: Determining agent routing")
-        routing_decision_json = yield ctx.call_activity('determine_agent_routing', input=json.dumps(to_dict(request)))
-        routing_decision = from_dict(AgentRoutingDecision, json.loads(routing_decision_json))
+        # Step 1: Determine routing, unless the conversation is sticky to the agent handling its open topic
+        if request.routing_decision is not None:
+            logger.info(f"Step 1: Reusing routing decision for conversation {request.conversation_id}")
+            routing_decision = request.routing_decision
+        else:
+            logger.info("Step 1: Determining agent routing")
+            routing_decision_json = yield ctx.call_activity('determine_agent_routing', input=encode_payload(request))
+            routing_decision = from_dict(AgentRoutingDecision, decode_payload(routing_decision_json))
         
         logger.info(f"Routing decision: {routing_decision.selected_agent.value} (confidence: {routing_decision.confidence})")
         
@@ -230,30 +384,58 @@ def hybrid_agent_conversation_orchestrator(ctx, request_json: str) -> str:
             "request": to_dict(request),
             "routing": to_dict(routing_decision)
         }
-        response_json = yield ctx.call_activity('execute_agent_request', input=json.dumps(input_data))
-        response = from_dict(AgentResponse, json.loads(response_json))
+        execution_task = ctx.call_activity('execute_agent_request', input=encode_payload(input_data))
+        
+        # When routing flagged the decision as uncertain, start the Azure AI escalation speculatively alongside Copilot Studio
+        speculative_task = None
+        if (routing_decision.selected_agent == AgentType.COPILOT_STUDIO
+                and (routing_decision.routing_context or {}).get("speculate")):
+            speculative_request = ConversationRequest(
+                user_id=request.user_id,
+                message=request.message,
+                conversation_id=request.conversation_id,
+                context=request.context,
+                routing_preference=AgentRoutingPreference.AZURE_AI_ONLY
+            )
+            speculative_input = {
+                "request": to_dict(speculative_request),
+                "routing": to_dict(AgentRoutingDecision(AgentType.AZURE_AI, "Speculative escalation", 1.0))
+            }
+            speculative_task = ctx.call_activity('execute_agent_request', input=encode_payload(speculative_input))
+        
+        response_json = yield execution_task
+        response = from_dict(AgentResponse, decode_payload(response_json))
+        response.routing_decision = routing_decision
+        escalated = False
         
         # Step 3: Check if follow-up or escalation is needed
         if response.requires_follow_up and routing_decision.selected_agent == AgentType.COPILOT_STUDIO:
             logger.info("Step 3: Handling follow-up or escalation")
             
             if response.next_action == "escalate":
-                # Escalate to Azure AI
-                escalation_request = ConversationRequest(
-                    user_id=request.user_id,
-                    message=f"Continue conversation: {response.message}. Original request: {request.message}",
-                    conversation_id=response.conversation_id,
-                    context=response.context,
-                    routing_preference=AgentRoutingPreference.AZURE_AI_ONLY
-                )
-                
-                escalation_input = {
-                    "request": to_dict(escalation_request),
-                    "routing": to_dict(AgentRoutingDecision(AgentType.AZURE_AI, "Follow-up escalation", 1.0))
-                }
+                escalated = True
+                escalation_decision = AgentRoutingDecision(AgentType.AZURE_AI, "Follow-up escalation", 1.0)
                 
-                escalation_response_json = yield ctx.call_activity('execute_agent_request', input=json.dumps(escalation_input))
-                escalation_response = from_dict(AgentResponse, json.loads(escalation_response_json))
+                if speculative_task is not None:
+                    # The speculative result is usually complete by now
+                    escalation_response_json = yield speculative_task
+                else:
+                    # Escalate to Azure AI
+                    escalation_request = ConversationRequest(
+                        user_id=request.user_id,
+                        message=f"Continue conversation: {response.message}. Original request: {request.message}",
+                        conversation_id=response.conversation_id,
+                        context=response.context,
+                        routing_preference=AgentRoutingPreference.AZURE_AI_ONLY
+                    )
+                    
+                    escalation_input = {
+                        "request": to_dict(escalation_request),
+                        "routing": to_dict(escalation_decision)
+                    }
+                    
+                    escalation_response_json = yield ctx.call_activity('execute_agent_request', input=encode_payload(escalation_input))
+                escalation_response = from_dict(AgentResponse, decode_payload(escalation_response_json))
                 
                 # Combine responses
                 response = AgentResponse(
@@ -262,11 +444,17 @@ def hybrid_agent_conversation_orchestrator(ctx, request_json: str) -> str:
                     agent_id="hybrid-routing",
                     conversation_id=response.conversation_id,
                     context={**(response.context or {}), **(escalation_response.context or {})},
-                    requires_follow_up=escalation_response.requires_follow_up
+                    requires_follow_up=escalation_response.requires_follow_up,
+                    routing_decision=escalation_decision
                 )
         
+        # An unused speculative result is simply never awaited; the outcome is counted by an activity, so it is
+        # recorded once and the orchestrator itself never touches worker services
+        if speculative_task is not None:
+            yield ctx.call_activity('record_speculation_outcome', input=encode_payload(escalated))
+        
         logger.info(f"Hybrid agent conversation completed for user {request.user_id}")
-        return json.dumps(to_dict(response))
+        return encode_payload(response)
     
     except Exception as ex:
         logger.error(f"Error in hybrid agent conversation for user {request.user_id}: {ex}")
@@ -278,58 +466,83 @@ def hybrid_agent_conversation_orchestrator(ctx, request_json: str) -> str:
             agent_id="system",
             context={"error": str(ex)}
         )
-        return json.dumps(to_dict(error_response))
+        return encode_payload(error_response)
 
 def multi_agent_collaboration_orchestrator(ctx, request_json: str) -> str:
     """Orchestrate multi-agent collaboration scenarios"""
     logger.info("Starting multi-agent collaboration orchestration")
     
-    request = from_dict(MultiAgentRequest, json.loads(request_json))
+    request = from_dict(MultiAgentRequest, decode_payload(request_json))
     logger.info(f"Starting multi-agent collaboration for task: {request.task_description}")
     
-    responses = []
+    step_responses: Dict[int, AgentResponse] = {}
     
     try:
         # Step 1: Plan agent collaboration
-        collaboration_plan_json = yield ctx.call_activity('plan_agent_collaboration', input=json.dumps(to_dict(request)))
-        collaboration_plan = [from_dict(AgentCollaborationStep, step_data) for step_data in json.loads(collaboration_plan_json)]
+        collaboration_plan_json = yield ctx.call_activity('plan_agent_collaboration', input=encode_payload(request))
+        collaboration_plan = [from_dict(AgentCollaborationStep, step_data) for step_data in decode_payload(collaboration_plan_json)]
         
         logger.info(f"Collaboration plan created with {len(collaboration_plan)} steps")
         
-        # Step 2: Execute each step
-        for i, step in enumerate(collaboration_plan):
-            logger.info(f"Executing step {i + 1}: {step.description} with {step.agent_type.value}")
-            
-            step_request = ConversationRequest(
-                user_id=request.user_id,
-                message=step.prompt,
-                context=step.input_context,
-                routing_preference=_get_routing_preference(step.agent_type)
-            )
-            
-            step_input = {
-                "request": to_dict(step_request),
-                "routing": to_dict(AgentRoutingDecision(step.agent_type, step.description, 1.0))
-            }
-            
-            step_response_json = yield ctx.call_activity('execute_agent_request', input=json.dumps(step_input))
-            step_response = from_dict(AgentResponse, json.loads(step_response_json))
-            
-            responses.append(step_response)
+        # Step 2: Execute the plan as a DAG, starting every step as soon as its dependencies complete
+        running: Dict[Any, int] = {}
+        pending = list(range(len(collaboration_plan)))
+        
+        while pending or running:
+            ready = [i for i in pending if all(d in step_responses for d in collaboration_plan[i].depends_on or [])]
+            if not ready and not running:
+                raise ValueError(f"Collaboration plan has unsatisfiable dependencies for steps {pending}")
             
-            # Pass context to next step
-            if i < len(collaboration_plan) - 1:
-                collaboration_plan[i + 1].input_context = {
-                    **(collaboration_plan[i + 1].input_context or {}),
-                    **(step_response.context or {})
+            for i in ready:
+                step = collaboration_plan[i]
+                pending.remove(i)
+                logger.info(f"Executing step {i + 1}: {step.description} with {step.agent_type.value}")
+                
+                # Merge dependency contexts in plan order so the result does not depend on completion order;
+                # contexts held in the context store are passed as references and merged by the activity
+                step_context = dict(step.input_context or {})
+                base_refs = [step.input_context_ref] if step.input_context_ref else []
+                for dependency in sorted(step.depends_on or []):
+                    dependency_response = step_responses[dependency]
+                    if dependency_response.context_ref:
+                        base_refs.append(dependency_response.context_ref)
+                    else:
+                        step_context.update(dependency_response.context or {})
+                
+                step_request = ConversationRequest(
+                    user_id=request.user_id,
+                    message=step.prompt,
+                    context=None if base_refs else step_context,
+                    routing_preference=_get_routing_preference(step.agent_type),
+                    context_delta=ContextDelta(base_refs, step_context) if base_refs else None
+                )
+                
+                step_input = {
+                    "request": to_dict(step_request),
+                    "routing": to_dict(AgentRoutingDecision(step.agent_type, step.description, 1.0)),
+                    "context_by_ref": True
                 }
+                
+                running[ctx.call_activity('execute_agent_request', input=encode_payload(step_input))] = i
+            
+            completed_task = yield task.when_any(list(running))
+            i = running.pop(completed_task)
+            step_responses[i] = from_dict(AgentResponse, decode_payload(completed_task.get_result()))
+        
+        responses = [step_responses[i] for i in range(len(collaboration_plan))]
+        
+        # Contexts passed by reference are loaded once, for the final result
+        if any(response.context_ref for response in responses):
+            responses_json = yield ctx.call_activity('load_agent_contexts', input=encode_payload(responses))
+            responses = [from_dict(AgentResponse, data) for data in decode_payload(responses_json)]
         
         logger.info(f"Multi-agent collaboration completed with {len(responses)} responses")
-        return json.dumps([to_dict(response) for response in responses])
+        return encode_payload(responses)
     
     except Exception as ex:
         logger.error(f"Error in multi-agent collaboration: {ex}")
         
+        responses = [step_responses[i] for i in sorted(step_responses)]
         error_response = AgentResponse(
             message="I encountered an error during the multi-agent collaboration. Please try again.",
             agent_type="Error",
@@ -338,19 +551,19 @@ def multi_agent_collaboration_orchestrator(ctx, request_json: str) -> str:
         )
         responses.append(error_response)
         
-        return json.dumps([to_dict(response) for response in responses])
+        return encode_payload(responses)
 
 def topic_based_conversation_orchestrator(ctx, request_json: str) -> str:
     """Orchestrate topic-based conversations with Copilot Studio"""
     logger.info("Starting topic-based conversation orchestration")
     
-    request = from_dict(TopicManagementRequest, json.loads(request_json))
+    request = from_dict(TopicManagementRequest, decode_payload(request_json))
     logger.info(f"Starting topic-based conversation for topic {request.topic_id}")
     
     try:
         # Execute topic action
-        response_json = yield ctx.call_activity('manage_topic', input=json.dumps(to_dict(request)))
-        response = from_dict(AgentResponse, json.loads(response_json))
+        response_json = yield ctx.call_activity('manage_topic', input=encode_payload(request))
+        response = from_dict(AgentResponse, decode_payload(response_json))
         
         # Check if escalation is needed
         if response.next_action == "escalate":
@@ -368,8 +581,8 @@ def topic_based_conversation_orchestrator(ctx, request_json: str) -> str:
                 "routing": to_dict(AgentRoutingDecision(AgentType.AZURE_AI, "Topic escalation", 1.0))
             }
             
-            escalation_response_json = yield ctx.call_activity('execute_agent_request', input=json.dumps(escalation_input))
-            escalation_response = from_dict(AgentResponse, json.loads(escalation_response_json))
+            escalation_response_json = yield ctx.call_activity('execute_agent_request', input=encode_payload(escalation_input))
+            escalation_response = from_dict(AgentResponse, decode_payload(escalation_response_json))
             
             response = AgentResponse(
                 message=f"{response.message}\n\n[Escalated Response]\n{escalation_response.message}",
@@ -379,7 +592,7 @@ def topic_based_conversation_orchestrator(ctx, request_json: str) -> str:
                 context={**(response.context or {}), **(escalation_response.context or {})}
             )
         
-        return json.dumps(to_dict(response))
+        return encode_payload(response)
     
     except Exception as ex:
         logger.error(f"Error in topic-based conversation for {request.topic_id}: {ex}")
@@ -390,22 +603,75 @@ def topic_based_conversation_orchestrator(ctx, request_json: str) -> str:
             agent_id="system",
             context={"error": str(ex), "topicId": request.topic_id}
         )
-        return json.dumps(to_dict(error_response))
+        return encode_payload(error_response)
+
+def power_automate_flow_orchestrator(ctx, request_json: str) -> str:
+    """Trigger a Power Automate flow and wait for its run to finish"""
+    request = from_dict(PowerAutomateFlowRequest, decode_payload(request_json))
+    
+    response_json = yield ctx.call_activity('trigger_power_automate_flow', input=encode_payload(request))
+    response = from_dict(PowerAutomateFlowResponse, decode_payload(response_json))
+    if not response.run_id or response.status in TERMINAL_RUN_STATUSES:
+        return encode_payload(response)
+    
+    # The shared tracker polls the run and raises this event, so the orchestration just waits. Tracked runs
+    # live in worker memory, so the run is registered again every FLOW_RUN_REARM_INTERVAL seconds
+    event_name = f"flow_run_completed:{response.run_id}"
+    deadline = ctx.current_utc_datetime + timedelta(seconds=FLOW_RUN_TIMEOUT)
+    run_json = encode_payload({
+        "flow_id": request.flow_id,
+        "run_id": response.run_id,
+        "event_name": event_name,
+        "deadline": deadline.replace(tzinfo=timezone.utc).timestamp()
+    })
+    completed_event = ctx.wait_for_external_event(event_name)
+    while True:
+        yield ctx.call_activity('track_power_automate_flow_run', input=run_json)
+        rearm_at = min(ctx.current_utc_datetime + timedelta(seconds=FLOW_RUN_REARM_INTERVAL), deadline)
+        winner = yield task.when_any([completed_event, ctx.create_timer(rearm_at)])
+        if winner == completed_event:
+            return completed_event.get_result()
+        if rearm_at >= deadline:
+            break
+    
+    # The run may have finished without its event getting through, so check once more before giving up
+    status_json = yield ctx.call_activity('check_power_automate_flow_run', input=run_json)
+    status = from_dict(PowerAutomateFlowResponse, decode_payload(status_json))
+    if status.status in TERMINAL_RUN_STATUSES:
+        return encode_payload(status)
+    
+    logger.warning(f"Flow run {response.run_id} did not finish within {FLOW_RUN_TIMEOUT}s")
+    return encode_payload(PowerAutomateFlowResponse(
+        flow_id=request.flow_id,
+        run_id=response.run_id,
+        status="TimedOut",
+        error_message=f"Run did not finish within {FLOW_RUN_TIMEOUT}s"
+    ))
 
 # Helper functions
 def _select_best_agent_for_capability(capability: AgentCapability) -> AgentType:
     """Select the best agent for a given capability"""
-    if (AgentType.COPILOT_STUDIO in capability.supported_by and 
-        ("workflow" in capability.name or "process" in capability.name)):
+    matches = capability_matcher.match(capability.name)
+    
+    if AgentType.COPILOT_STUDIO in capability.supported_by and AgentType.COPILOT_STUDIO in matches:
         return AgentType.COPILOT_STUDIO
     
-    if (AgentType.AZURE_AI in capability.supported_by and 
-        ("analysis" in capability.name or "creative" in capability.name)):
+    if AgentType.AZURE_AI in capability.supported_by and AgentType.AZURE_AI in matches:
         return AgentType.AZURE_AI
     
     # Default to first supported agent
     return capability.supported_by[0] if capability.supported_by else AgentType.COPILOT_STUDIO
 
+def _get_step_dependencies(capability: AgentCapability, step_indexes: Dict[str, int]) -> List[int]:
+    """Map the capabilities a capability depends on to plan step indexes"""
+    dependencies = []
+    for name in capability.depends_on or []:
+        if name in step_indexes and step_indexes[name] != step_indexes[capability.name]:
+            dependencies.append(step_indexes[name])
+        else:
+            logger.warning(f"Ignoring unknown dependency '{name}' of capability {capability.name}")
+    return sorted(set(dependencies))
+
 def _create_prompt_for_capability(capability: AgentCapability, task_description: str) -> str:
     """Create a prompt for a specific capability"""
     return (f"Task: {task_description}\n\n"
@@ -415,7 +681,7 @@ def _create_prompt_for_capability(capability: AgentCapability, task_description:
 
 def _create_general_collaboration_plan(request: MultiAgentRequest) -> List[AgentCollaborationStep]:
     """Create a general collaboration plan when no specific capabilities are provided"""
-    task = request.task_description.lower()
+    matches = collaboration_matcher.match(request.task_description)
     steps = []
     
     # Start with Copilot Studio for structured analysis
@@ -426,19 +692,21 @@ def _create_general_collaboration_plan(request: MultiAgentRequest) -> List[Agent
     ))
     
     # Add Azure AI for complex reasoning if needed
-    if any(keyword in task for keyword in ["complex", "analyze", "creative"]):
+    if AgentType.AZURE_AI in matches:
         steps.append(AgentCollaborationStep(
             agent_type=AgentType.AZURE_AI,
             description="Advanced analysis and recommendations",
-            prompt=f"Provide detailed analysis and recommendations for: {request.task_description}"
+            prompt=f"Provide detailed analysis and recommendations for: {request.task_description}",
+            depends_on=[0]
         ))
     
     # Add Power Automate integration if automation is mentioned
-    if any(keyword in task for keyword in ["automate", "flow", "trigger"]):
+    if AgentType.POWER_AUTOMATE in matches:
         steps.append(AgentCollaborationStep(
             agent_type=AgentType.POWER_AUTOMATE,
             description="Automation workflow",
-            prompt=f"Design automation workflow for: {request.task_description}"
+            prompt=f"Design automation workflow for: {request.task_description}",
+            depends_on=[0]
         ))
     
     return steps
@@ -490,7 +758,7 @@ async def _start_topic(request: TopicManagementRequest) -> AgentResponse:
         variables=request.parameters
     )
     
-    response = await power_platform_service.send_message_to_copilot_studio(copilot_request)
+    response = await services.power_platform.send_message_to_copilot_studio(copilot_request)
     
     return AgentResponse(
         message=response.message,
@@ -512,7 +780,7 @@ async def _continue_topic(request: TopicManagementRequest) -> AgentResponse:
         variables=request.parameters
     )
     
-    response = await power_platform_service.send_message_to_copilot_studio(copilot_request)
+    response = await services.power_platform.send_message_to_copilot_studio(copilot_request)
     
     return AgentResponse(
         message=response.message,
@@ -524,6 +792,35 @@ async def _continue_topic(request: TopicManagementRequest) -> AgentResponse:
         next_action=response.next_topic
     )
 
+async def _shutdown_services(worker: AsyncDurableTaskSchedulerWorker) -> None:
+    """Stop the services the worker used and log their stats"""
+    logger.info(f"Activity scheduling stats: {worker.activity_scheduler.snapshot()}")
+    
+    # Only services that were actually used have anything to stop or report
+    if services.is_created("catalog"):
+        await asyncio.wrap_future(activity_runtime.submit(services.catalog.stop()))
+        logger.info(f"PAC CLI command stats: {services.pac.get_command_stats()}")
+        logger.info(f"Catalog stats: {services.catalog.snapshot()}")
+    if services.is_created("flow_run_tracker"):
+        await asyncio.wrap_future(activity_runtime.submit(services.flow_run_tracker.stop()))
+        logger.info(f"Flow run tracker stats: {services.flow_run_tracker.snapshot()}")
+    if services.is_created("power_platform"):
+        await asyncio.wrap_future(activity_runtime.submit(services.power_platform.close()))
+        logger.info(f"Request coalescing stats: {services.power_platform.get_coalescing_stats()}")
+        logger.info(f"Power Platform rate limits: {services.power_platform.get_rate_limits()}")
+        logger.info(f"Power Platform circuit breakers: {services.power_platform.get_circuit_states()}")
+    if services.is_created("routing"):
+        logger.info(f"Routing decision cache stats: {services.routing.get_routing_cache_stats()}")
+        logger.info(f"Speculative hybrid execution stats: {services.routing.get_speculation_stats()}")
+    if context_store is not None:
+        logger.info(f"Context store stats: {context_store.snapshot()}")
+    if payload_store is not None:
+        logger.info(f"Payload store stats: {payload_store.snapshot()}")
+    if process_pool is not None:
+        process_pool.shutdown()
+        logger.info(f"Process pool stats: {process_pool.snapshot()}")
+    activity_runtime.stop()
+
 async def main():
     """Main entry point for the worker process"""
     logger.info("Starting Copilot Studio Extensibility worker...")
@@ -538,6 +835,7 @@ async def main():
     # Credential handling
     credential = None
     if endpoint != "http://localhost:8080":
+        from azure.identity import DefaultAzureCredential, ManagedIdentityCredential
         try:
             client_id = os.getenv("AZURE_MANAGED_IDENTITY_CLIENT_ID")
             if client_id:
@@ -553,36 +851,71 @@ async def main():
             logger.warning("Continuing without authentication - this may only work with local emulator")
             credential = None
     
-    with DurableTaskSchedulerWorker(
+    global event_client
+    event_client = DurableTaskSchedulerClient(
+        host_address=endpoint,
+        secure_channel=endpoint != "http://localhost:8080",
+        taskhub=taskhub_name,
+        token_credential=credential,
+        payload_store=payload_store
+    )
+    
+    with AsyncDurableTaskSchedulerWorker(
         host_address=endpoint,
         secure_channel=endpoint != "http://localhost:8080",
         taskhub=taskhub_name,
-        token_credential=credential
+        token_credential=credential,
+        payload_store=payload_store,
+        activity_capacity=int(os.getenv("WORKER_ACTIVITY_CAPACITY", "0")) or None
     ) as worker:
         
-        # Register activities
-        worker.add_activity(determine_agent_routing)
-        worker.add_activity(execute_agent_request)
-        worker.add_activity(plan_agent_collaboration)
+        # Register activities; cheap steps that unblock orchestrations run ahead of queued agent calls
+        worker.add_activity(determine_agent_routing, priority=5)
+        worker.add_activity(determine_agent_routing_batch, priority=5)
+        worker.add_activity(execute_agent_request, max_concurrency=int(os.getenv("AGENT_REQUEST_CONCURRENCY", "16")))
+        # Planning is pure CPU work, so it can run outside the worker process
+        planner = (process_pool.wrap(_plan_collaboration_steps, finish=_store_step_contexts, name="plan_agent_collaboration")
+                   if process_pool else plan_agent_collaboration)
+        worker.add_activity(planner, priority=10)
+        worker.add_activity(load_agent_contexts, priority=10)
         worker.add_activity(manage_topic)
         worker.add_activity(trigger_power_automate_flow)
+        worker.add_activity(trigger_power_automate_flows)
+        worker.add_activity(track_power_automate_flow_run, priority=10)
+        worker.add_activity(check_power_automate_flow_run, priority=10)
         worker.add_activity(get_environment_info)
+        worker.add_activity(record_speculation_outcome, priority=10)
         worker.add_activity(list_copilot_studio_bots)
+        worker.add_activity(list_copilot_studio_topics)
         
         # Register orchestrators
         worker.add_orchestrator(hybrid_agent_conversation_orchestrator)
         worker.add_orchestrator(multi_agent_collaboration_orchestrator)
         worker.add_orchestrator(topic_based_conversation_orchestrator)
+        worker.add_orchestrator(power_automate_flow_orchestrator)
         
         # Start the worker
         worker.start()
         
+        cold_start = time.perf_counter() - _import_started
+        cold_start_target = float(os.getenv("WORKER_COLD_START_TARGET", "1.0"))
+        logger.info(f"Worker started in {cold_start:.3f}s, of which {IMPORT_TIME:.3f}s importing modules")
+        if cold_start > cold_start_target:
+            logger.warning(f"Worker cold start of {cold_start:.3f}s exceeded the {cold_start_target}s target")
+        if os.getenv("WORKER_PROFILE_IMPORTS"):
+            for name, seconds in profile_imports("worker"):
+                logger.info(f"Import time {seconds * 1000:8.1f} ms  {name}")
+        
+        # Load the catalog in the background; activities use the network until it is ready
         try:
-            # Keep the worker running
-            while True:
-                await asyncio.sleep(1)
-        except KeyboardInterrupt:
-            logger.info("Worker shutdown initiated")
+            activity_runtime.submit(services.catalog.start())
+        except Exception as ex:
+            logger.warning(f"Catalog not loaded, activities will use the network: {ex}")
+        
+        # Run until SIGTERM or Ctrl+C, then stop fetching work, drain in-flight work and flush stats
+        host = WorkerHost(worker, drain_timeout=float(os.getenv("WORKER_DRAIN_TIMEOUT", "30")))
+        host.on_shutdown(lambda: _shutdown_services(worker))
+        await host.run()
     
     logger.info("Worker stopped")
 
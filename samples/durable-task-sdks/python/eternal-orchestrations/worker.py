@@ -1,4 +1,6 @@
 import os
+import signal
+import threading
 from datetime import timedelta
 import time  
 
@@ -41,5 +43,18 @@ with DurableTaskSchedulerWorker(host_address=endpoint,
 
     w.start()
 
-    while True:
-        time.sleep(1)
\ No newline at end of file
+    # Run until SIGTERM or Ctrl+C
+    stop_requested = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stop_requested.set())
+    stop_requested.wait()
+    print('Worker shutdown initiated, draining in-flight work')
+    drain_started = time.monotonic()
+
+    # Exit if in-flight work has not finished by the deadline; the scheduler redelivers it
+    deadline = threading.Timer(float(os.getenv("WORKER_DRAIN_TIMEOUT", "30")), os._exit, args=(1,))
+    deadline.daemon = True
+    deadline.start()
+    # Leaving the block stops fetching new work and waits for in-flight work to finish
+
+print(f'Worker stopped after draining for {time.monotonic() - drain_started:.2f}s')
\ No newline at end of file
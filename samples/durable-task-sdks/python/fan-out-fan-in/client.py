@@ -10,6 +10,19 @@ from durabletask.azuremanaged.client import DurableTaskSchedulerClient
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def create_payload_store():
+    """Offload payloads above PAYLOAD_OFFLOAD_THRESHOLD bytes to blob storage when PAYLOAD_STORAGE_CONNECTION_STRING is set"""
+    connection_string = os.getenv("PAYLOAD_STORAGE_CONNECTION_STRING")
+    if not connection_string:
+        return None
+    
+    # Works against Azure Storage or Azurite (UseDevelopmentStorage=true); workers and clients must share the store
+    from durabletask.extensions.azure_blob_payloads import BlobPayloadStore, BlobPayloadStoreOptions
+    return BlobPayloadStore(BlobPayloadStoreOptions(
+        connection_string=connection_string,
+        threshold_bytes=int(os.getenv("PAYLOAD_OFFLOAD_THRESHOLD", "262144"))
+    ))
+
 async def main():
     """Main entry point for the client application."""
     logger.info("Starting Fan Out/Fan In pattern client...")
@@ -29,7 +42,8 @@ async def main():
         host_address=endpoint, 
         secure_channel=endpoint != "http://localhost:8080",
         taskhub=taskhub_name, 
-        token_credential=credential
+        token_credential=credential,
+        payload_store=create_payload_store()
     )
     
     # Generate work items (default 10 items if not specified)
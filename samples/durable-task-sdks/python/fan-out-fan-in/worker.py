@@ -1,5 +1,7 @@
 import asyncio
 import logging
+import signal
+import threading
 import random
 import time
 import os
@@ -11,6 +13,19 @@ from durabletask.azuremanaged.worker import DurableTaskSchedulerWorker
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def create_payload_store():
+    """Offload payloads above PAYLOAD_OFFLOAD_THRESHOLD bytes to blob storage when PAYLOAD_STORAGE_CONNECTION_STRING is set"""
+    connection_string = os.getenv("PAYLOAD_STORAGE_CONNECTION_STRING")
+    if not connection_string:
+        return None
+    
+    # Works against Azure Storage or Azurite (UseDevelopmentStorage=true); workers and clients must share the store
+    from durabletask.extensions.azure_blob_payloads import BlobPayloadStore, BlobPayloadStoreOptions
+    return BlobPayloadStore(BlobPayloadStoreOptions(
+        connection_string=connection_string,
+        threshold_bytes=int(os.getenv("PAYLOAD_OFFLOAD_THRESHOLD", "262144"))
+    ))
+
 # Activity function
 def process_work_item(ctx, item: int) -> dict:
     """
@@ -61,6 +76,27 @@ def fan_out_fan_in_orchestrator(ctx, work_items: list) -> dict:
     
     return final_result
 
+def wait_for_shutdown_signal():
+    """Return an event that SIGTERM or Ctrl+C sets"""
+    stop_requested = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop_requested.set)
+    return stop_requested
+
+def arm_drain_deadline():
+    """Exit if in-flight work has not finished within WORKER_DRAIN_TIMEOUT seconds; the scheduler redelivers it"""
+    timeout = float(os.getenv("WORKER_DRAIN_TIMEOUT", "30"))
+    
+    def deadline_exceeded():
+        logger.warning(f"In-flight work did not finish within {timeout}s, exiting")
+        logging.shutdown()
+        os._exit(1)
+    
+    timer = threading.Timer(timeout, deadline_exceeded)
+    timer.daemon = True
+    timer.start()
+
 async def main():
     """Main entry point for the worker process."""
     logger.info("Starting Fan Out/Fan In pattern worker...")
@@ -80,7 +116,8 @@ async def main():
         host_address=endpoint, 
         secure_channel=endpoint != "http://localhost:8080",
         taskhub=taskhub_name, 
-        token_credential=credential
+        token_credential=credential,
+        payload_store=create_payload_store()
     ) as worker:
         
         # Register activities and orchestrators
@@ -91,14 +128,14 @@ async def main():
         # Start the worker (without awaiting)
         worker.start()
         
-        try:
-            # Keep the worker running
-            while True:
-                await asyncio.sleep(1)
-        except KeyboardInterrupt:
-            logger.info("Worker shutdown initiated")
+        # Run until SIGTERM or Ctrl+C
+        await wait_for_shutdown_signal().wait()
+        logger.info("Worker shutdown initiated, draining in-flight work")
+        drain_started = time.monotonic()
+        arm_drain_deadline()
+        # Leaving the block stops fetching new work and waits for in-flight work to finish
             
-    logger.info("Worker stopped")
+    logger.info(f"Worker stopped after draining for {time.monotonic() - drain_started:.2f}s")
 
 if __name__ == "__main__":
     asyncio.run(main())
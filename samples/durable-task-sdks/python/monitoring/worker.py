@@ -1,6 +1,8 @@
 import asyncio
 import datetime
 import logging
+import signal
+import threading
 import time
 import os
 from azure.identity import DefaultAzureCredential
@@ -102,6 +104,27 @@ def monitoring_job_orchestrator(ctx, job_data: dict) -> dict:
         "monitoring_duration_seconds": (ctx.current_utc_datetime - start_time).total_seconds()
     }
 
+def wait_for_shutdown_signal():
+    """Return an event that SIGTERM or Ctrl+C sets"""
+    stop_requested = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop_requested.set)
+    return stop_requested
+
+def arm_drain_deadline():
+    """Exit if in-flight work has not finished within WORKER_DRAIN_TIMEOUT seconds; the scheduler redelivers it"""
+    timeout = float(os.getenv("WORKER_DRAIN_TIMEOUT", "30"))
+    
+    def deadline_exceeded():
+        logger.warning(f"In-flight work did not finish within {timeout}s, exiting")
+        logging.shutdown()
+        os._exit(1)
+    
+    timer = threading.Timer(timeout, deadline_exceeded)
+    timer.daemon = True
+    timer.start()
+
 async def main():
     """Main entry point for the worker process."""
     logger.info("Starting Monitoring pattern worker...")
@@ -131,14 +154,14 @@ async def main():
         # Start the worker (without awaiting)
         worker.start()
         
-        try:
-            # Keep the worker running
-            while True:
-                await asyncio.sleep(1)
-        except KeyboardInterrupt:
-            logger.info("Worker shutdown initiated")
+        # Run until SIGTERM or Ctrl+C
+        await wait_for_shutdown_signal().wait()
+        logger.info("Worker shutdown initiated, draining in-flight work")
+        drain_started = time.monotonic()
+        arm_drain_deadline()
+        # Leaving the block stops fetching new work and waits for in-flight work to finish
             
-    logger.info("Worker stopped")
+    logger.info(f"Worker stopped after draining for {time.monotonic() - drain_started:.2f}s")
 
 if __name__ == "__main__":
     asyncio.run(main())